@@ -0,0 +1,411 @@
+"""
+Benchmarks executing the builtin templates on a thread pool, against executing them on a
+single thread, on a generated project.
+
+Threads only speed templates up on free-threaded Python. To compare against the GIL, run it
+with a free-threaded interpreter, once with the GIL turned back on:
+
+    PYTHON_GIL=1 python3.13t benchmarks/template_threads.py
+    PYTHON_GIL=0 python3.13t benchmarks/template_threads.py
+
+Or `make benchmark PYTHON=python3.13t`.
+"""
+
+import argparse
+import concurrent.futures
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+benchmark_parser = argparse.ArgumentParser(description=__doc__)
+benchmark_parser.add_argument(
+    "--units", type=int, default=64, help="Source units to generate (default: 64)"
+)
+benchmark_parser.add_argument(
+    "--functions",
+    type=int,
+    default=40,
+    help="Functions per generated contract (default: 40)",
+)
+benchmark_parser.add_argument(
+    "--repeat", type=int, default=3, help="Runs per mode, the median is kept"
+)
+benchmark_args = benchmark_parser.parse_args()
+
+# eburger parses the command line when it's imported
+sys.argv = sys.argv[:1]
+from eburger import settings, yaml_parser  # noqa: E402
+from eburger.utils.cli_args import args  # noqa: E402
+from eburger.utils.helpers import get_cpu_count, is_free_threaded  # noqa: E402
+
+
+class SourceBuilder:
+    """
+    Writes the Solidity source of a generated source unit, line by line, handing out the src
+    attribute of each line for the AST nodes generated along.
+    """
+
+    def __init__(self, file_index: int):
+        self.file_index = file_index
+        self.text = ""
+        self.node_id = file_index * 1_000_000
+
+    def next_id(self) -> int:
+        self.node_id += 1
+        return self.node_id
+
+    def line(self, code: str, indent: int = 0) -> str:
+        start = len(self.text) + indent * 4
+        self.text += " " * (indent * 4) + code + "\n"
+        return f"{start}:{len(code)}:{self.file_index}"
+
+
+def identifier(builder: SourceBuilder, name: str, type_string: str, src: str, **node):
+    return {
+        "id": builder.next_id(),
+        "nodeType": "Identifier",
+        "name": name,
+        "src": src,
+        "typeDescriptions": {"typeString": type_string},
+        **node,
+    }
+
+
+def generate_function(builder: SourceBuilder, index: int, state_ids: dict) -> dict:
+    function_src = builder.line(
+        f"function move{index}(address to, uint256 amount) public {{", 1
+    )
+    transfer_src = builder.line("token.transfer(to, amount);", 2)
+    assignment_src = builder.line("balance = amount;", 2)
+    loop_src = builder.line("for (uint256 k = 0; k < balance; k++) {}", 2)
+    emit_src = builder.line("emit Moved(amount);", 2)
+    builder.line("}", 1)
+
+    parameters = [
+        {
+            "id": builder.next_id(),
+            "nodeType": "VariableDeclaration",
+            "name": name,
+            "src": function_src,
+            "stateVariable": False,
+            "typeDescriptions": {"typeString": type_string},
+        }
+        for name, type_string in [("to", "address"), ("amount", "uint256")]
+    ]
+    to_id, amount_id = (parameter["id"] for parameter in parameters)
+    loop_variable_id = builder.next_id()
+
+    statements = [
+        {
+            "id": builder.next_id(),
+            "nodeType": "ExpressionStatement",
+            "src": transfer_src,
+            "expression": {
+                "id": builder.next_id(),
+                "nodeType": "FunctionCall",
+                "kind": "functionCall",
+                "src": transfer_src,
+                "expression": {
+                    "id": builder.next_id(),
+                    "nodeType": "MemberAccess",
+                    "memberName": "transfer",
+                    "src": transfer_src,
+                    "expression": identifier(
+                        builder,
+                        "token",
+                        "contract IERC20",
+                        transfer_src,
+                        referencedDeclaration=state_ids["token"],
+                    ),
+                    "typeDescriptions": {
+                        "typeString": "function (address,uint256) external returns (bool)"
+                    },
+                },
+                "arguments": [
+                    identifier(
+                        builder,
+                        "to",
+                        "address",
+                        transfer_src,
+                        referencedDeclaration=to_id,
+                    ),
+                    identifier(
+                        builder,
+                        "amount",
+                        "uint256",
+                        transfer_src,
+                        referencedDeclaration=amount_id,
+                    ),
+                ],
+                "typeDescriptions": {"typeString": "bool"},
+            },
+        },
+        {
+            "id": builder.next_id(),
+            "nodeType": "ExpressionStatement",
+            "src": assignment_src,
+            "expression": {
+                "id": builder.next_id(),
+                "nodeType": "Assignment",
+                "operator": "=",
+                "src": assignment_src,
+                "leftHandSide": identifier(
+                    builder,
+                    "balance",
+                    "uint256",
+                    assignment_src,
+                    referencedDeclaration=state_ids["balance"],
+                ),
+                "rightHandSide": identifier(
+                    builder,
+                    "amount",
+                    "uint256",
+                    assignment_src,
+                    referencedDeclaration=amount_id,
+                ),
+                "typeDescriptions": {"typeString": "uint256"},
+            },
+        },
+        {
+            "id": builder.next_id(),
+            "nodeType": "ForStatement",
+            "src": loop_src,
+            "initializationExpression": {
+                "id": builder.next_id(),
+                "nodeType": "VariableDeclarationStatement",
+                "src": loop_src,
+                "declarations": [
+                    {
+                        "id": loop_variable_id,
+                        "nodeType": "VariableDeclaration",
+                        "name": "k",
+                        "src": loop_src,
+                        "stateVariable": False,
+                        "typeDescriptions": {"typeString": "uint256"},
+                    }
+                ],
+            },
+            "condition": {
+                "id": builder.next_id(),
+                "nodeType": "BinaryOperation",
+                "operator": "<",
+                "src": loop_src,
+                "leftExpression": identifier(
+                    builder,
+                    "k",
+                    "uint256",
+                    loop_src,
+                    referencedDeclaration=loop_variable_id,
+                ),
+                "rightExpression": identifier(
+                    builder,
+                    "balance",
+                    "uint256",
+                    loop_src,
+                    referencedDeclaration=state_ids["balance"],
+                ),
+                "typeDescriptions": {"typeString": "bool"},
+            },
+            "loopExpression": {
+                "id": builder.next_id(),
+                "nodeType": "ExpressionStatement",
+                "src": loop_src,
+                "expression": {
+                    "id": builder.next_id(),
+                    "nodeType": "UnaryOperation",
+                    "operator": "++",
+                    "src": loop_src,
+                    "subExpression": identifier(
+                        builder,
+                        "k",
+                        "uint256",
+                        loop_src,
+                        referencedDeclaration=loop_variable_id,
+                    ),
+                },
+            },
+            "body": {
+                "id": builder.next_id(),
+                "nodeType": "Block",
+                "src": loop_src,
+                "statements": [],
+            },
+        },
+        {
+            "id": builder.next_id(),
+            "nodeType": "EmitStatement",
+            "src": emit_src,
+            "eventCall": {
+                "id": builder.next_id(),
+                "nodeType": "FunctionCall",
+                "kind": "functionCall",
+                "src": emit_src,
+                "expression": identifier(
+                    builder,
+                    "Moved",
+                    "function (uint256)",
+                    emit_src,
+                    referencedDeclaration=state_ids["Moved"],
+                ),
+                "arguments": [
+                    identifier(
+                        builder,
+                        "amount",
+                        "uint256",
+                        emit_src,
+                        referencedDeclaration=amount_id,
+                    )
+                ],
+            },
+        },
+    ]
+
+    return {
+        "id": builder.next_id(),
+        "nodeType": "FunctionDefinition",
+        "name": f"move{index}",
+        "kind": "function",
+        "visibility": "public",
+        "stateMutability": "nonpayable",
+        "implemented": True,
+        "src": function_src,
+        "modifiers": [],
+        "parameters": {
+            "id": builder.next_id(),
+            "nodeType": "ParameterList",
+            "src": function_src,
+            "parameters": parameters,
+        },
+        "returnParameters": {
+            "id": builder.next_id(),
+            "nodeType": "ParameterList",
+            "src": function_src,
+            "parameters": [],
+        },
+        "body": {
+            "id": builder.next_id(),
+            "nodeType": "Block",
+            "src": function_src,
+            "statements": statements,
+        },
+    }
+
+
+def generate_source_unit(file_index: int, functions: int) -> tuple[dict, str]:
+    builder = SourceBuilder(file_index)
+    pragma_src = builder.line("pragma solidity ^0.8.0;")
+    contract_src = builder.line(f"contract Vault{file_index} {{")
+    state_variables = [
+        ("token", "contract IERC20", builder.line("IERC20 token;", 1)),
+        ("balance", "uint256", builder.line("uint256 balance;", 1)),
+    ]
+    event_src = builder.line("event Moved(uint256 amount);", 1)
+
+    contract_nodes = [
+        {
+            "id": builder.next_id(),
+            "nodeType": "VariableDeclaration",
+            "name": name,
+            "src": src,
+            "stateVariable": True,
+            "constant": False,
+            "mutability": "mutable",
+            "typeDescriptions": {"typeString": type_string},
+        }
+        for name, type_string, src in state_variables
+    ]
+    contract_nodes.append(
+        {
+            "id": builder.next_id(),
+            "nodeType": "EventDefinition",
+            "name": "Moved",
+            "src": event_src,
+        }
+    )
+    state_ids = {node["name"]: node["id"] for node in contract_nodes}
+    contract_nodes += [
+        generate_function(builder, index, state_ids) for index in range(functions)
+    ]
+    builder.line("}")
+
+    source_unit = {
+        "id": builder.next_id(),
+        "nodeType": "SourceUnit",
+        "absolutePath": f"src/Vault{file_index}.sol",
+        "src": f"0:{len(builder.text)}:{file_index}",
+        "nodes": [
+            {
+                "id": builder.next_id(),
+                "nodeType": "PragmaDirective",
+                "literals": ["solidity", "^", "0.8", ".0"],
+                "src": pragma_src,
+            },
+            {
+                "id": builder.next_id(),
+                "nodeType": "ContractDefinition",
+                "name": f"Vault{file_index}",
+                "contractKind": "contract",
+                "abstract": False,
+                "baseContracts": [],
+                "src": contract_src,
+                "nodes": contract_nodes,
+            },
+        ],
+    }
+    return source_unit, builder.text
+
+
+def run_templates(ast_data: list, src_paths: list, threads: int) -> float:
+    create_thread_pool = yaml_parser.create_thread_pool
+    if threads == 1:
+        yaml_parser.create_thread_pool = lambda: concurrent.futures.ThreadPoolExecutor(
+            max_workers=1
+        )
+    try:
+        start = time.perf_counter()
+        yaml_parser.process_files_concurrently(ast_data, src_paths)
+        return time.perf_counter() - start
+    finally:
+        yaml_parser.create_thread_pool = create_thread_pool
+
+
+def main():
+    args.no = ["info", "warning", "success", "insights"]
+
+    with tempfile.TemporaryDirectory() as project_root:
+        settings.project_root = Path(project_root)
+        settings.outputs_dir = settings.project_root / ".eburger"
+        ast_data = []
+        src_paths = []
+        for file_index in range(benchmark_args.units):
+            source_unit, source = generate_source_unit(
+                file_index, benchmark_args.functions
+            )
+            src_path = source_unit["absolutePath"]
+            (settings.project_root / src_path).parent.mkdir(exist_ok=True)
+            (settings.project_root / src_path).write_text(source)
+            ast_data.append(source_unit)
+            src_paths.append(src_path)
+
+        gil = "disabled" if is_free_threaded() else "enabled"
+        print(
+            f"Python {sys.version.split()[0]}, GIL {gil}, {get_cpu_count()} cores, "
+            f"{benchmark_args.units} source units of {benchmark_args.functions} functions"
+        )
+        # Warms up the templates cache, so both modes load compiled templates
+        run_templates(ast_data, src_paths, 1)
+
+        timings = {}
+        for mode, threads in [("1 thread", 1), ("thread pool", None)]:
+            timings[mode] = statistics.median(
+                run_templates(ast_data, src_paths, threads)
+                for _ in range(benchmark_args.repeat)
+            )
+            print(f"{mode:>12}: {timings[mode]:.3f}s")
+        print(f"     speedup: {timings['1 thread'] / timings['thread pool']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,730 @@
+import heapq
+import re
+import threading
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator, Union
+
+from eburger.compact_ast import CompactAST, CompactSourceUnits, decode_src
+from eburger.profiler import count_visited_nodes
+
+# Stack marker for leaving a node during the index walk
+_EXIT = object()
+
+
+class NodesView(Sequence):
+    """
+    Read-only, copy-free view over a slice of a list of AST nodes (e.g. a Block's statements[1:]).
+
+    Every query helper accepts a view as its search root, so templates can scope searches
+    without cloning any AST data.
+    """
+
+    __slots__ = ("_items", "_range")
+
+    def __init__(self, items: list, start: int = None, stop: int = None):
+        if isinstance(items, NodesView):
+            self._items = items._items
+            self._range = items._range[start:stop]
+        else:
+            self._items = items
+            self._range = range(len(items))[start:stop]
+
+    def __len__(self) -> int:
+        return len(self._range)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                return [self._items[i] for i in self._range[index]]
+            return NodesView(self, index.start, index.stop)
+        return self._items[self._range[index]]
+
+    def __iter__(self):
+        items = self._items
+        for i in self._range:
+            yield items[i]
+
+    def __repr__(self) -> str:
+        return f"NodesView({list(self)!r})"
+
+
+class AnalysisContext:
+    """
+    Per-run lookup structures over the analyzed AST.
+
+    The indexes are built lazily in a single walk, the first time a template queries them,
+    and are then shared by every template executed against the same AST.
+    Templates must not mutate the indexed AST, clone nodes (deep_clone_node) when needed.
+
+    Every dict of the AST is numbered in the order a recursive depth-first walk enters it,
+    and the number following its last descendant is kept as well, so any subtree is a
+    contiguous [start, end) range of positions. Queries scoped to a subtree are bisect
+    lookups over the sorted per-type position lists, with no traversal.
+    """
+
+    def __init__(self, ast_data: Union[dict, list]):
+        self.ast_data = ast_data
+        self._lock = threading.Lock()
+        self._indexed = False
+
+        # Every dict of the AST, by position (enter order)
+        self._nodes = []
+        # id() of a dict -> its position
+        self._positions = {}
+        # Position following the last descendant of each dict (exit order)
+        self._ends = []
+        # Position of the closest enclosing dict, -1 for the root
+        self._parents = []
+        # nodeType -> sorted list of positions
+        self._type_positions = {}
+        # Node "id" value -> position of the first dict carrying it
+        self._id_positions = {}
+        # typeDescriptions.typeString -> sorted list of positions
+        self._type_string_positions = {}
+        # Decoded "start:length:fileIndex" src attributes by position, -1 when missing
+        self._src_starts = array("q")
+        self._src_lengths = array("q")
+        self._src_files = array("i")
+        # Regex pattern -> sorted positions of nodes whose typeString matches it
+        self._regex_positions = {}
+        # (nodeType, key) -> {value: sorted list of positions}, built on first use
+        self._attribute_positions = {}
+        # Positions of the top-level dicts of ast_data, built on first use
+        self._root_positions = None
+        # The run's memoized facts registry, see eburger.facts
+        self.facts = None
+        # Runs using the context, see use_analysis_context
+        self._users = 0
+
+    def ensure_index(self):
+        """
+        Builds the indexes if they weren't built yet, safe to call from multiple threads.
+        """
+        if self._indexed:
+            return
+        with self._lock:
+            if not self._indexed:
+                self._build_index()
+                self._indexed = True
+
+    def _build_index(self):
+        if isinstance(self.ast_data, CompactSourceUnits):
+            self._adopt_compact_index()
+            return
+
+        nodes = self._nodes
+        positions = self._positions
+        ends = self._ends
+        parents = self._parents
+        type_positions = self._type_positions
+        id_positions = self._id_positions
+        type_string_positions = self._type_string_positions
+        src_starts = self._src_starts
+        src_lengths = self._src_lengths
+        src_files = self._src_files
+
+        stack = [(self.ast_data, -1)]
+        while stack:
+            current, parent = stack.pop()
+            if current is _EXIT:
+                ends[parent] = len(nodes)
+                continue
+
+            if isinstance(current, dict):
+                position = len(nodes)
+                nodes.append(current)
+                positions[id(current)] = position
+                ends.append(position + 1)
+                parents.append(parent)
+
+                node_type = current.get("nodeType")
+                if node_type is not None:
+                    type_positions.setdefault(node_type, []).append(position)
+
+                node_id = current.get("id")
+                if node_id is not None and node_id not in id_positions:
+                    id_positions[node_id] = position
+
+                src_start, src_length, src_file = decode_src(current.get("src"))
+                src_starts.append(src_start)
+                src_lengths.append(src_length)
+                src_files.append(src_file)
+
+                type_string = get_type_string(current)
+                if type_string:
+                    type_string_positions.setdefault(type_string, []).append(position)
+
+                stack.append((_EXIT, position))
+                children = current.values()
+                parent = position
+            else:
+                children = current
+
+            # Pushed in reverse so children are visited in their original order
+            stack.extend(
+                (child, parent)
+                for child in reversed(list(children))
+                if isinstance(child, (dict, list))
+            )
+
+    def adopt_root_indexes(self, root_contexts: list):
+        """
+        Builds the indexes out of the indexes of each top-level node of ast_data, built on
+        its own (e.g. source units indexed as they were decoded), rather than walking the AST
+        again. Nothing is adopted if the indexes were already built.
+
+        :param root_contexts: The indexed context of [root] for each root of ast_data, in order.
+        """
+        if len(root_contexts) != len(self.ast_data) or any(
+            len(context.ast_data) != 1 or context.ast_data[0] is not root
+            for context, root in zip(root_contexts, self.ast_data)
+        ):
+            raise ValueError("Expected an indexed context per top-level node")
+
+        with self._lock:
+            if self._indexed:
+                return
+            for context in root_contexts:
+                context.ensure_index()
+                offset = len(self._nodes)
+                self._nodes.extend(context._nodes)
+                self._positions.update(
+                    (key, position + offset)
+                    for key, position in context._positions.items()
+                )
+                self._ends.extend(end + offset for end in context._ends)
+                # Top-level nodes keep -1
+                self._parents.extend(
+                    parent + offset if parent >= 0 else parent
+                    for parent in context._parents
+                )
+                for key_positions, root_key_positions in [
+                    (self._type_positions, context._type_positions),
+                    (self._type_string_positions, context._type_string_positions),
+                ]:
+                    for key, positions in root_key_positions.items():
+                        key_positions.setdefault(key, []).extend(
+                            position + offset for position in positions
+                        )
+                for node_id, position in context._id_positions.items():
+                    self._id_positions.setdefault(node_id, position + offset)
+                self._src_starts.extend(context._src_starts)
+                self._src_lengths.extend(context._src_lengths)
+                self._src_files.extend(context._src_files)
+            self._indexed = True
+
+    def _adopt_compact_index(self):
+        """
+        A CompactAST already holds the index columns, nodes are materialized on access.
+        """
+        compact = self.ast_data.compact
+        self._nodes = compact
+        self._positions = compact.positions
+        self._ends = compact.ends
+        self._parents = compact.parents
+        self._type_positions = compact.type_positions
+        self._id_positions = compact.id_positions
+        self._type_string_positions = compact.type_string_positions
+        self._src_starts = compact.src_starts
+        self._src_lengths = compact.src_lengths
+        self._src_files = compact.src_files
+
+    def src_arrays(self) -> tuple[array, array, array]:
+        """
+        Returns the decoded src attributes of every indexed dict, by position.
+
+        The arrays support the buffer protocol, so they can be wrapped without copies for
+        vectorized operations, e.g. numpy.frombuffer(starts, dtype=numpy.int64).
+
+        :return: (starts, lengths, file indexes) arrays, with -1 values where src is missing.
+        """
+        self.ensure_index()
+        return self._src_starts, self._src_lengths, self._src_files
+
+    def src_location(self, node: dict) -> Union[tuple[int, int, int], None]:
+        """
+        Returns the decoded src attribute of an indexed node.
+
+        :param node: An indexed node.
+        :return: A (start, length, file index) tuple, or None if node isn't indexed.
+        """
+        position = self._position_of(node)
+        if position is None:
+            return None
+        return (
+            self._src_starts[position],
+            self._src_lengths[position],
+            self._src_files[position],
+        )
+
+    def covers(self, root: Union[dict, list]) -> bool:
+        """
+        Checks whether a node, or every node in a list, is part of the indexed AST.
+
+        Only looks the nodes up, the indexes aren't built for it.
+
+        :param root: A node or a list of nodes.
+        :return: True if queries scoped to root can be answered from the index, False if
+        the indexes weren't built yet.
+        """
+        return self._indexed and self._ranges_of(root) is not None
+
+    def _position_of(self, node: dict) -> Union[int, None]:
+        self.ensure_index()
+        if isinstance(self._nodes, CompactAST):
+            # Its source units may have been materialized again since node was returned
+            return self._nodes.position_of(node)
+        position = self._positions.get(id(node))
+        if position is None or self._nodes[position] is not node:
+            return None
+        return position
+
+    def _ranges_of(self, root: Union[dict, list, None]) -> Union[list, None]:
+        """
+        Resolves a search root to the position ranges its walk would visit, in walk order.
+        """
+        self.ensure_index()
+        if root is None or root is self.ast_data:
+            return [(0, len(self._nodes))]
+
+        if isinstance(root, dict):
+            position = self._position_of(root)
+            if position is None:
+                return None
+            return [(position, self._ends[position])]
+
+        if isinstance(root, (list, NodesView)):
+            ranges = []
+            for item in root:
+                if isinstance(item, (dict, list)):
+                    item_ranges = self._ranges_of(item)
+                    if item_ranges is None:
+                        return None
+                    for start, end in item_ranges:
+                        # Sibling subtrees are adjacent, so slices of a node list collapse into one range
+                        if ranges and ranges[-1][1] == start:
+                            ranges[-1] = (ranges[-1][0], end)
+                        else:
+                            ranges.append((start, end))
+            return ranges
+
+        return None
+
+    def _positions_in(self, buckets: list, root: Union[dict, list, None]):
+        """
+        Narrows sorted position lists down to the subtree(s) of root.
+
+        :return: Matching positions in walk order, or None if root isn't indexed.
+        """
+        ranges = self._ranges_of(root)
+        if ranges is None:
+            return None
+        # The subtrees the lookup stands in for walking
+        count_visited_nodes(sum(end - start for start, end in ranges))
+
+        positions = []
+        for start, end in ranges:
+            sliced_buckets = []
+            for bucket in buckets:
+                low = bisect_left(bucket, start)
+                high = bisect_left(bucket, end, low)
+                if low < high:
+                    sliced_buckets.append(bucket[low:high])
+            if len(sliced_buckets) == 1:
+                positions.extend(sliced_buckets[0])
+            elif sliced_buckets:
+                positions.extend(heapq.merge(*sliced_buckets))
+        return positions
+
+    def nodes_by_types(
+        self, node_types: list, root: Union[dict, list] = None
+    ) -> Union[list, None]:
+        """
+        Returns all nodes of the given types, in AST walk order.
+
+        :param node_types: List of nodeType values.
+        :param root: Node or list of nodes to scope the search to, the whole AST by default.
+        :return: A new list of matching nodes, or None if root isn't indexed.
+        """
+        self.ensure_index()
+        buckets = [
+            self._type_positions[node_type]
+            for node_type in dict.fromkeys(node_types)
+            if node_type in self._type_positions
+        ]
+        positions = self._positions_in(buckets, root)
+        if positions is None:
+            return None
+        nodes = self._nodes
+        return [nodes[position] for position in positions]
+
+    def nodes_by_attribute(
+        self,
+        node_types: list,
+        key: str,
+        value,
+        root: Union[dict, list] = None,
+    ) -> Union[list, None]:
+        """
+        Returns all nodes of the given types whose key equals value, in AST walk order.
+
+        A (nodeType, key) -> value index is built the first time a pair is queried, so
+        repeated filtered lookups don't go over every node of the type again.
+
+        :param node_types: List of nodeType values.
+        :param key: The JSON key to filter by.
+        :param value: The value key must be equal to.
+        :param root: Node or list of nodes to scope the search to, the whole AST by default.
+        :return: A new list of matching nodes, or None if value is unhashable or root isn't indexed.
+        """
+        try:
+            hash(value)
+        except TypeError:
+            return None
+
+        buckets = []
+        for node_type in dict.fromkeys(node_types):
+            bucket = self._attribute_index(node_type, key).get(value)
+            if bucket:
+                buckets.append(bucket)
+        positions = self._positions_in(buckets, root)
+        if positions is None:
+            return None
+        nodes = self._nodes
+        return [nodes[position] for position in positions]
+
+    def _attribute_index(self, node_type: str, key: str) -> dict:
+        self.ensure_index()
+        attribute_index = self._attribute_positions.get((node_type, key))
+        if attribute_index is not None:
+            return attribute_index
+
+        with self._lock:
+            attribute_index = self._attribute_positions.get((node_type, key))
+            if attribute_index is None:
+                attribute_index = {}
+                nodes = self._nodes
+                # Compact ASTs hold integer ids in a column, no need to materialize them
+                node_ids = None
+                if key == "id" and isinstance(nodes, CompactAST):
+                    node_ids = nodes.node_ids
+                for position in self._type_positions.get(node_type, []):
+                    if node_ids is not None and node_ids[position] >= 0:
+                        value = node_ids[position]
+                    else:
+                        value = nodes[position].get(key)
+                    try:
+                        attribute_index.setdefault(value, []).append(position)
+                    except TypeError:
+                        # Unhashable values (lists, dicts) can only be filtered by a walk
+                        continue
+                self._attribute_positions[(node_type, key)] = attribute_index
+        return attribute_index
+
+    def nodes_by_type_string(
+        self, pattern: str, use_regex: bool = False, root: Union[dict, list] = None
+    ) -> Union[list, None]:
+        """
+        Returns all nodes whose typeDescriptions.typeString matches, in AST walk order.
+
+        Regex patterns are evaluated once per distinct typeString, and the matching
+        positions are cached for later queries with the same pattern.
+
+        :param pattern: The typeString, or a regex searched in it.
+        :param use_regex: Whether or not pattern is a regex.
+        :param root: Node or list of nodes to scope the search to, the whole AST by default.
+        :return: A new list of matching nodes, or None if root isn't indexed.
+        """
+        self.ensure_index()
+        if use_regex:
+            bucket = self._regex_positions.get(pattern)
+            if bucket is None:
+                matching_buckets = [
+                    type_string_positions
+                    for type_string, type_string_positions in self._type_string_positions.items()
+                    if type_string_matches(pattern, type_string)
+                ]
+                bucket = list(heapq.merge(*matching_buckets))
+                self._regex_positions[pattern] = bucket
+        else:
+            bucket = self._type_string_positions.get(pattern, [])
+        positions = self._positions_in([bucket], root)
+        if positions is None:
+            return None
+        nodes = self._nodes
+        return [nodes[position] for position in positions]
+
+    def node_by_id(
+        self, node_id: int, root: Union[dict, list] = None
+    ) -> Union[dict, None]:
+        """
+        Returns the first node carrying the given id.
+
+        :param node_id: The "id" value of the node.
+        :param root: Node or list of nodes to scope the search to, the whole AST by default.
+        :return: The node, or None if no node has this id.
+        """
+        self.ensure_index()
+        position = self._id_positions.get(node_id)
+        if (
+            position is None
+            or _range_containing(self._ranges_of(root), position) is None
+        ):
+            return None
+        return self._nodes[position]
+
+    def parent_of(
+        self, node: dict, root: Union[dict, list] = None
+    ) -> Union[dict, None]:
+        """
+        Returns the closest dict enclosing the given node.
+
+        :param node: An indexed node.
+        :param root: Node or list of nodes to scope the search to, the whole AST by default.
+        :return: The parent node, or None for the root or non indexed nodes.
+        """
+        return self.first_parent_of_type(node, None, root)
+
+    def ancestors_of(self, node: dict) -> Iterator[dict]:
+        """
+        Lazily walks up the enclosing dicts of an indexed node, closest first.
+
+        :param node: An indexed node.
+        :return: A generator of ancestor nodes, empty for non indexed nodes.
+        """
+        position = self._position_of(node)
+        if position is None:
+            return
+        position = self._parents[position]
+        while position >= 0:
+            yield self._nodes[position]
+            position = self._parents[position]
+
+    def is_within(self, node: dict, root: dict) -> bool:
+        """
+        Checks whether an indexed node is root or one of its descendants.
+
+        :param node: An indexed node.
+        :param root: An indexed node.
+        :return: False if either node isn't indexed, or node isn't in root's subtree.
+        """
+        position = self._position_of(node)
+        root_position = self._position_of(root)
+        if position is None or root_position is None:
+            return False
+        return root_position <= position < self._ends[root_position]
+
+    def root_index_of(self, node: dict) -> Union[int, None]:
+        """
+        Finds the top-level node of the AST containing a node, e.g. the source unit it's in.
+
+        :param node: An indexed node.
+        :return: The index in ast_data of the top-level node containing node, None if node
+        isn't indexed.
+        """
+        self.ensure_index()
+        position = self._position_of(node)
+        if position is None:
+            return None
+        if self._root_positions is None:
+            self._root_positions = array(
+                "i",
+                (
+                    root_position
+                    for root_position, parent in enumerate(self._parents)
+                    if parent < 0
+                ),
+            )
+        return bisect_right(self._root_positions, position) - 1
+
+    def iter_nodes_in_walk_order(
+        self, node_types: Union[list, None] = None
+    ) -> Iterator[dict]:
+        """
+        Single pass over the indexed AST, the shared traversal multiple consumers can hook onto.
+
+        :param node_types: Only visit nodes of these types, every dict when None.
+        :return: A generator of nodes, in AST walk order.
+        """
+        self.ensure_index()
+        nodes = self._nodes
+        if node_types is None:
+            positions = range(len(nodes))
+        else:
+            positions = heapq.merge(
+                *[
+                    self._type_positions[node_type]
+                    for node_type in dict.fromkeys(node_types)
+                    if node_type in self._type_positions
+                ]
+            )
+        for position in positions:
+            yield nodes[position]
+
+    def first_parent_of_type(
+        self, node: dict, parent_type: Union[str, None], root: Union[dict, list] = None
+    ) -> Union[dict, None]:
+        """
+        Walks up from the given node to its closest ancestor of a specific type.
+
+        :param node: An indexed node.
+        :param parent_type: The nodeType of the ancestor to find, None for any.
+        :param root: Node or list of nodes to scope the search to, the whole AST by default.
+        :return: The ancestor node, or None if not found.
+        """
+        position = self._position_of(node)
+        if position is None:
+            return None
+        scope = _range_containing(self._ranges_of(root), position)
+        if scope is None:
+            return None
+
+        position = self._parents[position]
+        # Ancestors are entered before their descendants, so leaving the scope means
+        # walking past its start
+        while position >= scope[0]:
+            count_visited_nodes(1)
+            parent = self._nodes[position]
+            if parent_type is None or parent.get("nodeType") == parent_type:
+                return parent
+            position = self._parents[position]
+        return None
+
+
+def get_src_location(node: dict) -> tuple[int, int, int]:
+    """
+    Returns the decoded src attribute of a node, from the index when the node is indexed.
+
+    :param node: An AST node.
+    :return: A (start, length, file index) tuple, with -1 values for missing or malformed src.
+    """
+    context = find_analysis_context(node)
+    if context is not None:
+        location = context.src_location(node)
+        if location is not None:
+            return location
+    return decode_src(node.get("src"))
+
+
+def _range_containing(ranges: Union[list, None], position: int) -> Union[tuple, None]:
+    if ranges is None:
+        return None
+    for start, end in ranges:
+        if start <= position < end:
+            return start, end
+    return None
+
+
+def get_type_string(node: dict) -> Union[str, None]:
+    """
+    Returns the typeDescriptions.typeString of a node, if it has one.
+    """
+    type_descriptions = node.get("typeDescriptions")
+    if isinstance(type_descriptions, dict):
+        return type_descriptions.get("typeString")
+    return None
+
+
+@lru_cache(maxsize=65536)
+def type_string_matches(pattern: str, type_string: str) -> bool:
+    """
+    Memoized regex search of a pattern in a typeString.
+
+    The same few thousand typeStrings repeat across the whole AST, so verdicts are cached
+    rather than running the regex again for every node.
+    """
+    return re.search(pattern, type_string) is not None
+
+
+# Contexts are only kept alive by the runs using them, and a context keeps its AST alive,
+# so an id() can't be reused while its entry exists
+_contexts = weakref.WeakValueDictionary()
+_contexts_lock = threading.Lock()
+
+
+def register_analysis_context(ast_data: Union[dict, list]) -> AnalysisContext:
+    """
+    Returns the analysis context of an AST, creating it if it doesn't exist yet.
+
+    The registry doesn't keep contexts alive, see use_analysis_context.
+
+    :param ast_data: The AST that templates will be executed against.
+    :return: The AnalysisContext of ast_data.
+    """
+    with _contexts_lock:
+        context = _contexts.get(id(ast_data))
+        if context is None or context.ast_data is not ast_data:
+            context = AnalysisContext(ast_data)
+            _contexts[id(ast_data)] = context
+    return context
+
+
+@contextmanager
+def use_analysis_context(ast_data: Union[dict, list]) -> Iterator[AnalysisContext]:
+    """
+    Keeps the analysis context of an AST registered while templates run against it, and
+    releases it once the last run using it is done.
+
+    :param ast_data: The AST that templates will be executed against.
+    :return: The AnalysisContext of ast_data.
+    """
+    context = register_analysis_context(ast_data)
+    with _contexts_lock:
+        context._users += 1
+    try:
+        yield context
+    finally:
+        with _contexts_lock:
+            context._users -= 1
+            if context._users == 0 and _contexts.get(id(ast_data)) is context:
+                del _contexts[id(ast_data)]
+
+
+def get_analysis_context(ast_data: Union[dict, list]) -> Union[AnalysisContext, None]:
+    """
+    Finds the analysis context registered for an AST.
+
+    :param ast_data: The AST that was registered.
+    :return: The AnalysisContext of ast_data, or None if it is not registered.
+    """
+    context = _contexts.get(id(ast_data))
+    if context is not None and context.ast_data is ast_data:
+        return context
+    return None
+
+
+def find_analysis_context(node: Union[dict, list]) -> Union[AnalysisContext, None]:
+    """
+    Finds the analysis context whose AST contains a node, a list of nodes, or is the AST.
+
+    :param node: A registered AST, or nodes within one.
+    :return: The AnalysisContext indexing node, or None if no registered AST contains it,
+    or the AST containing it isn't indexed yet.
+    """
+    context = get_analysis_context(node)
+    if context is not None:
+        return context
+    # Other threads register and release contexts meanwhile
+    with _contexts_lock:
+        contexts = list(_contexts.values())
+    for context in contexts:
+        if context.covers(node):
+            return context
+    return None
+
+
+def release_analysis_context(ast_data: Union[dict, list]):
+    """
+    Drops the analysis context of an AST once the run is done, freeing its indexes.
+
+    :param ast_data: The AST that was registered.
+    """
+    with _contexts_lock:
+        context = _contexts.get(id(ast_data))
+        if context is not None and context.ast_data is ast_data:
+            del _contexts[id(ast_data)]
@@ -0,0 +1,303 @@
+import json
+import threading
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Union
+
+# Stack marker for leaving a node during the compaction walk
+_EXIT = object()
+
+# How many dicts materialized source units may hold before the least recently used are
+# dropped, the most recently used unit is kept whatever its size
+MATERIALIZED_NODES_LIMIT = 250_000
+
+
+class CompactAST:
+    """
+    Array-backed representation of the source units of a large build.
+
+    Instead of keeping millions of dicts alive, the fields queries need are kept in parallel
+    typed arrays, one entry per AST dict, in the same depth-first walk order the analysis
+    context uses for its positions:
+    node id, interned nodeType code, parent position, end position (following the last
+    descendant), src start/length/file index, and interned typeString id.
+
+    Each source unit's JSON is kept zlib compressed, and is only decoded back into dicts
+    when a template touches one of its nodes. Only the most recently used materialized units
+    are kept (see MATERIALIZED_NODES_LIMIT), nodes templates still hold from dropped units
+    are found by their id and src instead, see position_of.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self.node_ids = array("q")
+        self.node_type_codes = array("i")
+        self.parents = array("i")
+        self.ends = array("i")
+        self.src_starts = array("q")
+        self.src_lengths = array("q")
+        self.src_files = array("i")
+        self.type_string_codes = array("i")
+
+        # Interned nodeType and typeString values, indexed by their codes
+        self.node_type_names = []
+        self.type_string_names = []
+        self._node_type_codes = {}
+        self._type_string_codes = {}
+
+        # Query indexes, with array backed position lists
+        self.type_positions = {}
+        self.type_string_positions = {}
+        self.id_positions = {}
+
+        self._unit_starts = array("i")
+        self._unit_blobs = []
+        # Unit -> its dicts in walk order, least recently used first
+        self._materialized_units = OrderedDict()
+        self._materialized_nodes = 0
+        self._last_unit = None
+        # id() of a dict of a materialized unit -> its position
+        self.positions = {}
+
+    def __len__(self) -> int:
+        return len(self.node_type_codes)
+
+    def __getitem__(self, position: int) -> dict:
+        """
+        Returns the dict at a position, materializing its source unit if needed.
+        """
+        if position < 0:
+            position += len(self)
+        unit = bisect_right(self._unit_starts, position) - 1
+        return self._materialize(unit)[position - self._unit_starts[unit]]
+
+    @property
+    def unit_count(self) -> int:
+        return len(self._unit_starts)
+
+    def unit_root(self, unit: int) -> dict:
+        """
+        Returns the root node (usually a SourceUnit) of a source unit.
+        """
+        return self[self._unit_starts[unit]]
+
+    def source_units(self) -> "CompactSourceUnits":
+        """
+        Returns the root nodes sequence templates receive as their ast_data.
+        """
+        return CompactSourceUnits(self)
+
+    def add_source_unit(self, raw_json: str):
+        """
+        Compacts the JSON text of one source unit AST.
+
+        :param raw_json: The JSON of the source unit's root node.
+        """
+        root = json.loads(raw_json)
+        if not isinstance(root, dict) or not root:
+            return
+        self._unit_starts.append(len(self))
+        self._unit_blobs.append(zlib.compress(raw_json.encode("utf-8"), 1))
+
+        node_ids = self.node_ids
+        node_type_codes = self.node_type_codes
+        parents = self.parents
+        ends = self.ends
+        src_starts = self.src_starts
+        src_lengths = self.src_lengths
+        src_files = self.src_files
+        type_string_codes = self.type_string_codes
+
+        stack = [(root, -1)]
+        while stack:
+            current, parent = stack.pop()
+            if current is _EXIT:
+                ends[parent] = len(node_type_codes)
+                continue
+
+            if isinstance(current, dict):
+                position = len(node_type_codes)
+                parents.append(parent)
+                ends.append(position + 1)
+
+                node_type = current.get("nodeType")
+                if node_type is None:
+                    node_type_codes.append(-1)
+                else:
+                    node_type_codes.append(
+                        self._intern(
+                            node_type, self._node_type_codes, self.node_type_names
+                        )
+                    )
+                    self.type_positions.setdefault(node_type, array("i")).append(
+                        position
+                    )
+
+                node_id = current.get("id")
+                if isinstance(node_id, int):
+                    node_ids.append(node_id)
+                    if node_id not in self.id_positions:
+                        self.id_positions[node_id] = position
+                else:
+                    node_ids.append(-1)
+
+                src_start, src_length, src_file = decode_src(current.get("src"))
+                src_starts.append(src_start)
+                src_lengths.append(src_length)
+                src_files.append(src_file)
+
+                type_descriptions = current.get("typeDescriptions")
+                type_string = None
+                if isinstance(type_descriptions, dict):
+                    type_string = type_descriptions.get("typeString")
+                if type_string:
+                    type_string_codes.append(
+                        self._intern(
+                            type_string, self._type_string_codes, self.type_string_names
+                        )
+                    )
+                    self.type_string_positions.setdefault(
+                        type_string, array("i")
+                    ).append(position)
+                else:
+                    type_string_codes.append(-1)
+
+                stack.append((_EXIT, position))
+                children = current.values()
+                parent = position
+            else:
+                children = current
+
+            # Pushed in reverse so children are visited in their original order
+            stack.extend(
+                (child, parent)
+                for child in reversed(list(children))
+                if isinstance(child, (dict, list))
+            )
+
+    @staticmethod
+    def _intern(value: str, codes: dict, names: list) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = len(names)
+            codes[value] = code
+            names.append(value)
+        return code
+
+    def position_of(self, node: dict) -> Union[int, None]:
+        """
+        Finds the position of a dict of one of the source units.
+
+        :param node: A dict of a materialized unit, or of a unit that was dropped since.
+        :return: The node's position, None if it isn't part of the AST.
+        """
+        position = self.positions.get(id(node))
+        if position is not None:
+            return position
+
+        # Dropped units' dicts are matched by their id, nodeType and src
+        node_id = node.get("id")
+        position = self.id_positions.get(node_id) if isinstance(node_id, int) else None
+        if position is None:
+            return None
+        node_type_code = self.node_type_codes[position]
+        if node_type_code < 0 or (
+            self.node_type_names[node_type_code] != node.get("nodeType")
+        ):
+            return None
+        src_start, src_length, src_file = decode_src(node.get("src"))
+        if (
+            self.src_starts[position] != src_start
+            or self.src_lengths[position] != src_length
+            or self.src_files[position] != src_file
+        ):
+            return None
+        return position
+
+    def _materialize(self, unit: int) -> list:
+        # Walks stay within a unit for long, so it's looked up without locking
+        last_unit = self._last_unit
+        if last_unit is not None and last_unit[0] == unit:
+            return last_unit[1]
+
+        with self._lock:
+            nodes = self._materialized_units.get(unit)
+            if nodes is not None:
+                self._materialized_units.move_to_end(unit)
+            else:
+                root = json.loads(zlib.decompress(self._unit_blobs[unit]))
+                nodes = []
+                stack = [root]
+                while stack:
+                    current = stack.pop()
+                    if isinstance(current, dict):
+                        nodes.append(current)
+                        children = current.values()
+                    else:
+                        children = current
+                    stack.extend(
+                        child
+                        for child in reversed(list(children))
+                        if isinstance(child, (dict, list))
+                    )
+
+                unit_start = self._unit_starts[unit]
+                for offset, node in enumerate(nodes):
+                    self.positions[id(node)] = unit_start + offset
+                self._materialized_units[unit] = nodes
+                self._materialized_nodes += len(nodes)
+                self._evict_units()
+            self._last_unit = (unit, nodes)
+        return nodes
+
+    def _evict_units(self):
+        """
+        Drops the least recently used materialized units past MATERIALIZED_NODES_LIMIT.
+        """
+        while (
+            self._materialized_nodes > MATERIALIZED_NODES_LIMIT
+            and len(self._materialized_units) > 1
+        ):
+            _, nodes = self._materialized_units.popitem(last=False)
+            self._materialized_nodes -= len(nodes)
+            # The dicts are still alive here, so their id()s weren't reused
+            for node in nodes:
+                del self.positions[id(node)]
+
+
+class CompactSourceUnits(Sequence):
+    """
+    The source unit roots of a CompactAST, materialized one by one as they're accessed.
+    """
+
+    def __init__(self, compact: CompactAST):
+        self.compact = compact
+
+    def __len__(self) -> int:
+        return self.compact.unit_count
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self.compact.unit_root(unit) for unit in range(len(self))[index]]
+        return self.compact.unit_root(range(len(self))[index])
+
+
+def decode_src(src: str) -> tuple[int, int, int]:
+    """
+    Decodes a "start:length:fileIndex" src attribute.
+
+    :param src: The src attribute of a node.
+    :return: A (start, length, file index) tuple, with -1 values for missing or malformed src.
+    """
+    if isinstance(src, str):
+        parts = src.split(":")
+        if len(parts) == 3:
+            try:
+                return int(parts[0]), int(parts[1]), int(parts[2])
+            except ValueError:
+                pass
+    return -1, -1, -1
@@ -0,0 +1,202 @@
+import threading
+from functools import wraps
+from types import CodeType
+from typing import Union
+
+from eburger.analysis_context import AnalysisContext, register_analysis_context
+
+FACT_NAMES = []
+
+
+def fact(compute):
+    """
+    Turns a Facts method into a lazily computed, memoized attribute.
+    """
+    name = compute.__name__
+    FACT_NAMES.append(name)
+
+    @property
+    @wraps(compute)
+    def getter(self):
+        values = self._values
+        if name not in values:
+            with self._lock_of(name):
+                if name not in values:
+                    values[name] = compute(self)
+        return values[name]
+
+    return getter
+
+
+class Facts:
+    """
+    Derived facts about the analyzed AST that several templates need, e.g.
+    facts.state_variables, each computed at most once per run, on first access.
+
+    Facts are safe to read from multiple threads, and the ones templates reference are
+    computed before forking worker processes, which inherit them.
+
+    :state_variables: State variable declarations.
+    :mutable_state_variables: State variable declarations that are neither constant nor
+    immutable.
+    :external_call_sites: Nodes typed as external functions, e.g. token.transfer in
+    token.transfer(to, amount).
+    :functions_with_external_calls: Function definitions with an external call site in their
+    body.
+    :low_level_calls: Member accesses of .call, .delegatecall and .staticcall.
+    :function_modifiers: Function definition id -> names of the modifiers it applies.
+    """
+
+    def __init__(self, context: AnalysisContext):
+        self._context = context
+        self._values = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        # Fact name -> {source unit index: the part of the fact within that source unit}
+        self._unit_values = {}
+
+    def _lock_of(self, name: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    @fact
+    def state_variables(self) -> list:
+        return [
+            node
+            for node in self._context.nodes_by_types(["VariableDeclaration"])
+            if node.get("stateVariable")
+        ]
+
+    @fact
+    def mutable_state_variables(self) -> list:
+        return [
+            node
+            for node in self.state_variables
+            if not node.get("constant") and node.get("mutability") == "mutable"
+        ]
+
+    @fact
+    def external_call_sites(self) -> list:
+        return self._context.nodes_by_type_string("function.*external", use_regex=True)
+
+    @fact
+    def functions_with_external_calls(self) -> list:
+        functions = {}
+        for call_site in self.external_call_sites:
+            previous_node = call_site
+            for ancestor in self._context.ancestors_of(call_site):
+                if ancestor.get("nodeType") == "FunctionDefinition":
+                    if ancestor.get("body") is previous_node:
+                        functions[id(ancestor)] = ancestor
+                    break
+                previous_node = ancestor
+        # Functions don't nest, so they come in walk order
+        return list(functions.values())
+
+    @fact
+    def low_level_calls(self) -> list:
+        return [
+            node
+            for node in self._context.nodes_by_types(["MemberAccess"])
+            if node.get("memberName") in ["call", "delegatecall", "staticcall"]
+        ]
+
+    @fact
+    def function_modifiers(self) -> dict:
+        function_modifiers = {}
+        for function_node in self._context.nodes_by_types(["FunctionDefinition"]):
+            function_modifiers[function_node.get("id")] = [
+                modifier.get("modifierName", {}).get("name")
+                for modifier in function_node.get("modifiers", [])
+            ]
+        return function_modifiers
+
+    def of_source_unit(self, name: str, unit_index: int) -> Union[list, dict]:
+        """
+        Returns the part of a fact within one source unit, splitting the fact once for all
+        source units on first use.
+        """
+        unit_values = self._unit_values.get(name)
+        if unit_values is None:
+            value = getattr(self, name)
+            with self._lock_of(f"{name} by source unit"):
+                unit_values = self._unit_values.get(name)
+                if unit_values is None:
+                    unit_values = {}
+                    if isinstance(value, dict):
+                        for key, item in value.items():
+                            node = self._context.node_by_id(key)
+                            unit = self._context.root_index_of(node) if node else None
+                            unit_values.setdefault(unit, {})[key] = item
+                    else:
+                        for node in value:
+                            unit = self._context.root_index_of(node)
+                            unit_values.setdefault(unit, []).append(node)
+                    self._unit_values[name] = unit_values
+        return unit_values.get(unit_index, type(getattr(self, name))())
+
+
+class SourceUnitFacts:
+    """
+    The facts of a single source unit, for file scoped templates, or of a single node within
+    it (e.g. a contract, for contract scoped templates).
+    """
+
+    def __init__(self, facts: Facts, unit_index: int, root: dict = None):
+        self._facts = facts
+        self._unit_index = unit_index
+        self._root = root
+
+    def __getattr__(self, name: str):
+        if name not in FACT_NAMES:
+            raise AttributeError(f"Unknown fact: {name}")
+        value = self._facts.of_source_unit(name, self._unit_index)
+        if self._root is None:
+            return value
+
+        context = self._facts._context
+        if isinstance(value, dict):
+            return {
+                key: item
+                for key, item in value.items()
+                if context.is_within(context.node_by_id(key), self._root)
+            }
+        return [node for node in value if context.is_within(node, self._root)]
+
+
+_facts_lock = threading.Lock()
+
+
+def get_facts(ast_data: Union[dict, list]) -> Facts:
+    """
+    Returns the facts registry of an AST, shared by every template of the run.
+
+    :param ast_data: The analyzed AST.
+    :return: The Facts of ast_data.
+    """
+    context = register_analysis_context(ast_data)
+    if context.facts is None:
+        with _facts_lock:
+            if context.facts is None:
+                context.facts = Facts(context)
+    return context.facts
+
+
+def get_referenced_facts(code: CodeType) -> set:
+    """
+    Finds the facts compiled template code may read, from the attribute names it uses.
+
+    :param code: Compiled template code.
+    :return: The fact names referenced by the code or any function it defines.
+    """
+    names = set()
+    stack = [code]
+    while stack:
+        current = stack.pop()
+        names.update(current.co_names)
+        stack.extend(
+            const for const in current.co_consts if isinstance(const, CodeType)
+        )
+    if "facts" not in names:
+        return set()
+    return names.intersection(FACT_NAMES)
@@ -4,7 +4,13 @@ import sys
 from pathlib import Path
 
 import eburger.settings as settings
-from eburger.serializer import parse_solidity_ast, reduce_json
+from eburger.serializer import (
+    SourceUnitStream,
+    load_compact_ast,
+    parse_solidity_ast,
+    reduce_json,
+)
+from eburger.template_cache import find_template_files, pack_templates
 from eburger.utils.cli_args import args
 from eburger.utils.compilers import compile_foundry, compile_hardhat, compile_solc
 from eburger.utils.filesystem import (
@@ -22,11 +28,16 @@ from eburger.utils.logger import log
 from eburger.utils.outputs import (
     calculate_nsloc,
     draw_nsloc_table,
+    draw_profile_table,
     save_as_json,
     save_as_markdown,
     save_as_sarif,
 )
-from eburger.yaml_parser import process_files_concurrently
+from eburger.yaml_parser import (
+    process_files_concurrently,
+    process_files_pipelined,
+    reaches_fail_fast_severity,
+)
 
 
 def main():
@@ -34,6 +45,22 @@ def main():
         print(get_eburger_version())
         sys.exit(0)
 
+    if args.templates_command == "pack":
+        template_paths = settings.templates_directories
+        if args.template_paths:
+            template_paths = [
+                Path(template_path) for template_path in args.template_paths
+            ]
+        bundle_path = Path(args.bundle_path)
+        templates_count = pack_templates(
+            find_template_files(template_paths), bundle_path
+        )
+        log(
+            "success",
+            f"Packed {templates_count} templates into {bundle_path.resolve()}, load them with `eburger -t {bundle_path}`.",
+        )
+        sys.exit(0)
+
     if not args.solidity_file_or_folder:
         args.solidity_file_or_folder = "."
 
@@ -44,6 +71,9 @@ def main():
 
     create_directory_if_not_exists(settings.outputs_dir)
 
+    if args.no_template_cache:
+        settings.templates_cache_dir = None
+
     log("debug", f"Project path: {args.solidity_file_or_folder}")
 
     path_type = None
@@ -51,17 +81,25 @@ def main():
     if args.ast_json_file:
         filename = Path(args.ast_json_file).name
 
-        with open(args.ast_json_file, "r") as f:
-            ast_json = json.load(f)
-            ast_json, src_paths = reduce_json(ast_json)
+        if args.compact_ast:
+            ast_json, src_paths = load_compact_ast(args.ast_json_file)
+        elif args.pipeline:
+            ast_json = SourceUnitStream(args.ast_json_file)
+            src_paths = ast_json.src_paths
+        else:
+            with open(args.ast_json_file, "r") as f:
+                ast_json = json.load(f)
+                ast_json, src_paths = reduce_json(ast_json)
 
-        ast_suffix = "_ast"
-        if filename.endswith("_ast"):
-            ast_suffix = ""
+            ast_suffix = "_ast"
+            if filename.endswith("_ast"):
+                ast_suffix = ""
 
-        output_path = (settings.outputs_dir / f"{filename}{ast_suffix}.json").resolve()
+            output_path = (
+                settings.outputs_dir / f"{filename}{ast_suffix}.json"
+            ).resolve()
 
-        save_as_json(output_path, ast_json)
+            save_as_json(output_path, ast_json)
 
     elif args.solidity_file_or_folder:
         if os.path.isfile(args.solidity_file_or_folder):
@@ -136,7 +174,8 @@ def main():
             output_filename, ast_json, filename, src_paths = compile_foundry(
                 forge_full_path_binary_found
             )
-            save_as_json(output_filename, ast_json)
+            if not args.compact_ast and not args.pipeline:
+                save_as_json(output_filename, ast_json)
 
         elif path_type == "hardhat":
             log("info", "Hardhat project detected, compiling using hardhat.")
@@ -146,7 +185,8 @@ def main():
                 log("warning", "Ignoring the -r option in hardhat based projects.")
 
             output_filename, ast_json, filename, src_paths = compile_hardhat()
-            save_as_json(output_filename, ast_json)
+            if not args.compact_ast and not args.pipeline:
+                save_as_json(output_filename, ast_json)
 
         # solc compilation flow
         elif path_type in ["file", "folder"]:
@@ -156,9 +196,6 @@ def main():
 
             save_as_json(output_filename, solc_compile_res_parsed)
 
-    # Parse AST
-    ast_roots = parse_solidity_ast(ast_json)
-
     # Parse YAML templates
     if args.template_paths:
         settings.templates_directories = []
@@ -166,13 +203,27 @@ def main():
             settings.templates_directories.append(Path(template_path))
             log("info", f"Templates path: {Path(template_path)}")
 
-    insights = process_files_concurrently(ast_roots, src_paths)
+    profile = [] if args.profile or args.profile_dump else None
+    timed_out = []
+    if isinstance(ast_json, SourceUnitStream):
+        # Source units are decoded as templates run on them
+        insights = process_files_pipelined(ast_json, profile, timed_out)
+    else:
+        ast_roots = parse_solidity_ast(ast_json)
+        insights = process_files_concurrently(ast_roots, src_paths, profile, timed_out)
+
+    if profile:
+        draw_profile_table(profile)
 
-    if insights:
+    if insights or profile or timed_out:
         analysis_output = {}
         analysis_output["insights"] = insights
         _, summary = calculate_nsloc()
         analysis_output["nsloc"] = summary
+        if profile:
+            analysis_output["profile"] = profile
+        if timed_out:
+            analysis_output["timed_out"] = timed_out
 
         insights_json_path = settings.outputs_dir / f"{filename}_eburger_output.json"
         save_as_json(insights_json_path, analysis_output)
@@ -209,6 +260,13 @@ def main():
     else:
         log("success", f"No insights found. Results saved to {settings.outputs_dir}")
 
+    for insight in insights:
+        if reaches_fail_fast_severity(insight):
+            log(
+                "error",
+                f"Stopped on {insight['severity']} severity insight '{insight['name']}' (--fail-fast-on {args.fail_fast_on}).",
+            )
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,187 @@
+from typing import Iterator, Union
+
+from eburger.analysis_context import (
+    AnalysisContext,
+    get_type_string,
+    register_analysis_context,
+    type_string_matches,
+)
+
+MATCH_PATTERN_KEYS = ["nodeType", "attributes", "typeString", "parent", "ancestor"]
+
+
+class MatchPattern:
+    """
+    A compiled `match:` pattern of a YAML template.
+
+    Example:
+        match:
+          - nodeType: FunctionCall
+            attributes:
+              expression.memberName: transfer
+            typeString: "^tuple\\(\\)$"
+            ancestor:
+              nodeType: FunctionDefinition
+              attributes:
+                stateMutability: nonpayable
+
+    :nodeType: A nodeType, or a list of nodeTypes, the node must be of.
+    :attributes: Dotted attribute paths and the values they must be equal to.
+    :typeString: Regex searched in the node's typeDescriptions.typeString.
+    :parent: A pattern the closest enclosing node must match.
+    :ancestor: A pattern at least one enclosing node must match.
+    """
+
+    def __init__(self, spec: dict):
+        if not isinstance(spec, dict):
+            raise ValueError(f"A match pattern must be a mapping, got: {spec!r}")
+        unknown_keys = [key for key in spec if key not in MATCH_PATTERN_KEYS]
+        if unknown_keys:
+            raise ValueError(f"Unsupported match pattern keys: {unknown_keys}")
+
+        node_types = spec.get("nodeType")
+        if isinstance(node_types, str):
+            node_types = [node_types]
+        self.node_types = node_types
+
+        self.attributes = [
+            (path.split("."), value)
+            for path, value in (spec.get("attributes") or {}).items()
+        ]
+        self.type_string = spec.get("typeString")
+        self.parent = MatchPattern(spec["parent"]) if spec.get("parent") else None
+        self.ancestor = MatchPattern(spec["ancestor"]) if spec.get("ancestor") else None
+
+    def matches(self, node: dict, context: AnalysisContext) -> bool:
+        if self.node_types is not None and node.get("nodeType") not in self.node_types:
+            return False
+
+        for path, value in self.attributes:
+            attribute = node
+            for key in path:
+                if not isinstance(attribute, dict):
+                    return False
+                attribute = attribute.get(key)
+            if attribute != value:
+                return False
+
+        if self.type_string is not None:
+            node_type_string = get_type_string(node)
+            if not node_type_string or not type_string_matches(
+                self.type_string, node_type_string
+            ):
+                return False
+
+        if self.parent is not None:
+            parent = context.parent_of(node)
+            if parent is None or not self.parent.matches(parent, context):
+                return False
+
+        if self.ancestor is not None:
+            if not any(
+                self.ancestor.matches(ancestor, context)
+                for ancestor in context.ancestors_of(node)
+            ):
+                return False
+
+        return True
+
+
+class VisitContext:
+    """
+    Per-template state of a visitor template, passed to each of its on_<NodeType> callbacks.
+
+    Callbacks report nodes with ctx.report(node), and may keep any other state they need
+    across nodes as attributes of the context.
+    """
+
+    def __init__(self, ast_data: Union[dict, list]):
+        self.ast_data = ast_data
+        self.results = []
+        # The exception that stopped the template's callbacks, if any
+        self.error = None
+        self._context = register_analysis_context(ast_data)
+
+    def report(self, node: dict):
+        self.results.append(node)
+
+    def parent(self, node: dict) -> Union[dict, None]:
+        return self._context.parent_of(node)
+
+    def ancestors(self, node: dict) -> Iterator[dict]:
+        return self._context.ancestors_of(node)
+
+
+def compile_match_patterns(match_spec: Union[dict, list]) -> list:
+    """
+    Compiles the `match:` section of a template, a single pattern or a list of alternatives.
+
+    :param match_spec: The parsed YAML of the match section.
+    :return: A list of MatchPattern, a node matches if it matches any of them.
+    """
+    if isinstance(match_spec, dict):
+        match_spec = [match_spec]
+    if not isinstance(match_spec, list) or not match_spec:
+        raise ValueError("The match section must be a pattern or a list of patterns.")
+    return [MatchPattern(spec) for spec in match_spec]
+
+
+def run_match_patterns(
+    template_patterns: dict, ast_data: Union[dict, list], template_visitors: dict = None
+) -> dict:
+    """
+    Evaluates the match patterns and visitor callbacks of all templates in a single traversal
+    of the AST.
+
+    Patterns and callbacks are dispatched by nodeType, so each node is only checked against
+    the patterns and callbacks that can use it, and templates pay for one shared walk instead
+    of one walk each.
+
+    :param template_patterns: Template key -> list of compiled MatchPattern.
+    :param ast_data: The analyzed AST.
+    :param template_visitors: Template key -> (VisitContext, nodeType -> callback). Callbacks
+    are called with each node of their nodeType and the template's context, and a failing
+    template stops receiving nodes, with the exception kept as its context's error.
+    :return: Template key -> list of matching nodes, in AST walk order.
+    """
+    context = register_analysis_context(ast_data)
+
+    # nodeType -> [(callback, VisitContext)]
+    visitor_table = {}
+    for visit_context, callbacks in (template_visitors or {}).values():
+        for node_type, callback in callbacks.items():
+            visitor_table.setdefault(node_type, []).append((callback, visit_context))
+
+    # nodeType -> [(template key, pattern)], None for patterns matching any nodeType
+    dispatch_table = {}
+    for template_key, patterns in template_patterns.items():
+        for pattern in patterns:
+            for node_type in pattern.node_types or [None]:
+                dispatch_table.setdefault(node_type, []).append((template_key, pattern))
+
+    any_type_patterns = dispatch_table.get(None, [])
+    visited_types = None
+    if not any_type_patterns:
+        visited_types = list(dispatch_table) + list(visitor_table)
+
+    matches = {template_key: [] for template_key in template_patterns}
+    for node in context.iter_nodes_in_walk_order(visited_types):
+        node_type = node.get("nodeType")
+        typed_patterns = dispatch_table.get(node_type, []) if node_type else []
+        matched_templates = set()
+        for template_key, pattern in typed_patterns + any_type_patterns:
+            # Patterns of the same template are alternatives, a node is reported once
+            if template_key in matched_templates:
+                continue
+            if pattern.matches(node, context):
+                matched_templates.add(template_key)
+                matches[template_key].append(node)
+
+        for callback, visit_context in visitor_table.get(node_type, []):
+            if visit_context.error is not None:
+                continue
+            try:
+                callback(node, visit_context)
+            except Exception as e:
+                visit_context.error = e
+    return matches
@@ -0,0 +1,125 @@
+import cProfile
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from types import GeneratorType
+from typing import Iterator, Union
+
+from eburger.utils.logger import log
+
+# The profile record of the template running on the current thread, if it's profiled
+_local = threading.local()
+
+
+@contextmanager
+def profile_template(
+    template_name: str, enabled: bool, dump_path: Union[Path, None] = None
+) -> Iterator[Union[dict, None]]:
+    """
+    Profiles the template execution running on the current thread.
+
+    :param template_name: The name the profile record is reported under.
+    :param enabled: Whether to profile, yields None and records nothing otherwise.
+    :param dump_path: Where to dump cProfile stats of the execution, if set, its profile
+    record is dumped next to them as JSON.
+    :return: The profile record, filled in when the block exits.
+    """
+    if not enabled:
+        yield None
+        return
+
+    record = {
+        "template": template_name,
+        "wall_time": 0.0,
+        "cpu_time": 0.0,
+        "helper_calls": 0,
+        "nodes_visited": 0,
+        "results": 0,
+    }
+    profiler = cProfile.Profile() if dump_path is not None else None
+
+    previous_record = getattr(_local, "record", None)
+    _local.record = record
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    if profiler is not None:
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows a single active cProfile per interpreter, templates are
+            # profiled one at a time when dumping, so another profiler is running
+            log(
+                "warning",
+                f"Couldn't dump the profile of {template_name}, another profiler is active.",
+            )
+            profiler = None
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record["cpu_time"] = round(time.thread_time() - cpu_start, 6)
+        record["wall_time"] = round(time.perf_counter() - wall_start, 6)
+        _local.record = previous_record
+        if profiler is not None:
+            dump_path.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(dump_path)
+            # cProfile stats can't hold the helper counters, they're dumped alongside
+            with open(dump_path.with_suffix(".json"), "w") as f:
+                json.dump(record, f)
+
+
+def profiled_helper(helper):
+    """
+    Counts the calls of a template helper in the profile record of the template running on
+    the current thread.
+
+    Helpers called by other helpers are accounted to the outermost call.
+    """
+
+    @wraps(helper)
+    def wrapper(*args, **kwargs):
+        record = getattr(_local, "record", None)
+        if record is None or getattr(_local, "in_helper", False):
+            return helper(*args, **kwargs)
+
+        record["helper_calls"] += 1
+        _local.in_helper = True
+        try:
+            result = helper(*args, **kwargs)
+        finally:
+            _local.in_helper = False
+
+        if isinstance(result, GeneratorType):
+            return _resume_as_helper(result)
+        return result
+
+    return wrapper
+
+
+def _resume_as_helper(generator: GeneratorType) -> Iterator:
+    while True:
+        in_helper = getattr(_local, "in_helper", False)
+        _local.in_helper = True
+        try:
+            node = next(generator)
+        except StopIteration:
+            return
+        finally:
+            _local.in_helper = in_helper
+        yield node
+
+
+def count_visited_nodes(count: int):
+    """
+    Counts AST nodes scanned to answer a query, walked or covered by an index lookup, in the
+    profile record of the template running on the current thread.
+
+    :param count: How many nodes were scanned.
+    """
+    record = getattr(_local, "record", None)
+    if record is not None:
+        record["nodes_visited"] += count
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Union
+
+from eburger import settings
+from eburger.analysis_context import register_analysis_context
+from eburger.compact_ast import decode_src
+from eburger.utils.cli_args import args
+from eburger.utils.helpers import get_eburger_version, get_source_file_path
+from eburger.utils.logger import log
+
+
+def get_result_cache_path() -> Path:
+    return settings.outputs_dir / "results_cache.json"
+
+
+def get_run_signature() -> str:
+    """
+    Hashes everything besides the sources and templates that shapes template results: the
+    eburger version, how result file paths are resolved and printed, and findings limits.
+    """
+    signature = [
+        str(get_eburger_version()),
+        str(settings.project_root),
+        str(args.solidity_file_or_folder),
+        bool(args.ast_json_file),
+        bool(args.relative_file_paths),
+        args.max_findings_per_template,
+    ]
+    return hashlib.sha256(json.dumps(signature).encode("utf-8")).hexdigest()
+
+
+def _hash_file(file_name: str, file_hashes: dict) -> str:
+    file_hash = file_hashes.get(file_name)
+    if file_hash is None:
+        try:
+            with open(get_source_file_path(file_name), "rb") as file:
+                file_hash = hashlib.sha256(file.read()).hexdigest()
+        except OSError:
+            # Hashed by name only, a file appearing later still changes the hashes
+            file_hash = "missing"
+        file_hashes[file_name] = file_hash
+    return file_hash
+
+
+def get_source_unit_hashes(ast_data: list, src_paths: list) -> list:
+    """
+    Hashes each source unit's source file together with every file it imports, directly or
+    through other imports, since the AST of a unit changes with its imports as well.
+
+    :param ast_data: The source unit roots.
+    :param src_paths: The source files of the AST.
+    :return: A hash per source unit, in ast_data order.
+    """
+    context = register_analysis_context(ast_data)
+
+    unit_files = []
+    for unit in ast_data:
+        file_name = unit.get("absolutePath")
+        if file_name is None:
+            file_index = decode_src(unit.get("src"))[2]
+            if 0 <= file_index < len(src_paths):
+                file_name = src_paths[file_index]
+        unit_files.append(file_name)
+
+    # Imported file -> files it imports
+    imports = {file_name: set() for file_name in unit_files}
+    for import_directive in context.nodes_by_types(["ImportDirective"]):
+        imported_file = import_directive.get("absolutePath")
+        unit_index = context.root_index_of(import_directive)
+        if imported_file and unit_index is not None:
+            imports[unit_files[unit_index]].add(imported_file)
+
+    file_hashes = {}
+    unit_hashes = []
+    for file_name in unit_files:
+        if file_name is None:
+            # No way to tell if the unit changed, keeps it from ever being served from cache
+            unit_hashes.append(os.urandom(32).hex())
+            continue
+
+        dependencies = {file_name}
+        stack = [file_name]
+        while stack:
+            for imported_file in imports.get(stack.pop(), []):
+                if imported_file not in dependencies:
+                    dependencies.add(imported_file)
+                    stack.append(imported_file)
+
+        unit_hash = hashlib.sha256(file_name.encode("utf-8"))
+        for dependency in sorted(dependencies):
+            unit_hash.update(dependency.encode("utf-8"))
+            unit_hash.update(_hash_file(dependency, file_hashes).encode("utf-8"))
+        unit_hashes.append(unit_hash.hexdigest())
+    return unit_hashes
+
+
+def get_task_cache_key(
+    run_signature: str,
+    template_hash: str,
+    unit_hashes: list,
+    unit_index: Union[int, None],
+) -> str:
+    """
+    Returns the cache key of a template execution.
+
+    :param run_signature: See get_run_signature.
+    :param template_hash: The sha256 of the template file.
+    :param unit_hashes: See get_source_unit_hashes.
+    :param unit_index: The source unit a file scoped template runs on, None for templates
+    running on the whole AST.
+    :return: The key, equal between runs only if the results would be equal.
+    """
+    key = hashlib.sha256(run_signature.encode("utf-8"))
+    key.update(template_hash.encode("utf-8"))
+    if unit_index is None:
+        scope_hashes = unit_hashes
+    else:
+        scope_hashes = [unit_hashes[unit_index]]
+    for unit_hash in scope_hashes:
+        key.update(unit_hash.encode("utf-8"))
+    return key.hexdigest()
+
+
+def load_result_cache() -> dict:
+    try:
+        with open(get_result_cache_path(), "r") as file:
+            entries = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return entries if isinstance(entries, dict) else {}
+
+
+def save_result_cache(entries: dict):
+    """
+    Saves the results of this run's template executions, replacing the previous run's, so
+    stale entries don't pile up.
+
+    :param entries: Task cache key -> parsed results list.
+    """
+    cache_path = get_result_cache_path()
+    temp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temp_path, "w") as file:
+            json.dump(entries, file)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        log("warning", f"Couldn't save the results cache: {e}")
@@ -0,0 +1,125 @@
+import json
+import os
+import statistics
+from pathlib import Path
+from typing import Union
+
+from eburger import settings
+from eburger.utils.logger import log
+
+# Tasks expected to finish faster than this aren't worth splitting
+HEAVY_TASK_MIN_SECONDS = 0.5
+
+
+def get_timings_path() -> Path:
+    return settings.outputs_dir / "template_timings.json"
+
+
+def get_task_timing_key(ast_data, task: tuple) -> str:
+    """
+    Returns what a task's runtime is recorded under, within its template's timings: the
+    source unit's path for file and contract scoped templates, "" for the others.
+    """
+    unit_index = task[1]
+    if unit_index is None:
+        return ""
+    return ast_data[unit_index].get("absolutePath") or str(unit_index)
+
+
+def load_template_timings() -> dict:
+    try:
+        with open(get_timings_path(), "r") as file:
+            timings = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return timings if isinstance(timings, dict) else {}
+
+
+def save_template_timings(timings: dict):
+    """
+    Saves the template runtimes scheduling is based on.
+
+    :param timings: Template key -> {task timing key -> seconds}.
+    """
+    timings_path = get_timings_path()
+    temp_path = timings_path.with_name(f"{timings_path.name}.{os.getpid()}.tmp")
+    try:
+        timings_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temp_path, "w") as file:
+            json.dump(timings, file)
+        os.replace(temp_path, timings_path)
+    except OSError as e:
+        log("warning", f"Couldn't save the template timings: {e}")
+
+
+def record_task_times(timings: dict, durations: dict, timing_keys: dict):
+    """
+    Records this run's task runtimes, replacing the previous runs' for the same tasks.
+
+    :param timings: See save_template_timings, updated in place.
+    :param durations: Task -> seconds it ran for.
+    :param timing_keys: Task -> see get_task_timing_key.
+    """
+    for task, seconds in durations.items():
+        template_timings = timings.setdefault(task[0], {})
+        template_timings[timing_keys[task]] = round(seconds, 6)
+
+
+def estimate_task_time(template_timings: dict, timing_key: str) -> Union[float, None]:
+    """
+    Estimates how long a task will run for, from its template's previous runs.
+
+    :param template_timings: The template's task timing key -> seconds.
+    :param timing_key: See get_task_timing_key.
+    :return: The task's last runtime, the template's average runtime for source units it
+    never ran on, or None for templates that never ran.
+    """
+    seconds = template_timings.get(timing_key)
+    if isinstance(seconds, (int, float)):
+        return seconds
+    known_times = [
+        seconds
+        for seconds in template_timings.values()
+        if isinstance(seconds, (int, float))
+    ]
+    if known_times:
+        return statistics.mean(known_times)
+    return None
+
+
+def order_longest_first(tasks: list, estimates: dict) -> list:
+    """
+    Orders tasks for a pool, so that the longest ones don't start last and finish alone.
+
+    Tasks without an estimate come first, as they may as well be the longest.
+
+    :param tasks: The tasks, ties keep their order.
+    :param estimates: Task -> expected seconds or None, see estimate_task_time.
+    :return: The ordered tasks.
+    """
+    return sorted(
+        tasks,
+        key=lambda task: (
+            estimates.get(task) is not None,
+            -(estimates.get(task) or 0),
+        ),
+    )
+
+
+def find_heavy_tasks(estimates: dict, workers: int) -> list:
+    """
+    Finds the tasks expected to outlast the run's fair share of each worker, which keep the
+    run going on their own however the other tasks are scheduled.
+
+    :param estimates: Task -> expected seconds or None, see estimate_task_time.
+    :param workers: How many tasks run in parallel.
+    :return: The heavy tasks.
+    """
+    total = sum(seconds for seconds in estimates.values() if seconds is not None)
+    return [
+        task
+        for task, seconds in estimates.items()
+        if seconds is not None
+        and seconds >= HEAVY_TASK_MIN_SECONDS
+        and seconds > total / workers
+    ]
@@ -1,11 +1,28 @@
+import json
+import re
+from json.decoder import scanstring
+from typing import Iterator, Union
+
 from eburger import settings
+from eburger.compact_ast import CompactAST, CompactSourceUnits
 from eburger.utils.logger import log
 
+# A JSON string (without its closing quote as group 1 when the text ends within the
+# string), or a single bracket outside of strings
+_JSON_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*(")?|[\[\]{}]')
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_JSON_SCALAR_END = re.compile(r"[,}\]\s]")
+
 
-def parse_solidity_ast(ast_json: dict) -> list:
+def parse_solidity_ast(
+    ast_json: Union[dict, CompactAST]
+) -> Union[list, CompactSourceUnits]:
     """
     Parses the Solidity AST from the JSON representation.
     """
+    if isinstance(ast_json, CompactAST):
+        return ast_json.source_units()
+
     root_nodes = []
     for key, node in ast_json.get("sources", {}).items():
         ast_node = node.get("AST", node.get("ast", {}))
@@ -39,3 +56,268 @@ def reduce_json(ast_json: dict) -> tuple:
             remove_keys_in_place(ast_json[section])
 
     return ast_json, src_paths
+
+
+# Compilation output is read at least this many characters at a time
+JSON_CHUNK_SIZE = 1 << 20
+
+
+class JsonTextReader:
+    """
+    JSON text read from a file a chunk at a time, for walking it (see
+    iter_json_object_members) while holding only the text the walk still needs.
+
+    Offsets are positions in the whole text. Text before the end of the values a walk moved
+    past is dropped.
+    """
+
+    def __init__(self, file=None, text: str = "", chunk_size: int = None):
+        """
+        :param file: A text file to read the JSON text from.
+        :param text: The whole JSON text, when there's no file to read.
+        :param chunk_size: Characters to read at least at a time, JSON_CHUNK_SIZE by default.
+        """
+        self._file = file
+        self._chunk_size = chunk_size or JSON_CHUNK_SIZE
+        self._text = text
+        # Offset of _text[0] in the whole text
+        self._start = 0
+        self._complete = file is None
+        # Value offset -> end offset, of the values walked before the walk moves past them
+        self._value_ends = {}
+
+    def _read_more(self) -> bool:
+        if self._complete:
+            return False
+        # As much as is buffered, so parsing a long value again after each read stays linear
+        chunk = self._file.read(max(self._chunk_size, len(self._text)))
+        if not chunk:
+            self._complete = True
+            return False
+        self._text += chunk
+        return True
+
+    def parse(self, step, offset: int):
+        """
+        Runs a parsing step at an offset, reading more text until the step has all it needs.
+
+        :param step: Called with the buffered text, the offset within it, and the offset of
+        the buffered text in the whole text. Raises IndexError or ValueError when it runs past
+        the buffered text.
+        :param offset: The offset to parse at.
+        :return: What the step returned.
+        """
+        while True:
+            try:
+                return step(self._text, offset - self._start, self._start)
+            except (IndexError, ValueError):
+                if not self._read_more():
+                    raise
+
+    def value_end(self, offset: int) -> int:
+        """
+        Finds where the JSON value at offset ends, without decoding it.
+        """
+        end = self._value_ends.get(offset)
+        if end is None:
+            end = self.parse(_parse_json_value_end, offset)
+            self._value_ends[offset] = end
+        return end
+
+    def record_value_end(self, offset: int, end: int):
+        self._value_ends[offset] = end
+
+    def slice(self, start: int, end: int) -> str:
+        return self._text[start - self._start : end - self._start]
+
+    def release(self, offset: int):
+        """
+        Drops the text before offset, once that's more than half of the buffered text.
+        """
+        released = offset - self._start
+        if released >= self._chunk_size and released * 2 >= len(self._text):
+            self._text = self._text[released:]
+            self._start = offset
+            self._value_ends = {
+                value_offset: end
+                for value_offset, end in self._value_ends.items()
+                if value_offset >= offset
+            }
+
+
+def _skip_json_value(text: str, index: int) -> int:
+    """
+    Finds where the JSON value starting at index ends, without decoding it.
+    """
+    if text[index] == '"':
+        return scanstring(text, index + 1)[1]
+
+    if text[index] in "{[":
+        depth = 0
+        for token in _JSON_TOKEN.finditer(text, index):
+            token_start = text[token.start()]
+            if token_start == '"':
+                if token.group(1) is None:
+                    # The string goes on past the end of the text
+                    break
+            elif token_start in "{[":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return token.end()
+        raise ValueError(f"Unterminated JSON value at offset {index}")
+
+    scalar_end = _JSON_SCALAR_END.search(text, index)
+    if scalar_end is None:
+        # Values walked are always within an object or array
+        raise ValueError(f"Unterminated JSON value at offset {index}")
+    return scalar_end.start()
+
+
+def _parse_json_value_end(text: str, index: int, base: int) -> int:
+    return base + _skip_json_value(text, index)
+
+
+def _parse_json_object_start(text: str, index: int, base: int) -> int:
+    index = _JSON_WHITESPACE.match(text, index).end()
+    if text[index] != "{":
+        raise ValueError(f"Expected a JSON object at offset {base + index}")
+    return base + index + 1
+
+
+def _parse_json_object_member(text: str, index: int, base: int) -> tuple:
+    """
+    Parses the key of the next member of an object.
+
+    :return: (key, value offset), or (None, offset past the object) at its end.
+    """
+    index = _JSON_WHITESPACE.match(text, index).end()
+    if text[index] == "}":
+        return None, base + index + 1
+    if text[index] == ",":
+        index = _JSON_WHITESPACE.match(text, index + 1).end()
+
+    key, index = scanstring(text, index + 1)
+    index = _JSON_WHITESPACE.match(text, index).end()
+    if text[index] != ":":
+        raise ValueError(f"Expected a colon at offset {base + index}")
+    value_start = _JSON_WHITESPACE.match(text, index + 1).end()
+    # The value has to be there, not just its offset
+    text[value_start]
+    return key, base + value_start
+
+
+def iter_json_object_members(
+    reader: JsonTextReader, index: int
+) -> Iterator[tuple[str, int]]:
+    """
+    Walks the members of the JSON object starting at index, without decoding their values.
+
+    Values can be walked in turn (by a nested walk, or reader.value_end) before the walk
+    moves on, the rest are skipped, and the text before them is released.
+
+    :param reader: The JSON text.
+    :param index: Offset of the object.
+    :return: A generator of (key, value offset) tuples.
+    """
+    member_index = reader.parse(_parse_json_object_start, index)
+    while True:
+        key, value_start = reader.parse(_parse_json_object_member, member_index)
+        if key is None:
+            reader.record_value_end(index, value_start)
+            return
+        yield key, value_start
+        member_index = reader.value_end(value_start)
+        reader.release(member_index)
+
+
+def find_json_sources(reader: JsonTextReader) -> Union[int, None]:
+    """
+    Locates the "sources" object of solc/foundry/hardhat compilation output JSON text.
+
+    The text is only read up to the sources object, top-level or within "output", whichever
+    comes first.
+
+    :param reader: JSON text of the compilation output, or of a whole build-info file.
+    :return: Offset of the sources object, or None if there isn't one.
+    """
+    for key, value_start in iter_json_object_members(reader, 0):
+        if key == "sources":
+            return value_start
+        if key == "output":
+            for output_key, output_value_start in iter_json_object_members(
+                reader, value_start
+            ):
+                if output_key == "sources":
+                    return output_value_start
+    return None
+
+
+def _iter_raw_source_asts(reader: JsonTextReader, src_paths: list) -> Iterator[str]:
+    """
+    Walks the source units of compilation output JSON text, without decoding them.
+
+    :param reader: JSON text of the compilation output, or of a whole build-info file.
+    :param src_paths: Filled with the original source file list (like reduce_json), as the
+    sources are walked.
+    :return: A generator of the JSON text of each non empty, non excluded source unit AST.
+    """
+    sources_index = find_json_sources(reader)
+    if sources_index is None:
+        return
+
+    for source_path, source_start in iter_json_object_members(reader, sources_index):
+        src_paths.append(source_path)
+        if any(substring in source_path for substring in settings.excluded_contracts):
+            log("debug", f"Excluding {source_path}")
+            continue
+
+        raw_asts = {}
+        for key, value_start in iter_json_object_members(reader, source_start):
+            if key in ["AST", "ast"]:
+                raw_asts[key] = reader.slice(value_start, reader.value_end(value_start))
+        raw_ast = raw_asts.get("AST", raw_asts.get("ast", ""))
+        # Same as parse_solidity_ast, empty ASTs are skipped
+        if raw_ast and raw_ast not in ["{}", "null"]:
+            yield raw_ast
+
+
+def load_compact_ast(file_path: str) -> tuple[CompactAST, list]:
+    """
+    Loads compilation output JSON straight into a CompactAST, one source unit at a time.
+
+    The file is read in chunks and never decoded as a whole, so peak memory stays around a
+    single source unit's text and dicts besides the CompactAST, and excluded contracts are
+    not decoded at all.
+
+    :param file_path: Path of a build-info or AST JSON file.
+    :return: The CompactAST, and the original source file list (like reduce_json).
+    """
+    compact = CompactAST()
+    src_paths = []
+    with open(file_path, "r") as f:
+        for raw_ast in _iter_raw_source_asts(JsonTextReader(f), src_paths):
+            compact.add_source_unit(raw_ast)
+    return compact, src_paths
+
+
+class SourceUnitStream:
+    """
+    The source unit roots of compilation output JSON, decoded one at a time as they're
+    iterated, so analysis can start on the first source units while the rest are decoded.
+
+    :file_path: Path of a build-info or AST JSON file.
+    :src_paths: The original source file list (like reduce_json), filled as the source units
+    are iterated.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.src_paths = []
+
+    def __iter__(self) -> Iterator[dict]:
+        self.src_paths.clear()
+        with open(self.file_path, "r") as f:
+            for raw_ast in _iter_raw_source_asts(JsonTextReader(f), self.src_paths):
+                yield json.loads(raw_ast)
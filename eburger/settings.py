@@ -4,6 +4,12 @@ from pathlib import Path
 
 project_root = Path.cwd()
 outputs_dir = Path.cwd() / ".eburger"
+# Parsed and compiled templates, shared by all projects. None disables the cache.
+templates_cache_dir = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "eburger"
+    / "templates"
+)
 excluded_dirs = ["test", "script", "mocks", "MockContracts" "lib", "node_modules"]
 excluded_contracts = [
     "@openzeppelin",
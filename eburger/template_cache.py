@@ -0,0 +1,327 @@
+import ast
+import hashlib
+import marshal
+import os
+import sys
+from pathlib import Path
+from types import CodeType
+from typing import Callable, Union
+
+import yaml
+from packaging.version import parse as parse_version
+
+from eburger import settings
+from eburger.matcher import compile_match_patterns
+from eburger.utils.helpers import get_eburger_version
+from eburger.utils.logger import log
+
+
+TEMPLATE_KEYS = {"metadata", "code", "visit_code", "hash"}
+# Bumped whenever templates compile differently (e.g. compile_python_section's generators),
+# so cached and bundled code of the previous compiler isn't used anymore
+CACHE_FORMAT = 2
+TEMPLATE_SECTIONS = [("python", "code"), ("visit", "visit_code")]
+# The generator function python sections yielding their findings are compiled into
+TEMPLATE_GENERATOR_NAME = "_template_findings"
+
+BUNDLE_SUFFIX = ".ebundle"
+# Bumped whenever the bundle layout changes, older bundles have to be repacked
+BUNDLE_FORMAT = 1
+
+# libyaml's loader when PyYAML was built with it, parses like yaml.safe_load only faster
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def get_template_cache_path(template_bytes: bytes) -> Path:
+    """
+    Returns the cache entry path of a template.
+
+    Entries are keyed by the template's content hash, the interpreter's bytecode tag, the
+    eburger version and CACHE_FORMAT, so editing a template, switching Python versions or
+    upgrading eburger simply misses the old entry.
+
+    :param template_bytes: The raw content of the template file.
+    :return: The path of the cache entry.
+    """
+    template_hash = hashlib.sha256(template_bytes).hexdigest()
+    return (
+        settings.templates_cache_dir
+        / f"{template_hash}.{sys.implementation.cache_tag}.{get_eburger_version()}.v{CACHE_FORMAT}.marshal"
+    )
+
+
+def load_template(
+    file_path, selector: Callable[[dict], bool] = None
+) -> Union[dict, None]:
+    """
+    Loads a YAML template along with the compiled code of its python and visit sections.
+
+    :param file_path: Path to the YAML template.
+    :param selector: Called with the parsed template, templates it rejects aren't compiled.
+    :return: A dict with the parsed template as "metadata", the compiled code of its python
+    and visit sections as "code" and "visit_code" (None when a section is missing, or doesn't
+    compile), and the sha256 of the template file as "hash". None if the selector rejected
+    the template.
+    """
+    with open(file_path, "rb") as file:
+        template_bytes = file.read()
+
+    cache_path = None
+    if settings.templates_cache_dir is not None:
+        cache_path = get_template_cache_path(template_bytes)
+        try:
+            with open(cache_path, "rb") as cache_file:
+                template = marshal.load(cache_file)
+            if isinstance(template, dict) and template.keys() == TEMPLATE_KEYS:
+                if selector is not None and not selector(template["metadata"]):
+                    return None
+                return template
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+    metadata = yaml.load(template_bytes, Loader=YamlLoader)
+    if selector is not None and not selector(metadata):
+        return None
+
+    template = {
+        "metadata": metadata,
+        "code": None,
+        "visit_code": None,
+        "hash": hashlib.sha256(template_bytes).hexdigest(),
+    }
+    compiled = compile_template(template)
+
+    if cache_path is not None and compiled:
+        store_template(cache_path, template)
+    return template
+
+
+def compile_template(template: dict) -> bool:
+    """
+    Compiles the python and visit sections of a loaded template into its "code" and
+    "visit_code".
+
+    :param template: A template dict, as returned by load_template.
+    :return: False if a section doesn't compile, its code is left None.
+    """
+    metadata = template["metadata"]
+    compiled = True
+    for section, code_key in TEMPLATE_SECTIONS:
+        source = metadata.get(section) if isinstance(metadata, dict) else None
+        if source is None:
+            continue
+        try:
+            template[code_key] = compile_template_section(section, source)
+        except SyntaxError:
+            # Compiled again and reported when the template is executed
+            compiled = False
+    return compiled
+
+
+def store_template(cache_path: Path, template: dict):
+    temp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temp_path, "wb") as temp_file:
+            marshal.dump(template, temp_file)
+        # Atomic, so concurrent runs never read a partially written entry
+        os.replace(temp_path, cache_path)
+    except (OSError, ValueError) as e:
+        # e.g. a read-only cache dir, or YAML values marshal doesn't support (dates)
+        log("debug", f"Couldn't cache template {cache_path.name}: {e}")
+        try:
+            temp_path.unlink()
+        except OSError:
+            pass
+
+
+def _yields_at_top_level(tree: ast.Module) -> bool:
+    stack = list(tree.body)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.Yield, ast.YieldFrom)):
+            return True
+        if not isinstance(
+            node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+        ):
+            stack.extend(ast.iter_child_nodes(node))
+    return False
+
+
+def compile_python_section(source: str) -> CodeType:
+    """
+    Compiles the python section of a template.
+
+    Besides building a results list, sections can yield their findings at the top level.
+    These are compiled into a generator function named TEMPLATE_GENERATOR_NAME, which
+    executing the code defines, with the template's line numbers kept.
+
+    :param source: The python section.
+    :return: The compiled code.
+    """
+    tree = ast.parse(source)
+    if _yields_at_top_level(tree):
+        generator = ast.parse(f"def {TEMPLATE_GENERATOR_NAME}():\n    pass").body[0]
+        generator.body = tree.body
+        tree.body = [generator]
+    return compile(tree, "<string>", "exec")
+
+
+def compile_template_section(section: str, source: str) -> CodeType:
+    """
+    Compiles the python or visit section of a template.
+
+    :param section: "python" or "visit".
+    :param source: The section's code.
+    :return: The compiled code, raises SyntaxError if it doesn't compile.
+    """
+    if section == "python":
+        return compile_python_section(source)
+    return compile(source, "<string>", "exec")
+
+
+def find_template_files(templates_paths: list) -> list:
+    """
+    Lists the templates to load.
+
+    :param templates_paths: Templates folders, YAML templates and templates bundles.
+    :return: The YAML templates of the folders, and the given files.
+    """
+    template_files = []
+    for templates_path in templates_paths:
+        if templates_path.is_dir():
+            template_files = list(
+                set(template_files + list(templates_path.glob("*.yaml")))
+            )
+        elif templates_path.is_file():
+            if templates_path.suffix not in [".yaml", BUNDLE_SUFFIX]:
+                log(
+                    "error",
+                    f"Please load files with a .yaml file extension, or {BUNDLE_SUFFIX} templates bundles.",
+                )
+            if templates_path not in template_files:
+                template_files.append(templates_path)
+        else:
+            log("error", "Invalid templates directory or file.", sorry=True)
+    return template_files
+
+
+def pack_templates(template_files: list, bundle_path: Path) -> int:
+    """
+    Packs templates into a bundle file, which load_template_bundle loads with a single read,
+    skipping YAML parsing and compilation.
+
+    Templates are validated while packing, an invalid template fails the whole pack rather
+    than every run using the bundle.
+
+    :param template_files: YAML templates, and bundles to repack.
+    :param bundle_path: Path of the bundle to write.
+    :return: The number of packed templates.
+    """
+    templates = {}
+    for template_file in template_files:
+        if template_file.suffix == BUNDLE_SUFFIX:
+            file_templates = load_template_bundle(template_file)
+        else:
+            file_templates = {template_file.name: load_template(template_file)}
+
+        for file_name, template in file_templates.items():
+            metadata = template["metadata"]
+            if not isinstance(metadata, dict) or not metadata.get("name"):
+                log("error", f"Template {template_file} has no name.")
+            if get_eburger_version() < parse_version(metadata.get("version", "1.0.0")):
+                log(
+                    "warning",
+                    f"Not packing template '{metadata['name']}', it requires eburger {metadata['version']}.",
+                )
+                continue
+            for section, code_key in TEMPLATE_SECTIONS:
+                if metadata.get(section) is not None and template[code_key] is None:
+                    try:
+                        compile_template_section(section, metadata[section])
+                    except SyntaxError as e:
+                        log(
+                            "error",
+                            f"Invalid {section} section in template {metadata['name']} -> {e}",
+                        )
+            if metadata.get("match") is not None:
+                try:
+                    compile_match_patterns(metadata["match"])
+                except ValueError as e:
+                    log(
+                        "error",
+                        f"Invalid match section in template {metadata['name']} -> {e}",
+                    )
+            if file_name in templates:
+                log(
+                    "warning",
+                    f"Packing more than one {file_name} template, keeping {template_file}'s.",
+                )
+            templates[file_name] = template
+
+    # Bytecode only loads on the Python version that compiled it, so it's marshalled
+    # separately and the rest of the bundle stays readable by any version
+    bundle = {
+        "format": BUNDLE_FORMAT,
+        "cache_tag": sys.implementation.cache_tag,
+        "cache_format": CACHE_FORMAT,
+        "templates": {
+            file_name: {"metadata": template["metadata"], "hash": template["hash"]}
+            for file_name, template in templates.items()
+        },
+    }
+    try:
+        bundle["code"] = marshal.dumps(
+            {
+                file_name: (template["code"], template["visit_code"])
+                for file_name, template in templates.items()
+            }
+        )
+        bundle_bytes = marshal.dumps(bundle)
+    except ValueError as e:
+        # e.g. YAML values marshal doesn't support (dates)
+        log("error", f"Couldn't pack templates: {e}")
+
+    bundle_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(bundle_path, "wb") as bundle_file:
+        bundle_file.write(bundle_bytes)
+    return len(templates)
+
+
+def load_template_bundle(bundle_path: Path) -> dict:
+    """
+    Loads the templates of a bundle written by pack_templates.
+
+    :param bundle_path: Path to the bundle.
+    :return: Template file name -> template dict, as returned by load_template.
+    """
+    try:
+        with open(bundle_path, "rb") as bundle_file:
+            bundle = marshal.load(bundle_file)
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        log("error", f"Couldn't load templates bundle {bundle_path}: {e}")
+
+    if not isinstance(bundle, dict) or bundle.get("format") != BUNDLE_FORMAT:
+        log(
+            "error",
+            f"{bundle_path} isn't a templates bundle of this eburger version, please repack it with `eburger templates pack`.",
+        )
+
+    templates = {
+        file_name: {**template, "code": None, "visit_code": None}
+        for file_name, template in bundle["templates"].items()
+    }
+    if (
+        bundle["cache_tag"] == sys.implementation.cache_tag
+        and bundle.get("cache_format") == CACHE_FORMAT
+    ):
+        for file_name, code in marshal.loads(bundle["code"]).items():
+            templates[file_name]["code"], templates[file_name]["visit_code"] = code
+    else:
+        log(
+            "debug",
+            f"Templates bundle {bundle_path} was packed on another Python or eburger version, compiling its templates.",
+        )
+        for template in templates.values():
+            compile_template(template)
+    return templates
@@ -1,6 +1,16 @@
 import copy
 import re
-from typing import Union
+from collections.abc import Sequence
+from typing import Iterator, Union
+
+from eburger.analysis_context import (
+    NodesView,
+    find_analysis_context,
+    get_src_location,
+    get_type_string,
+    type_string_matches,
+)
+from eburger.profiler import count_visited_nodes, profiled_helper
 
 
 def join_lists_unique(list1: list, list2: list) -> list:
@@ -44,51 +54,145 @@ def is_entry_unique(results: list, file_path: str, lines: str) -> bool:
     )
 
 
-def get_nodes_by_types(
-    node: dict,
+@profiled_helper
+def iter_nodes(node: Union[dict, list]) -> Iterator[dict]:
+    """
+    Lazily walks the given node or AST depth-first, using an explicit stack.
+
+    :param node: The node or AST to walk.
+    :return: A generator of every dict within node (node included), in walk order.
+    """
+    for current_node, _ in _iter_nodes_with_ancestry(node):
+        yield current_node
+
+
+def _iter_nodes_with_ancestry(node: Union[dict, list]) -> Iterator[tuple]:
+    """
+    Lazily walks the given node or AST depth-first, using an explicit stack.
+
+    :param node: The node or AST to walk.
+    :return: A generator of (dict, ancestry) pairs, where ancestry is a (parent, ancestry) linked pair, or None at the top.
+    """
+    stack = [(node, None)]
+    visited = 0
+    try:
+        while stack:
+            current_node, ancestry = stack.pop()
+            if isinstance(current_node, dict):
+                visited += 1
+                yield current_node, ancestry
+                children = current_node.values()
+                ancestry = (current_node, ancestry)
+            elif isinstance(current_node, Sequence) and not isinstance(
+                current_node, str
+            ):
+                # Lists, NodesView slices and CompactAST source units
+                children = current_node
+            else:
+                continue
+            # Pushed in reverse so children are visited in their original order
+            stack.extend(
+                (child, ancestry)
+                for child in reversed(list(children))
+                if isinstance(child, (dict, list))
+            )
+    finally:
+        # Also when the walk is left early
+        count_visited_nodes(visited)
+
+
+@profiled_helper
+def iter_nodes_by_types(
+    node: Union[dict, list],
     node_types: Union[str, list],
     filter_key: str = None,
     filter_value: str = None,
-) -> list:
+) -> Iterator[dict]:
     """
-    Finds nodes of specific types within the given node or AST.
+    Lazily finds nodes of specific types within the given node or AST, allowing early exits (e.g. any()).
 
     :param node: The node or AST to search.
     :param node_types: The type(s) of nodes to find.
     :param filter_key: A JSON key to find and filter by.
     :param filter_value: filter_key value to search.
-    :return: A list of nodes of the specified types.
+    :return: A generator of nodes of the specified types.
     """
-
     if isinstance(node_types, str):
         node_types = [node_types]
 
-    def search_nodes(current_node, result):
-        if isinstance(current_node, dict):
-            if current_node.get("nodeType") in node_types:
-                result.append(current_node)
-            for value in current_node.values():
-                if isinstance(value, (dict, list)):
-                    search_nodes(value, result)
-        elif isinstance(current_node, list):
-            for item in current_node:
-                search_nodes(item, result)
+    # Queries on the analyzed AST, or on any of its subtrees, are answered from the per-run index
+    context = find_analysis_context(node)
+    if context is not None:
+        if filter_key is None:
+            results = context.nodes_by_types(node_types, node)
+        else:
+            results = context.nodes_by_attribute(
+                node_types, filter_key, filter_value, node
+            )
+        if results is not None:
+            yield from results
+            return
+
+    for current_node in iter_nodes(node):
+        if current_node.get("nodeType") in node_types and (
+            filter_key is None or current_node.get(filter_key) == filter_value
+        ):
+            yield current_node
 
-    results = []
-    search_nodes(node, results)
 
-    # Only after results were colelcted, apply filter if filter_key and filter_value are provided
-    if filter_key is not None:
-        results_filtered = []
-        for result in results:
-            if filter_key is None or result.get(filter_key) == filter_value:
-                results_filtered.append(result)
-        results = results_filtered
+@profiled_helper
+def get_nodes_by_types(
+    node: Union[dict, list],
+    node_types: Union[str, list],
+    filter_key: str = None,
+    filter_value: str = None,
+) -> list:
+    """
+    Finds nodes of specific types within the given node or AST.
+
+    :param node: The node or AST to search.
+    :param node_types: The type(s) of nodes to find.
+    :param filter_key: A JSON key to find and filter by.
+    :param filter_value: filter_key value to search.
+    :return: A list of nodes of the specified types.
+    """
+    return list(iter_nodes_by_types(node, node_types, filter_key, filter_value))
 
-    return results
 
+@profiled_helper
+def iter_nodes_by_signature(
+    node: Union[dict, list], pattern: str, use_regex: bool = False
+) -> Iterator[dict]:
+    """
+    Lazily searches for nodes with a specific typeString within the given node or AST, allowing early exits (e.g. any()).
 
-def get_nodes_by_signature(node: dict, pattern: str, use_regex: bool = False):
+    :param node: The node or AST to search.
+    :param pattern: The typeString to search for (regex).
+    :param use_regex: Whether or not to use regex for the search.
+    :return: A generator of nodes that have the specified typeString.
+    """
+    context = find_analysis_context(node)
+    if context is not None:
+        matching_nodes = context.nodes_by_type_string(pattern, use_regex, node)
+        if matching_nodes is not None:
+            yield from matching_nodes
+            return
+
+    for current_node in iter_nodes(node):
+        # Check if the current node matches the typeString
+        node_type_string = get_type_string(current_node)
+        if node_type_string:
+            if use_regex:
+                if type_string_matches(pattern, node_type_string):
+                    yield current_node
+            elif pattern == node_type_string:
+                yield current_node
+
+
+@profiled_helper
+def get_nodes_by_signature(
+    node: Union[dict, list], pattern: str, use_regex: bool = False
+) -> list:
     """
     Searches for nodes with a specific typeString within the given node or AST.
 
@@ -97,35 +201,10 @@ def get_nodes_by_signature(node: dict, pattern: str, use_regex: bool = False):
     :param use_regex: Whether or not to use regex for the search.
     :return: A list of nodes that have the specified typeString.
     """
-    matching_nodes = []
-    if use_regex:
-        compiled_pattern = re.compile(pattern)
-
-    def search_nodes(current_node):
-        if isinstance(current_node, dict):
-            # Check if the current node matches the typeString
-            node_type_string = current_node.get("typeDescriptions", {}).get(
-                "typeString"
-            )
-            if node_type_string:
-                if use_regex:
-                    if compiled_pattern.search(node_type_string):
-                        matching_nodes.append(current_node)
-                else:
-                    if pattern == node_type_string:
-                        matching_nodes.append(current_node)
-            # Recursively search in child nodes
-            for value in current_node.values():
-                if isinstance(value, (dict, list)):
-                    search_nodes(value)
-        elif isinstance(current_node, list):
-            for item in current_node:
-                search_nodes(item)
-
-    search_nodes(node)
-    return matching_nodes
+    return list(iter_nodes_by_signature(node, pattern, use_regex))
 
 
+@profiled_helper
 def find_node_ids_first_parent_of_type(
     ast: dict, node_id: int, parent_type: dict
 ) -> Union[dict, None]:
@@ -137,37 +216,108 @@ def find_node_ids_first_parent_of_type(
     :param parent_type: The nodeType of the parent node to find.
     :return: The first parent node of the specified type, or None if not found.
     """
-
-    def search_node(current_node, target_id, parent_node=None):
-        if isinstance(current_node, dict):
-            # Check if the current node is the target
-            if current_node.get("id") == target_id:
+    context = find_analysis_context(ast)
+    if context is not None:
+        node = context.node_by_id(node_id, ast)
+        if node is None:
+            return None
+        return context.first_parent_of_type(node, parent_type, ast)
+
+    for current_node, ancestry in _iter_nodes_with_ancestry(ast):
+        # Check if the current node is the target
+        if current_node.get("id") != node_id:
+            continue
+        while ancestry is not None:
+            parent_node, ancestry = ancestry
+            if parent_node.get("nodeType") == parent_type:
                 return parent_node
-            # Iterate over child nodes
-            for key, value in current_node.items():
-                if isinstance(value, (list, dict)):
-                    result = search_node(
-                        value,
-                        target_id,
-                        (
-                            current_node
-                            if current_node.get("nodeType") == parent_type
-                            else parent_node
-                        ),
-                    )
-                    if result:
-                        return result
-        elif isinstance(current_node, list):
-            for item in current_node:
-                if isinstance(item, (list, dict)):
-                    result = search_node(item, target_id, parent_node)
-                    if result:
-                        return result
-        return None
-
-    return search_node(ast, node_id)
+    return None
 
 
+@profiled_helper
+def get_node_by_id(ast: dict, node_id: int) -> Union[dict, None]:
+    """
+    Finds the node with a specific ID in the AST.
+
+    :param ast: The AST to search.
+    :param node_id: The ID of the node to find.
+    :return: The node with the specified ID, or None if not found.
+    """
+    context = find_analysis_context(ast)
+    if context is not None:
+        return context.node_by_id(node_id, ast)
+
+    for current_node in iter_nodes(ast):
+        if current_node.get("id") == node_id:
+            return current_node
+    return None
+
+
+@profiled_helper
+def get_parent(ast: dict, node: dict) -> Union[dict, None]:
+    """
+    Finds the closest parent node of a given node in the AST.
+
+    :param ast: The AST to search.
+    :param node: The node whose parent is to be found.
+    :return: The parent node, or None if node is the AST root or isn't part of it.
+    """
+    context = find_analysis_context(ast)
+    if context is not None:
+        return context.parent_of(node, ast)
+
+    for current_node, ancestry in _iter_nodes_with_ancestry(ast):
+        if current_node is node:
+            return ancestry[0] if ancestry is not None else None
+    return None
+
+
+def sort_nodes_by_location(nodes: list) -> list:
+    """
+    Sorts nodes by their source location, using the src attributes decoded at index time.
+
+    :param nodes: List of nodes to sort.
+    :return: A new list ordered by file index, then start offset (enclosing nodes first).
+    """
+
+    def location_key(node):
+        start, length, file_index = get_src_location(node)
+        return file_index, start, -length
+
+    return sorted(nodes, key=location_key)
+
+
+def is_node_before(node: dict, other_node: dict) -> bool:
+    """
+    Checks if a node's source code ends before another node's begins, in the same file.
+
+    :param node: The node expected first.
+    :param other_node: The node expected after it.
+    :return: True if node is located before other_node.
+    """
+    start, length, file_index = get_src_location(node)
+    other_start, _, other_file_index = get_src_location(other_node)
+    if start < 0 or other_start < 0 or file_index != other_file_index:
+        return False
+    return start + length <= other_start
+
+
+def is_node_within(node: dict, outer_node: dict) -> bool:
+    """
+    Checks if a node's source code range is contained in another node's, in the same file.
+
+    :param node: The inner node.
+    :param outer_node: The node expected to contain it.
+    :return: True if node is located within outer_node.
+    """
+    start, length, file_index = get_src_location(node)
+    outer_start, outer_length, outer_file_index = get_src_location(outer_node)
+    if start < 0 or outer_start < 0 or file_index != outer_file_index:
+        return False
+    return outer_start <= start and start + length <= outer_start + outer_length
+
+
+@profiled_helper
 def function_def_has_following_check_statements(
     function_def: dict, id_key: str
 ) -> bool:
@@ -192,18 +342,19 @@ def function_def_has_following_check_statements(
                 statement = statement.get("expression")
 
             # Check for require statements
-            require_stmts = get_nodes_by_types(
-                statement, "Identifier", filter_key="name", filter_value="require"
-            )
-            if require_stmts:
+            if any(
+                iter_nodes_by_types(
+                    statement, "Identifier", filter_key="name", filter_value="require"
+                )
+            ):
                 return True
 
             # Check for direct reverts
-            revert_stmts = get_nodes_by_types(
-                statement, "Identifier", filter_key="name", filter_value="revert"
-            )
-
-            if revert_stmts:
+            if any(
+                iter_nodes_by_types(
+                    statement, "Identifier", filter_key="name", filter_value="revert"
+                )
+            ):
                 return True
 
         # If we find the target node, start the check
@@ -214,6 +365,19 @@ def function_def_has_following_check_statements(
     return False
 
 
+@profiled_helper
+def get_statements_view(node: dict, start: int = None, stop: int = None) -> NodesView:
+    """
+    Copy-free, read-only slice of a node's statements, usable as a search root by every query helper.
+
+    :param node: A node holding statements (e.g. a Block, or a function body).
+    :param start: Index of the first statement in the view.
+    :param stop: Index the view stops before.
+    :return: A NodesView over node["statements"][start:stop].
+    """
+    return NodesView(node.get("statements", []), start, stop)
+
+
 def deep_clone_node(node: dict):
     """
     Deep clone an AST node for template level manipulations.
@@ -1,4 +1,21 @@
 import argparse
+import math
+import sys
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected a number of 1 or more, got {value}")
+    return number
+
+
+def positive_float(value: str) -> float:
+    number = float(value)
+    if not 0 < number < math.inf:
+        raise argparse.ArgumentTypeError(f"expected a number above 0, got {value}")
+    return number
+
 
 parser = argparse.ArgumentParser(description="help")
 
@@ -45,7 +62,7 @@ parser.add_argument(
     type=str,
     nargs="+",
     default=[],
-    help="Exclude logging output types (e.g. info warning success insights)",
+    help="Exclude logging output types (e.g. info warning success insights), or templates of given severities (e.g. low medium)",
 )
 parser.add_argument(
     "-t",
@@ -53,7 +70,61 @@ parser.add_argument(
     dest="template_paths",
     type=str,
     nargs="+",
-    help="Path to eburger yaml templates folder",
+    help="Path to eburger yaml templates folder, yaml template or templates bundle (see eburger templates pack)",
+)
+parser.add_argument(
+    "-sv",
+    "--severities",
+    dest="severities",
+    type=str.casefold,
+    nargs="+",
+    default=[],
+    help="Only execute templates of these severities (e.g. high medium)",
+)
+parser.add_argument(
+    "-pr",
+    "--precisions",
+    dest="precisions",
+    type=str.casefold,
+    nargs="+",
+    default=[],
+    help="Only execute templates of these precisions (e.g. high)",
+)
+parser.add_argument(
+    "-it",
+    "--include-templates",
+    dest="include_templates",
+    type=str,
+    nargs="+",
+    default=[],
+    help="Only execute templates whose name or file name matches one of these globs (e.g. '*reentrancy*')",
+)
+parser.add_argument(
+    "-et",
+    "--exclude-templates",
+    dest="exclude_templates",
+    type=str,
+    nargs="+",
+    default=[],
+    help="Skip templates whose name or file name matches one of these globs",
+)
+parser.add_argument(
+    "-tg",
+    "--tags",
+    dest="tags",
+    type=str.casefold,
+    nargs="+",
+    default=[],
+    help="Only execute templates having one of these tags",
+)
+parser.add_argument(
+    "-etg",
+    "--exclude-tags",
+    dest="exclude_tags",
+    type=str.casefold,
+    nargs="+",
+    default=[],
+    help="Skip templates having one of these tags",
 )
 parser.add_argument(
     "-d",
@@ -100,6 +171,95 @@ parser.add_argument(
     help="Output file paths in relative format rather than full paths",
 )
 
+parser.add_argument(
+    "-ca",
+    "--compact-ast",
+    dest="compact_ast",
+    action="store_true",
+    help="Keep the AST in a compact array-backed form, decoding source units only when templates touch them (lowers memory use on large build-info files)",
+)
+
+parser.add_argument(
+    "-pl",
+    "--pipeline",
+    dest="pipeline",
+    action="store_true",
+    help="Decode the compilation output one source unit at a time, running file scoped templates on each source unit as soon as it's decoded (foundry, hardhat and -a ASTs)",
+)
+
+parser.add_argument(
+    "-j",
+    "--jobs",
+    dest="jobs",
+    type=positive_int,
+    help="Execute templates in N forked worker processes sharing the parsed AST (not available on Windows)",
+)
+
+parser.add_argument(
+    "-to",
+    "--timeout",
+    dest="template_timeout",
+    type=positive_float,
+    help="Time budget in seconds for each template, templates running longer are stopped and reported as timed out (a template's own timeout takes precedence). Each budgeted template execution, per source unit for file scoped templates, runs in its own forked process, alongside the other templates",
+)
+
+parser.add_argument(
+    "-mf",
+    "--max-findings-per-template",
+    dest="max_findings_per_template",
+    type=positive_int,
+    help="Stop each template once it reports N findings",
+)
+
+parser.add_argument(
+    "-ff",
+    "--fail-fast-on",
+    dest="fail_fast_on",
+    type=str.casefold,
+    choices=["low", "medium", "high"],
+    help="Stop the analysis as soon as a finding of this severity or higher is found, and exit with status 1 (e.g. --fail-fast-on high)",
+)
+
+parser.add_argument(
+    "-sh",
+    "--split-heavy-templates",
+    dest="split_heavy_templates",
+    action="store_true",
+    help="Execute contract scoped templates that ran longest in previous runs on each contract separately, spreading them across workers",
+)
+
+parser.add_argument(
+    "-p",
+    "--profile",
+    dest="profile",
+    action="store_true",
+    help="Profile template executions and report the time, helper calls and AST nodes scanned by helpers of each template",
+)
+
+parser.add_argument(
+    "-pd",
+    "--profile-dump",
+    dest="profile_dump",
+    action="store_true",
+    help="Profile templates, and also dump each template's cProfile stats and profile record to .eburger/profiles",
+)
+
+parser.add_argument(
+    "-inc",
+    "--incremental",
+    dest="incremental",
+    action="store_true",
+    help="Reuse the previous run's results for templates whose template file and source files (including imports) are unchanged",
+)
+
+parser.add_argument(
+    "-nc",
+    "--no-template-cache",
+    dest="no_template_cache",
+    action="store_true",
+    help="Parse and compile templates from scratch instead of using the compiled templates cache",
+)
+
 parser.add_argument(
     "-v",
     "--version",
@@ -116,4 +276,42 @@ parser.add_argument(
     default=".",
     help=argparse.SUPPRESS,
 )
-args = parser.parse_args()
+
+# Parser of "eburger templates <command>", the analysis options keep their defaults
+templates_parser = argparse.ArgumentParser(
+    prog="eburger templates", description="Manage eburger templates"
+)
+templates_parser.add_argument(
+    "templates_command",
+    choices=["pack"],
+    help="pack: bundle templates into a single file, with their metadata validated and code precompiled, for -t to load in one read",
+)
+templates_parser.add_argument(
+    "-t",
+    "--templates",
+    dest="template_paths",
+    type=str,
+    nargs="+",
+    help="Templates folders or files to pack, the builtin templates by default",
+)
+templates_parser.add_argument(
+    "-o",
+    "--output",
+    dest="bundle_path",
+    type=str,
+    default="templates.ebundle",
+    help="Path of the bundle to write (default: templates.ebundle)",
+)
+templates_parser.add_argument(
+    "-d",
+    "--debug",
+    dest="debug",
+    action="store_true",
+    help="Print debug output",
+)
+
+if sys.argv[1:2] == ["templates"]:
+    args = parser.parse_args([], namespace=templates_parser.parse_args(sys.argv[2:]))
+else:
+    args = parser.parse_args()
+    args.templates_command = None
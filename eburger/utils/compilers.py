@@ -3,15 +3,19 @@ import os
 import shutil
 import sys
 from pathlib import Path
+from typing import Union
 
 from eburger import settings
-from eburger.serializer import reduce_json
+from eburger.compact_ast import CompactAST
+from eburger.serializer import SourceUnitStream, load_compact_ast, reduce_json
 from eburger.utils.cli_args import args
 from eburger.utils.filesystem import (
     create_or_empty_directory,
     find_and_read_sol_file,
     get_foundry_ast_json,
+    get_foundry_build_info_path,
     get_hardhat_ast_json,
+    get_hardhat_build_info_path,
     get_solidity_version_from_file,
 )
 from eburger.utils.helpers import (
@@ -79,7 +83,9 @@ def compile_solc(path_type: str) -> tuple[Path, dict, str, list, dict]:
     return output_filename, ast_json, filename, src_paths, solc_compile_res_parsed
 
 
-def compile_foundry(forge_full_path_binary_found: bool) -> tuple[Path, dict, str, list]:
+def compile_foundry(
+    forge_full_path_binary_found: bool,
+) -> tuple[Path, Union[dict, CompactAST, SourceUnitStream], str, list]:
     # Call foundry's full path if necessary, otherwise use the bins available through PATH
     forge_clean_command = "forge clean"
     if forge_full_path_binary_found:
@@ -108,14 +114,23 @@ def compile_foundry(forge_full_path_binary_found: bool) -> tuple[Path, dict, str
     )
     sample_file_path = find_and_read_sol_file(args.solidity_file_or_folder)
     filename, output_filename = get_filename_from_path(sample_file_path)
-    ast_json = get_foundry_ast_json(forge_out_dir)
-
-    ast_json, src_paths = reduce_json(ast_json)
+    if args.compact_ast:
+        ast_json, src_paths = load_compact_ast(
+            get_foundry_build_info_path(forge_out_dir)
+        )
+    elif args.pipeline:
+        ast_json = SourceUnitStream(get_foundry_build_info_path(forge_out_dir))
+        src_paths = ast_json.src_paths
+    else:
+        ast_json = get_foundry_ast_json(forge_out_dir)
+        ast_json, src_paths = reduce_json(ast_json)
 
     return output_filename, ast_json, filename, src_paths
 
 
-def compile_hardhat() -> tuple[Path, dict, str, list]:
+def compile_hardhat() -> (
+    tuple[Path, Union[dict, CompactAST, SourceUnitStream], str, list]
+):
     # try runing npx normally, as a fallback try the construct_sourceable_nvm_string method
     # if a user hadn't got npx installed / or it's not on path (meaning it was installed in same run as the analysis)
     # it still needs the fallback option
@@ -154,8 +169,15 @@ def compile_hardhat() -> tuple[Path, dict, str, list]:
     sample_file_path = find_and_read_sol_file(args.solidity_file_or_folder)
     filename, output_filename = get_filename_from_path(sample_file_path)
 
-    ast_json = get_hardhat_ast_json(hardhat_out_dir)
-
-    ast_json, src_paths = reduce_json(ast_json)
+    if args.compact_ast:
+        ast_json, src_paths = load_compact_ast(
+            get_hardhat_build_info_path(hardhat_out_dir)
+        )
+    elif args.pipeline:
+        ast_json = SourceUnitStream(get_hardhat_build_info_path(hardhat_out_dir))
+        src_paths = ast_json.src_paths
+    else:
+        ast_json = get_hardhat_ast_json(hardhat_out_dir)
+        ast_json, src_paths = reduce_json(ast_json)
 
     return output_filename, ast_json, filename, src_paths
@@ -132,7 +132,7 @@ def create_or_empty_directory(directory_path: Path):
 
 
 # TODO: Add better handling for multiple build info files
-def get_foundry_ast_json(forge_out_dir) -> dict:
+def get_foundry_build_info_path(forge_out_dir) -> str:
     try:
         json_files = [f for f in os.listdir(forge_out_dir) if f.endswith(".json")]
     except FileNotFoundError:
@@ -156,14 +156,18 @@ def get_foundry_ast_json(forge_out_dir) -> dict:
         json_files,
         key=lambda x: os.path.getctime(os.path.join(forge_out_dir, x)),
     )
-    latest_file_path = os.path.join(forge_out_dir, latest_file)
+    return os.path.join(forge_out_dir, latest_file)
+
+
+def get_foundry_ast_json(forge_out_dir) -> dict:
+    latest_file_path = get_foundry_build_info_path(forge_out_dir)
     with open(latest_file_path, "r") as f:
         ast_json = json.load(f)
     return ast_json["output"]
 
 
 # TODO: Add better handling for multiple build info files
-def get_hardhat_ast_json(hardhat_out_dir) -> dict:
+def get_hardhat_build_info_path(hardhat_out_dir) -> str:
     json_files = [f for f in os.listdir(hardhat_out_dir) if f.endswith(".json")]
     if not json_files:
         log("error", "npx hardhat compile generated no output.")
@@ -176,7 +180,11 @@ def get_hardhat_ast_json(hardhat_out_dir) -> dict:
         json_files,
         key=lambda x: os.path.getctime(os.path.join(hardhat_out_dir, x)),
     )
-    latest_file_path = os.path.join(hardhat_out_dir, latest_file)
+    return os.path.join(hardhat_out_dir, latest_file)
+
+
+def get_hardhat_ast_json(hardhat_out_dir) -> dict:
+    latest_file_path = get_hardhat_build_info_path(hardhat_out_dir)
     with open(latest_file_path, "r") as f:
         ast_json = json.load(f)
     return ast_json["output"]
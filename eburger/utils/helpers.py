@@ -3,11 +3,14 @@ import os
 import re
 import shlex
 import subprocess
+import sys
 from datetime import datetime
+from functools import lru_cache
 from importlib.metadata import version
 from pathlib import Path
 
 from eburger import settings
+from eburger.analysis_context import get_src_location
 from eburger.utils.cli_args import args
 from eburger.utils.filesystem import get_all_solidity_files
 from eburger.utils.logger import log
@@ -157,10 +160,45 @@ def python_shell_source(execute_source: bool = True) -> tuple[str, str]:
     return source_syntax, and_sign
 
 
+def is_free_threaded() -> bool:
+    """
+    Checks whether Python runs without the GIL, as free-threaded builds (e.g. python3.13t)
+    do unless the GIL is turned back on (PYTHON_GIL=1).
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def get_cpu_count() -> int:
+    # The cores this process may run on, Python 3.13+ accounts for CPU affinity
+    cpu_count = getattr(os, "process_cpu_count", os.cpu_count)()
+    return cpu_count or 1
+
+
+# Looked up in the installed package metadata, checked for every template
+@lru_cache(maxsize=None)
 def get_eburger_version() -> str:
     return parse_version(version("eburger"))
 
 
+def get_source_file_path(project_relative_file_name: str) -> str:
+    """
+    Resolves the path of a source file of the AST.
+
+    :param project_relative_file_name: The file's path as listed in the AST's sources.
+    :return: The absolute path of the file.
+    """
+    if args.solidity_file_or_folder and args.ast_json_file:
+        return str(
+            Path(
+                settings.project_root
+                / Path(args.solidity_file_or_folder)
+                / project_relative_file_name
+            ).resolve()
+        )
+    return str(Path(settings.project_root / project_relative_file_name).resolve())
+
+
 def parse_code_highlight(node: dict, src_paths: list) -> tuple[str, str, str]:
     """
     Extracts and highlights a specific code snippet from a source file based on a given AST node.
@@ -181,8 +219,9 @@ def parse_code_highlight(node: dict, src_paths: list) -> tuple[str, str, str]:
     messages and null values are returned.
     """
 
-    src_location = node.get("src", "")
-    file_index = int(src_location.split(":")[2])
+    start_offset, length, file_index = get_src_location(node)
+    if file_index < 0:
+        raise ValueError(f"Malformed AST src node: {node.get('src')}")
 
     if file_index < len(src_paths):
         project_relative_file_name = src_paths[file_index]
@@ -190,26 +229,13 @@ def parse_code_highlight(node: dict, src_paths: list) -> tuple[str, str, str]:
         log("warning", "Unrecognized AST src node, using default source file.")
         project_relative_file_name = src_paths[0]
 
-    if args.solidity_file_or_folder and args.ast_json_file:
-        file_path = str(
-            Path(
-                settings.project_root
-                / Path(args.solidity_file_or_folder)
-                / project_relative_file_name
-            ).resolve()
-        )
-    else:
-        file_path = str(
-            Path(settings.project_root / project_relative_file_name).resolve()
-        )
+    file_path = get_source_file_path(project_relative_file_name)
 
     if args.relative_file_paths:
         result_file_path_uri = project_relative_file_name
     else:
         result_file_path_uri = file_path
 
-    start_offset, length, _ = map(int, src_location.split(":"))
-
     file_content = None
     try:
         with open(file_path, "r") as file:
@@ -1,4 +1,5 @@
 import sys
+import threading
 from eburger.utils.cli_args import args
 
 
@@ -38,7 +39,17 @@ def construct_insight_occurrences(results: list) -> list:
     return occurrences
 
 
+# Keeps messages logged from concurrently running templates from interleaving. Reentrant,
+# as logging insights logs warnings
+_log_lock = threading.RLock()
+
+
 def log(type: str, message: str, sorry: bool = False):
+    with _log_lock:
+        _log(type, message, sorry)
+
+
+def _log(type: str, message: str, sorry: bool):
     match type:
         case "success":
             if "success" not in args.no:
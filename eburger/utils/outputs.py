@@ -355,3 +355,30 @@ def draw_nsloc_table():
 
     print(table)
     sys.exit(0)
+
+
+def draw_profile_table(profile: list):
+    table = PrettyTable()
+    table.field_names = [
+        "Template",
+        "Wall time (s)",
+        "CPU time (s)",
+        "Helper calls",
+        "Nodes visited",
+        "Results",
+    ]
+    table.align["Template"] = "l"
+
+    for record in profile:
+        table.add_row(
+            [
+                record.get("template"),
+                f"{record.get('wall_time'):.4f}",
+                f"{record.get('cpu_time'):.4f}",
+                record.get("helper_calls"),
+                record.get("nodes_visited"),
+                record.get("results"),
+            ]
+        )
+
+    print(table)
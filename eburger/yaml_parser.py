@@ -1,31 +1,154 @@
 import concurrent.futures
+import fnmatch
+import gc
+import multiprocessing
+import os
+import sys
+import threading
+import time
 import traceback
+from collections.abc import Sequence
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from types import CodeType, GeneratorType
+from typing import Union
 
-import yaml
 from packaging.version import parse as parse_version
 
-from eburger import settings
-from eburger.template_utils import *
+from eburger import settings, template_utils
+from eburger.analysis_context import (
+    AnalysisContext,
+    NodesView,
+    register_analysis_context,
+    use_analysis_context,
+)
+from eburger.facts import SourceUnitFacts, get_facts, get_referenced_facts
+from eburger.matcher import VisitContext, compile_match_patterns, run_match_patterns
+from eburger.profiler import profile_template
+from eburger.result_cache import (
+    get_run_signature,
+    get_source_unit_hashes,
+    get_task_cache_key,
+    load_result_cache,
+    save_result_cache,
+)
+from eburger.scheduler import (
+    estimate_task_time,
+    find_heavy_tasks,
+    get_task_timing_key,
+    load_template_timings,
+    order_longest_first,
+    record_task_times,
+    save_template_timings,
+)
+from eburger.serializer import SourceUnitStream
+from eburger.template_cache import (
+    BUNDLE_SUFFIX,
+    TEMPLATE_GENERATOR_NAME,
+    compile_python_section,
+    find_template_files,
+    load_template,
+    load_template_bundle,
+)
 from eburger.utils.cli_args import args
-from eburger.utils.helpers import get_eburger_version, parse_code_highlight
+from eburger.utils.helpers import (
+    get_cpu_count,
+    get_eburger_version,
+    is_free_threaded,
+    parse_code_highlight,
+)
 from eburger.utils.logger import color, log
 
 
+# The API template code runs against: the template_utils helpers, and the run's logger and
+# arguments, which templates used to reach through this module's globals
+TEMPLATE_API = {
+    **{
+        name: value
+        for name, value in vars(template_utils).items()
+        if not name.startswith("_")
+    },
+    "args": args,
+    "settings": settings,
+    "log": log,
+}
+
+
+SEVERITIES = ["low", "medium", "high"]
+
+# Set once a finding reaching --fail-fast-on is found, stops the templates still running
+_stop_run = threading.Event()
+
+
+def is_fail_fast_severity(severity: str) -> bool:
+    """
+    Checks whether a template severity is the --fail-fast-on severity or higher.
+    """
+    severity = str(severity).casefold()
+    return (
+        args.fail_fast_on is not None
+        and severity in SEVERITIES
+        and SEVERITIES.index(severity) >= SEVERITIES.index(args.fail_fast_on)
+    )
+
+
+def reaches_fail_fast_severity(insight: dict) -> bool:
+    return bool(insight.get("results")) and is_fail_fast_severity(
+        insight.get("severity")
+    )
+
+
+def get_template_globals() -> dict:
+    """
+    Returns fresh globals for executing template code, seeded with TEMPLATE_API.
+
+    Each execution gets its own namespace, so whatever a template defines or shadows stays
+    within it, and templates running concurrently share nothing but the AST.
+    """
+    template_globals = dict(TEMPLATE_API)
+    template_globals["project_root"] = settings.project_root
+    return template_globals
+
+
 def execute_python_code(
-    template_name: str, python_code: str, ast_data: dict, src_paths: list
+    template_name: str,
+    python_code: Union[str, CodeType],
+    ast_data: dict,
+    src_paths: list,
+    matches: list = None,
+    facts=None,
+    max_results: int = None,
 ) -> list:
-    local_vars = {
-        "ast_data": ast_data,
-        "project_root": settings.project_root,
-    }
+    # A single namespace, so functions the template defines can call one another
+    template_globals = get_template_globals()
+    template_globals.update(
+        {
+            "ast_data": ast_data,
+            # Memoized facts about the AST shared by all templates, e.g. facts.state_variables
+            "facts": facts if facts is not None else get_facts(ast_data),
+            # Nodes found by the template's match and visit sections, if it has them
+            "matches": matches if matches is not None else [],
+        }
+    )
 
     try:
-        compiled_code = compile(python_code, "<string>", "exec")
-        exec(compiled_code, globals(), local_vars)
+        # Templates made only of match and visit sections report their matches as is
+        if python_code is None:
+            results = template_globals["matches"]
+        else:
+            compiled_code = python_code
+            if not isinstance(compiled_code, CodeType):
+                compiled_code = compile_python_section(python_code)
+            exec(compiled_code, template_globals)
+            if TEMPLATE_GENERATOR_NAME in template_globals:
+                # Findings are resolved as the template yields them
+                results = template_globals[TEMPLATE_GENERATOR_NAME]()
+            else:
+                results = template_globals["results"]
 
         parsed_results = []
 
-        for result in local_vars["results"]:
+        for result in results:
             if result.get("nodeType", None) is None:
                 log(
                     "warning",
@@ -37,38 +160,506 @@ def execute_python_code(
             parsed_results.append(
                 {"file": file_path, "lines": lines, "code": vuln_code}
             )
+            if len(parsed_results) == max_results or _stop_run.is_set():
+                break
 
+        if isinstance(results, GeneratorType):
+            results.close()
         return parsed_results
 
     except Exception as e:
-        line = f"Error occurred during execution: {str(e)}"
+        log_template_error(template_name, e)
+
+
+def log_template_error(template_name: str, e: Exception):
+    line = f"Error occurred during execution: {str(e)}"
+    try:
+        line += f" at line {traceback.extract_tb(e.__traceback__)[-1][1]}"
+    except Exception as e:
+        line = f"failed extracting traceback - {line}"
+    log("error", f"Failed parsing template {template_name} -> {line}", sorry=True)
+
+
+def load_template_visitors(
+    template_name: str, visit_code: Union[str, CodeType]
+) -> dict:
+    """
+    Executes a template's visit section, collecting the on_<NodeType>(node, ctx) callbacks it
+    defines.
+
+    :param template_name: The template's name, for error reporting.
+    :param visit_code: The source or compiled code of the visit section.
+    :return: nodeType -> callback.
+    """
+    # Own globals, so callbacks can call the other functions the section defines
+    visitor_globals = get_template_globals()
+    try:
+        if not isinstance(visit_code, CodeType):
+            visit_code = compile(visit_code, "<string>", "exec")
+        exec(visit_code, visitor_globals)
+    except Exception as e:
+        log_template_error(template_name, e)
+
+    return {
+        name[len("on_") :]: callback
+        for name, callback in visitor_globals.items()
+        if name.startswith("on_") and callable(callback)
+    }
+
+
+def find_template_matches(templates: dict, ast_data) -> dict:
+    """
+    Evaluates the match and visit sections of templates together, in a single AST traversal.
+
+    :param templates: Template key -> loaded template.
+    :param ast_data: The analyzed AST.
+    :return: Template key -> matched and reported nodes, for templates with these sections.
+    """
+    template_patterns = {}
+    template_visitors = {}
+    for template_key, template in templates.items():
+        yaml_data = template["metadata"]
+        if not is_template_compatible(yaml_data):
+            continue
+        if yaml_data.get("match") is not None:
+            try:
+                template_patterns[template_key] = compile_match_patterns(
+                    yaml_data["match"]
+                )
+            except ValueError as e:
+                log(
+                    "error",
+                    f"Invalid match section in template {yaml_data.get('name')} -> {e}",
+                )
+        if yaml_data.get("visit") is not None:
+            template_visitors[template_key] = (
+                VisitContext(ast_data),
+                load_template_visitors(
+                    yaml_data.get("name"), template["visit_code"] or yaml_data["visit"]
+                ),
+            )
+
+    template_matches = run_match_patterns(
+        template_patterns, ast_data, template_visitors
+    )
+    for template_key, (visit_context, _) in template_visitors.items():
+        if visit_context.error is not None:
+            log_template_error(
+                templates[template_key]["metadata"].get("name"), visit_context.error
+            )
+        template_matches.setdefault(template_key, []).extend(visit_context.results)
+    return template_matches
+
+
+# The run forked template workers inherit from the parent, see process_files_concurrently
+_inherited_run = {}
+
+
+def process_inherited_yaml(
+    file_path: str, unit_index: int = None, contract_index: int = None
+) -> dict:
+    """
+    Runs a template in a forked worker, on the AST and templates inherited from the parent.
+
+    :param file_path: The template's key in the inherited run.
+    :param unit_index: The source unit to run a file or contract scoped template on.
+    :param contract_index: The contract to run a contract scoped template on, see
+    process_yaml.
+    :return: The template's insight dict.
+    """
+    return process_yaml(
+        file_path,
+        _inherited_run["ast_data"],
+        _inherited_run["src_paths"],
+        _inherited_run["templates"][file_path],
+        _inherited_run["task_matches"].get((file_path, unit_index)),
+        unit_index,
+        contract_index,
+    )
+
+
+def run_timed(function, *function_args) -> tuple:
+    """
+    Calls a function, timing it for scheduling later runs, see scheduler.py.
+
+    :return: The function's return value, and the seconds it took.
+    """
+    start = time.perf_counter()
+    value = function(*function_args)
+    return value, time.perf_counter() - start
+
+
+def share_run_with_forks(
+    ast_data, src_paths: list, templates: dict, task_matches: dict
+):
+    """
+    Prepares the run's state to be inherited by forked template workers.
+
+    Nothing is pickled on the way in: workers inherit the AST, its analysis indexes and the
+    compiled templates copy-on-write, and only the insight dicts are sent back.
+    """
+    _inherited_run.update(
+        {
+            "ast_data": ast_data,
+            "src_paths": src_paths,
+            "templates": templates,
+            "task_matches": task_matches,
+        }
+    )
+    # Built before forking, so workers share the indexes instead of each building their own
+    register_analysis_context(ast_data).ensure_index()
+    # Same for the facts templates reference
+    facts = get_facts(ast_data)
+    for template in templates.values():
+        if template["code"] is not None:
+            for name in get_referenced_facts(template["code"]):
+                facts.of_source_unit(name, 0)
+    # Keeps the garbage collector from touching, and so copying, the inherited objects
+    gc.freeze()
+
+
+def create_thread_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Creates the thread pool templates are executed in.
+
+    Without the GIL (free-threaded Python) templates run in parallel, so the pool gets a
+    thread per core. With it, the executor's default size is kept, as threads only overlap
+    template code with I/O.
+
+    Dumping profiles runs templates one at a time: Python 3.12+ allows a single active
+    cProfile, which records every thread.
+    """
+    if args.profile_dump:
+        return concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    if is_free_threaded():
+        log(
+            "debug",
+            f"Free-threaded Python, executing templates on {get_cpu_count()} threads.",
+        )
+        return concurrent.futures.ThreadPoolExecutor(max_workers=get_cpu_count())
+    return concurrent.futures.ThreadPoolExecutor()
+
+
+def create_forked_process_pool(jobs: int) -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Creates a process pool whose workers are forked with the run's state already loaded, see
+    share_run_with_forks.
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+    )
+
+
+def get_template_budget(yaml_data: dict) -> Union[float, None]:
+    """
+    Returns the time budget of a template, from its timeout or the --timeout option.
+
+    :param yaml_data: The parsed template.
+    :return: The budget in seconds, or None if the template can run as long as it takes.
+    """
+    budget = yaml_data.get("timeout", args.template_timeout)
+    if budget is None:
+        return None
+    if isinstance(budget, bool) or not isinstance(budget, (int, float)) or budget <= 0:
+        log(
+            "error",
+            f"Invalid timeout in template {yaml_data.get('name')}, expected a positive number of seconds.",
+        )
+    return float(budget)
+
+
+def process_budgeted_yaml(task: tuple, connection: Connection):
+    """
+    Runs a template in a forked child process, sending its outcome back to the parent.
+    """
+    try:
+        connection.send(("insight", process_inherited_yaml(*task)))
+    except SystemExit as e:
+        # Errors were already logged by the child, the parent exits the same way
+        connection.send(("exit", e.code))
+    except Exception as e:
+        connection.send(("error", str(e)))
+    finally:
+        connection.close()
+
+
+def run_budgeted_templates(
+    budgets: dict,
+    max_workers: int,
+    timed_out: list,
+    durations: dict = None,
+    control: Connection = None,
+) -> dict:
+    """
+    Runs templates in forked child processes, killing the ones exceeding their time budget.
+
+    :param budgets: (template key, source unit index or None) task -> time budget in seconds,
+    tasks start in this order.
+    :param max_workers: How many templates to run at once.
+    :param timed_out: Filled with a record of each template that was killed.
+    :param durations: Filled with the seconds each task ran for, their budget for the ones
+    that were killed.
+    :param control: When running in a budget supervisor, its connection with the parent,
+    which sends on it to stop the run, and is sent "stopped" when a finding fails the run.
+    :return: Task -> insight dict, for tasks that completed within their budget.
+    """
+    if durations is None:
+        durations = {}
+    fork_context = multiprocessing.get_context("fork")
+    pending = list(budgets)
+    # Receiving connection -> (task, process, deadline)
+    running = {}
+    outcomes = {}
+
+    while pending or running:
+        if _stop_run.is_set():
+            # Like in the pool, running templates still report their findings, within their
+            # budget, and the rest never start
+            pending.clear()
+            if not running:
+                break
+        while pending and len(running) < max_workers:
+            task = pending.pop(0)
+            receiver, sender = fork_context.Pipe(duplex=False)
+            process = fork_context.Process(
+                target=process_budgeted_yaml, args=(task, sender), daemon=True
+            )
+            process.start()
+            sender.close()
+            running[receiver] = (task, process, time.monotonic() + budgets[task])
+
+        connections = list(running)
+        if control is not None and not _stop_run.is_set():
+            connections.append(control)
+        next_deadline = min(deadline for _, _, deadline in running.values())
+        for receiver in wait(connections, max(0, next_deadline - time.monotonic())):
+            if receiver is control:
+                try:
+                    control.recv()
+                except EOFError:
+                    pass
+                _stop_run.set()
+                continue
+            task, process, deadline = running.pop(receiver)
+            try:
+                status, value = receiver.recv()
+            except EOFError:
+                status, value = "error", f"worker exited with code {process.exitcode}"
+            receiver.close()
+            process.join()
+            durations[task] = time.monotonic() - deadline + budgets[task]
+            if status == "exit":
+                sys.exit(value)
+            elif status == "error":
+                log("error", f"Unhandled error in {task[0]}: {value}", sorry=True)
+            outcomes[task] = value
+            if reaches_fail_fast_severity(value) and not _stop_run.is_set():
+                _stop_run.set()
+                if control is not None:
+                    control.send(("stopped", None))
+
+        now = time.monotonic()
+        for receiver, (task, process, deadline) in list(running.items()):
+            if now < deadline:
+                continue
+            process.kill()
+            process.join()
+            receiver.close()
+            del running[receiver]
+            durations[task] = budgets[task]
+
+            file_path, unit_index = task
+            template_name = _inherited_run["templates"][file_path]["metadata"].get(
+                "name"
+            )
+            record = {
+                "name": template_name,
+                "template": file_path,
+                "timeout": budgets[task],
+            }
+            if unit_index is not None:
+                record["source_unit"] = _inherited_run["ast_data"][unit_index].get(
+                    "absolutePath"
+                )
+            timed_out.append(record)
+            log(
+                "warning",
+                f"Template '{template_name}' exceeded its {budgets[task]:g}s time budget and was stopped.",
+            )
+    return outcomes
+
+
+def supervise_budgeted_templates(
+    budgets: dict, max_workers: int, connection: Connection
+):
+    """
+    Runs budgeted templates in a forked child, alongside the parent's pool, sending their
+    outcomes back to the parent, see run_budgeted_templates.
+
+    The child is forked before the pool starts any thread, so forking each template from it
+    never copies a lock another thread holds.
+    """
+    timed_out = []
+    durations = {}
+    try:
+        outcomes = run_budgeted_templates(
+            budgets, max_workers, timed_out, durations, connection
+        )
+        connection.send(("done", (outcomes, timed_out, durations)))
+    except SystemExit as e:
+        # Errors were already logged by the supervisor, the parent exits the same way
+        connection.send(("exit", e.code))
+    except Exception as e:
+        connection.send(("error", str(e)))
+    finally:
+        connection.close()
+
+
+def receive_budgeted_outcomes(connection: Connection, futures: dict) -> tuple:
+    """
+    Waits for a budget supervisor to finish, stopping the pool if a budgeted template's
+    finding fails the run.
+
+    :param connection: The parent's connection with the supervisor.
+    :param futures: The pool's futures, cancelled when the run is stopped.
+    :return: The supervisor's last (status, value) message.
+    """
+    while True:
         try:
-            line += f" at line {traceback.extract_tb(e.__traceback__)[-1][1]}"
-        except Exception as e:
-            line = f"failed extracting traceback - {line}"
-        log("error", f"Failed parsing template {template_name} -> {line}", sorry=True)
+            status, value = connection.recv()
+        except EOFError:
+            return "error", "the budget supervisor exited"
+        if status != "stopped":
+            return status, value
+        # Running templates see _stop_run, the rest never start
+        _stop_run.set()
+        for future in futures:
+            future.cancel()
 
 
-# Function to process a single YAML file
-def process_yaml(file_path, ast_data, src_paths):
-    with open(file_path, "r") as file:
-        yaml_data = yaml.safe_load(file)
+def get_profile_dump_path(
+    file_path, unit_index: int = None, contract_index: int = None
+) -> Union[Path, None]:
+    if not args.profile_dump:
+        return None
+    dump_name = Path(file_path).stem
+    if unit_index is not None:
+        dump_name += f".{unit_index}"
+    if contract_index is not None:
+        dump_name += f".{contract_index}"
+    return settings.outputs_dir / "profiles" / f"{dump_name}.pstats"
 
-    template_compatibility_version = yaml_data.get("version", "1.0.0")
-    eburger_version = get_eburger_version()
 
-    if eburger_version < parse_version(template_compatibility_version):
-        template_name = yaml_data.get("name")
+def get_template_scope(yaml_data: dict) -> str:
+    """
+    Returns the scope of a template: "file" templates only look at one source unit at a time,
+    and are executed on each source unit separately. "contract" templates only look at one
+    contract at a time, and are executed on each contract of each source unit separately.
+    "project" (the default) templates are executed once, on the whole AST.
+    """
+    scope = yaml_data.get("scope", "project")
+    if scope not in ["contract", "file", "project"]:
         log(
-            "warning",
-            f"Skipping template '{template_name}' due to version compatibility. Template version: {template_compatibility_version}, eburger version: {eburger_version}",
+            "error",
+            f"Invalid scope in template {yaml_data.get('name')}, expected contract, file or project.",
         )
-        results = []
+    return scope
+
+
+def get_contract_indexes(source_unit: dict) -> list:
+    return [
+        index
+        for index, node in enumerate(source_unit.get("nodes", []))
+        if node.get("nodeType") == "ContractDefinition"
+    ]
+
+
+def get_contract_scopes(
+    ast_data, unit_index: int, matches: list, facts, contract_index: int = None
+) -> list:
+    """
+    Scopes a contract scoped template's execution on a source unit to each of its contracts.
+
+    :param ast_data: The analyzed AST.
+    :param unit_index: The source unit.
+    :param matches: The template's matches within the source unit, or None.
+    :param facts: The facts of the whole AST.
+    :param contract_index: A single contract to scope to, by its index in the source unit's
+    nodes.
+    :return: An (ast_data, matches, facts) view per contract.
+    """
+    context = register_analysis_context(ast_data)
+    unit_nodes = ast_data[unit_index].get("nodes", [])
+    if contract_index is None:
+        contract_indexes = get_contract_indexes(ast_data[unit_index])
     else:
-        results = execute_python_code(
-            yaml_data["name"], yaml_data["python"], ast_data, src_paths
+        contract_indexes = [contract_index]
+
+    scopes = []
+    for index in contract_indexes:
+        contract = unit_nodes[index]
+        contract_matches = matches
+        if matches is not None:
+            contract_matches = [
+                node for node in matches if context.is_within(node, contract)
+            ]
+        scopes.append(
+            (
+                NodesView(unit_nodes, index, index + 1),
+                contract_matches,
+                SourceUnitFacts(facts, unit_index, contract),
+            )
         )
+    return scopes
+
+
+def split_matches_by_source_unit(ast_data, matches: list) -> dict:
+    context = register_analysis_context(ast_data)
+    unit_matches = {}
+    for node in matches:
+        unit_matches.setdefault(context.root_index_of(node), []).append(node)
+    return unit_matches
+
 
+def merge_source_unit_insights(unit_insights: list) -> dict:
+    """
+    Merges the insights of a file scoped template's executions on each source unit, or of a
+    contract scoped template's on each contract.
+
+    :param unit_insights: The insight dicts, in source unit (or contract) order.
+    :return: A single insight dict, as if the template was executed on the whole AST.
+    """
+    insight = dict(unit_insights[0])
+    insight["results"] = [
+        result for unit_insight in unit_insights for result in unit_insight["results"]
+    ]
+
+    profiles = [
+        unit_insight["profile"]
+        for unit_insight in unit_insights
+        if unit_insight.get("profile") is not None
+    ]
+    if profiles:
+        insight["profile"] = dict(profiles[0])
+        for key in [
+            "wall_time",
+            "cpu_time",
+            "helper_calls",
+            "nodes_visited",
+            "results",
+        ]:
+            insight["profile"][key] = sum(profile[key] for profile in profiles)
+        for key in ["wall_time", "cpu_time"]:
+            insight["profile"][key] = round(insight["profile"][key], 6)
+    return insight
+
+
+def is_template_compatible(yaml_data: dict) -> bool:
+    template_compatibility_version = yaml_data.get("version", "1.0.0")
+    return get_eburger_version() >= parse_version(template_compatibility_version)
+
+
+def build_insight(yaml_data: dict, results: list) -> dict:
     return {
         "name": yaml_data.get("name"),
         "severity": yaml_data.get("severity"),
@@ -81,42 +672,518 @@ def process_yaml(file_path, ast_data, src_paths):
     }
 
 
-def process_files_concurrently(ast_data: dict, src_paths: list) -> list:
-    yaml_files = []
-    for templates_directory in settings.templates_directories:
-        if templates_directory.is_dir():
-            yaml_files = list(
-                set(yaml_files + list(templates_directory.glob("*.yaml")))
+# Function to process a single YAML file
+def process_yaml(
+    file_path,
+    ast_data,
+    src_paths,
+    template: dict = None,
+    matches: list = None,
+    unit_index: int = None,
+    contract_index: int = None,
+):
+    # Templates running on the same AST share its lazily built indexes
+    with use_analysis_context(ast_data):
+        if template is None:
+            template = load_template(file_path)
+        yaml_data = template["metadata"]
+
+        if not is_template_compatible(yaml_data):
+            template_name = yaml_data.get("name")
+            log(
+                "warning",
+                f"Skipping template '{template_name}' due to version compatibility. Template version: {yaml_data.get('version', '1.0.0')}, eburger version: {get_eburger_version()}",
             )
-        elif templates_directory.is_file():
-            if templates_directory.suffix != ".yaml":
-                log("error", "Please load files with a .yaml file extension.")
-            if templates_directory not in yaml_files:
-                yaml_files.append(templates_directory)
+            results = []
+            profile = None
         else:
-            log("error", "Invalid templates directory or file.", sorry=True)
+            # Match and visit sections are normally evaluated for all templates at once by process_files_concurrently
+            if matches is None:
+                matches = find_template_matches({file_path: template}, ast_data).get(
+                    file_path
+                )
+                if matches is not None and unit_index is not None:
+                    matches = split_matches_by_source_unit(ast_data, matches).get(
+                        unit_index, []
+                    )
+
+            # File scoped templates see a single source unit, through a copy-free view, and
+            # contract scoped templates each contract of it in turn
+            facts = get_facts(ast_data)
+            if unit_index is None:
+                scopes = [(ast_data, matches, facts)]
+            elif get_template_scope(yaml_data) == "contract":
+                scopes = get_contract_scopes(
+                    ast_data, unit_index, matches, facts, contract_index
+                )
+            else:
+                scopes = [
+                    (
+                        NodesView(ast_data, unit_index, unit_index + 1),
+                        matches,
+                        SourceUnitFacts(facts, unit_index),
+                    )
+                ]
+
+            max_results = args.max_findings_per_template
+            if is_fail_fast_severity(yaml_data.get("severity")):
+                # A single finding fails the run
+                max_results = 1
+
+            results = []
+            with profile_template(
+                yaml_data["name"],
+                args.profile or args.profile_dump,
+                get_profile_dump_path(file_path, unit_index, contract_index),
+            ) as profile:
+                for scoped_ast_data, scoped_matches, scoped_facts in scopes:
+                    results += execute_python_code(
+                        yaml_data["name"],
+                        template["code"] or yaml_data.get("python"),
+                        scoped_ast_data,
+                        src_paths,
+                        scoped_matches,
+                        scoped_facts,
+                        None if max_results is None else max_results - len(results),
+                    )
+                    if len(results) == max_results or _stop_run.is_set():
+                        break
+                # Set within the block, so that dumped records have it
+                if profile is not None:
+                    profile["results"] = len(results)
+
+        insight = build_insight(yaml_data, results)
+        if reaches_fail_fast_severity(insight):
+            _stop_run.set()
+        if profile is not None:
+            insight["profile"] = profile
+        return insight
+
+
+def add_insight(insight: dict, insights: list, profile: Union[list, None]):
+    template_profile = insight.pop("profile", None)
+    if template_profile is not None and profile is not None:
+        profile.append(template_profile)
+    if args.max_findings_per_template is not None:
+        # File scoped templates are limited per source unit until merged
+        insight["results"] = insight["results"][: args.max_findings_per_template]
+    if insight.get("results"):
+        if args.no and insight.get("severity").casefold() in args.no:
+            return
+        insights.append(insight)
+
+
+def is_template_selected(yaml_data: dict, template_file: Path) -> bool:
+    """
+    Resolves the template selection options against a template's metadata, so that
+    templates which aren't selected are never compiled or executed.
+
+    :param yaml_data: The parsed template.
+    :param template_file: The template's file, its name is matched along with the template's.
+    :return: Whether the template should be executed.
+    """
+    if not isinstance(yaml_data, dict):
+        # Reported as invalid when loaded
+        return True
+
+    severity = str(yaml_data.get("severity")).casefold()
+    precision = str(yaml_data.get("precision")).casefold()
+    names = [str(yaml_data.get("name")).casefold(), template_file.stem.casefold()]
+    tags = {str(tag).casefold() for tag in yaml_data.get("tags") or []}
+
+    def matches_any_glob(patterns: list) -> bool:
+        return any(
+            fnmatch.fnmatchcase(name, pattern.casefold())
+            for pattern in patterns
+            for name in names
+        )
+
+    if severity in args.no:
+        return False
+    if args.severities and severity not in args.severities:
+        return False
+    if args.precisions and precision not in args.precisions:
+        return False
+    if args.include_templates and not matches_any_glob(args.include_templates):
+        return False
+    if args.exclude_templates and matches_any_glob(args.exclude_templates):
+        return False
+    if args.tags and not tags.intersection(args.tags):
+        return False
+    if args.exclude_tags and tags.intersection(args.exclude_tags):
+        return False
+    return True
+
+
+def load_templates() -> dict:
+    """
+    Loads the selected templates of the configured templates directories, files and bundles.
+
+    :return: Template key (its file path) -> loaded template.
+    """
+    templates = {}
+    skipped_templates = 0
+    for template_file in find_template_files(settings.templates_directories):
+        if template_file.suffix == BUNDLE_SUFFIX:
+            for file_name, template in load_template_bundle(template_file).items():
+                template_key = template_file / file_name
+                if is_template_selected(template["metadata"], template_key):
+                    templates[str(template_key)] = template
+                else:
+                    skipped_templates += 1
+        else:
+            template = load_template(
+                template_file,
+                lambda yaml_data: is_template_selected(yaml_data, template_file),
+            )
+            if template is not None:
+                templates[str(template_file)] = template
+            else:
+                skipped_templates += 1
     log(
         "info",
-        f"Loaded {color.Success}{len(yaml_files)}{color.Default} templates for execution.",
+        f"Loaded {color.Success}{len(templates)}{color.Default} templates for execution.",
     )
-    insights = []
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(process_yaml, str(file_path), ast_data, src_paths)
-            for file_path in yaml_files
+    if skipped_templates:
+        log(
+            "info", f"Skipped {skipped_templates} templates not selected for execution."
+        )
+    return templates
+
+
+def process_files_concurrently(
+    ast_data: dict,
+    src_paths: list,
+    profile: list = None,
+    timed_out: list = None,
+    templates: dict = None,
+    early_outcomes: dict = None,
+) -> list:
+    """
+    Executes all loaded templates against the AST.
+
+    :param ast_data: The analyzed AST.
+    :param src_paths: The source files of the AST.
+    :param profile: When profiling, filled with the profile record of each template, slowest
+    first.
+    :param timed_out: Filled with a record of each template stopped for exceeding its time
+    budget.
+    :param templates: The loaded templates, loaded from the templates directories if not set.
+    :param early_outcomes: Insights of template executions that already ran, by task, see
+    process_files_pipelined.
+    :return: The insights of templates that found results.
+    """
+    if templates is None:
+        templates = load_templates()
+    # Templates share the AST's indexes until the run is done
+    with use_analysis_context(ast_data):
+        return execute_templates(
+            ast_data, src_paths, profile, timed_out, templates, early_outcomes
+        )
+
+
+def execute_templates(
+    ast_data: dict,
+    src_paths: list,
+    profile: list,
+    timed_out: list,
+    templates: dict,
+    early_outcomes: dict,
+) -> list:
+    """
+    See process_files_concurrently, runs within the AST's analysis context.
+    """
+    early_outcomes = early_outcomes or {}
+    _stop_run.clear()
+    forking_supported = "fork" in multiprocessing.get_all_start_methods()
+
+    # Templates that already ran on every source unit don't need the shared pass, and
+    # budgeted templates evaluate their match and visit sections within their budget
+    shared_pass_templates = {
+        file_path: template
+        for file_path, template in templates.items()
+        if (
+            not early_outcomes
+            or not all(
+                (file_path, unit) in early_outcomes for unit in range(len(ast_data))
+            )
+        )
+        and not (
+            forking_supported
+            and is_template_compatible(template["metadata"])
+            and get_template_budget(template["metadata"]) is not None
+        )
+    }
+    with profile_template(
+        "Shared match and visit pass",
+        args.profile or args.profile_dump,
+        get_profile_dump_path("shared_pass"),
+    ) as shared_pass_profile:
+        template_matches = find_template_matches(shared_pass_templates, ast_data)
+        if shared_pass_profile is not None:
+            shared_pass_profile["results"] = sum(map(len, template_matches.values()))
+    if shared_pass_profile is not None and profile is not None:
+        profile.append(shared_pass_profile)
+
+    use_processes = args.jobs is not None and args.jobs > 1
+    if use_processes and not forking_supported:
+        log(
+            "warning",
+            "Forked worker processes aren't supported on this platform, ignoring --jobs.",
+        )
+        use_processes = False
+
+    # Each template runs as one task, or as one task per source unit if it's file or contract
+    # scoped
+    tasks = {}
+    task_matches = {}
+    fan_out = isinstance(ast_data, Sequence) and not isinstance(ast_data, str)
+    for file_path, template in templates.items():
+        yaml_data = template["metadata"]
+        if (
+            fan_out
+            and is_template_compatible(yaml_data)
+            and get_template_scope(yaml_data) in ["contract", "file"]
+        ):
+            tasks[file_path] = [(file_path, unit) for unit in range(len(ast_data))]
+            # Templates left out of the shared pass find their own matches, see process_yaml
+            if file_path in template_matches:
+                unit_matches = split_matches_by_source_unit(
+                    ast_data, template_matches[file_path]
+                )
+                for task in tasks[file_path]:
+                    task_matches[task] = unit_matches.get(task[1], [])
+        else:
+            tasks[file_path] = [(file_path, None)]
+            if file_path in template_matches:
+                task_matches[(file_path, None)] = template_matches[file_path]
+
+    # Results of unchanged (template, source unit) pairs are served from the last run
+    outcomes = dict(early_outcomes)
+    task_cache_keys = {}
+    if args.incremental and fan_out:
+        result_cache = load_result_cache()
+        run_signature = get_run_signature()
+        unit_hashes = get_source_unit_hashes(ast_data, src_paths)
+        for file_path, template in templates.items():
+            if not is_template_compatible(template["metadata"]):
+                continue
+            for task in tasks[file_path]:
+                task_cache_key = get_task_cache_key(
+                    run_signature, template["hash"], unit_hashes, task[1]
+                )
+                task_cache_keys[task] = task_cache_key
+                if task_cache_key in result_cache:
+                    outcomes[task] = build_insight(
+                        template["metadata"], result_cache[task_cache_key]
+                    )
+        log(
+            "info",
+            f"Reusing cached results for {len(outcomes)} of {len(task_cache_keys)} template executions.",
+        )
+
+    # Early or cached findings may already fail the run
+    if any(reaches_fail_fast_severity(outcome) for outcome in outcomes.values()):
+        _stop_run.set()
+
+    budgets = {}
+    for file_path, template in templates.items():
+        if is_template_compatible(template["metadata"]):
+            budget = get_template_budget(template["metadata"])
+            if budget is not None:
+                for task in tasks[file_path]:
+                    if task not in outcomes:
+                        budgets[task] = budget
+    if budgets and not forking_supported:
+        log(
+            "warning",
+            "Template time budgets can't be enforced on this platform, running templates without them.",
+        )
+        budgets = {}
+
+    unbudgeted_tasks = [
+        task
+        for file_tasks in tasks.values()
+        for task in file_tasks
+        if task not in budgets and task not in outcomes
+    ]
+
+    # Tasks start longest expected first, from the runtimes of previous runs, so that a long
+    # template doesn't start last and keep the run going on its own
+    timings = load_template_timings()
+    timing_keys = {}
+    estimates = {}
+    for task in [*budgets, *unbudgeted_tasks]:
+        timing_keys[task] = get_task_timing_key(ast_data, task)
+        estimates[task] = estimate_task_time(
+            timings.get(task[0], {}), timing_keys[task]
+        )
+    budgets = {
+        task: budgets[task] for task in order_longest_first(list(budgets), estimates)
+    }
+    unbudgeted_tasks = order_longest_first(unbudgeted_tasks, estimates)
+
+    # Contract scoped tasks expected to outlast the rest of the run run per contract instead,
+    # on several workers. Threads only run templates in parallel without the GIL.
+    task_contracts = {}
+    if args.split_heavy_templates and fan_out:
+        if use_processes:
+            workers = args.jobs
+        else:
+            workers = get_cpu_count() if is_free_threaded() else 1
+        for task in find_heavy_tasks(
+            {task: estimates[task] for task in unbudgeted_tasks}, workers
+        ):
+            contract_indexes = get_contract_indexes(ast_data[task[1]])
+            if (
+                get_template_scope(templates[task[0]]["metadata"]) == "contract"
+                and len(contract_indexes) > 1
+            ):
+                task_contracts[task] = [
+                    (*task, contract_index) for contract_index in contract_indexes
+                ]
+        if task_contracts:
+            log(
+                "debug",
+                f"Splitting {len(task_contracts)} heavy template executions per contract.",
+            )
+    pool_tasks = [
+        pool_task
+        for task in unbudgeted_tasks
+        for pool_task in task_contracts.get(task, [task])
+    ]
+
+    if use_processes or budgets:
+        share_run_with_forks(ast_data, src_paths, templates, task_matches)
+
+    durations = {}
+    if timed_out is None:
+        timed_out = []
+    supervisor = None
+    if budgets and not _stop_run.is_set():
+        budget_workers = args.jobs if use_processes else get_cpu_count()
+        if pool_tasks:
+            # Budgeted templates run alongside the pool rather than before it
+            connection, supervisor_connection = multiprocessing.Pipe()
+            supervisor = multiprocessing.get_context("fork").Process(
+                target=supervise_budgeted_templates,
+                args=(budgets, budget_workers, supervisor_connection),
+            )
+            supervisor.start()
+            supervisor_connection.close()
+        else:
+            outcomes.update(
+                run_budgeted_templates(budgets, budget_workers, timed_out, durations)
+            )
+
+    if pool_tasks and not _stop_run.is_set():
+        if use_processes:
+            executor = create_forked_process_pool(args.jobs)
+        else:
+            executor = create_thread_pool()
+        supervisor_watcher = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        with executor, supervisor_watcher:
+            if use_processes:
+                futures = {
+                    executor.submit(run_timed, process_inherited_yaml, *task): task
+                    for task in pool_tasks
+                }
+            else:
+                futures = {
+                    executor.submit(
+                        run_timed,
+                        process_yaml,
+                        task[0],
+                        ast_data,
+                        src_paths,
+                        templates[task[0]],
+                        task_matches.get(task[:2]),
+                        *task[1:],
+                    ): task
+                    for task in pool_tasks
+                }
+            if supervisor is not None:
+                supervisor_outcome = supervisor_watcher.submit(
+                    receive_budgeted_outcomes, connection, futures
+                )
+            for future in concurrent.futures.as_completed(futures):
+                if future.cancelled():
+                    # Stopped by a budgeted template's finding
+                    continue
+                task = futures[future]
+                try:
+                    outcomes[task], durations[task] = future.result()
+                except Exception as e:
+                    log("error", f"Unhandled error: {e}", sorry=True)
+                if reaches_fail_fast_severity(outcomes[task]):
+                    # Running templates see _stop_run, the rest never start
+                    _stop_run.set()
+                    for pending_future in futures:
+                        pending_future.cancel()
+                    if supervisor is not None:
+                        try:
+                            connection.send(("stop", None))
+                        except OSError:
+                            # The supervisor already finished
+                            pass
+                    break
+        # Templates that were running when the run was stopped still report their findings
+        for future, task in futures.items():
+            if task not in outcomes and not future.cancelled():
+                try:
+                    outcomes[task], durations[task] = future.result()
+                except Exception as e:
+                    log("error", f"Unhandled error: {e}", sorry=True)
+
+    if supervisor is not None:
+        status, value = supervisor_outcome.result()
+        connection.close()
+        supervisor.join()
+        if status == "exit":
+            sys.exit(value)
+        elif status == "error":
+            log("error", f"Unhandled error in budgeted templates: {value}", sorry=True)
+        budgeted_outcomes, budgeted_timed_out, budgeted_durations = value
+        outcomes.update(budgeted_outcomes)
+        timed_out.extend(budgeted_timed_out)
+        durations.update(budgeted_durations)
+
+    for task, contract_tasks in task_contracts.items():
+        contract_insights = [
+            outcomes.pop(contract_task)
+            for contract_task in contract_tasks
+            if contract_task in outcomes
         ]
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                results = future.result(timeout=30)  # 30 seconds timeout
-                if results.get("results"):
-                    if args.no:
-                        if results.get("severity").casefold() in args.no:
-                            continue
-                    insights.append(results)
-            except concurrent.futures.TimeoutError:
-                log("error", "A task has timed out.", sorry=True)
-            except Exception as e:
-                log("error", f"Unhandled error: {e}", sorry=True)
+        if contract_insights:
+            outcomes[task] = merge_source_unit_insights(contract_insights)
+            durations[task] = sum(
+                durations.pop(contract_task, 0) for contract_task in contract_tasks
+            )
+
+    # Stopped runs have partial results and runtimes
+    if durations and not _stop_run.is_set():
+        record_task_times(timings, durations, timing_keys)
+        save_template_timings(timings)
+    if args.incremental and fan_out and not _stop_run.is_set():
+        save_result_cache(
+            {
+                task_cache_key: outcomes[task]["results"]
+                for task, task_cache_key in task_cache_keys.items()
+                if task in outcomes
+            }
+        )
+
+    insights = []
+    for file_tasks in tasks.values():
+        task_insights = [outcomes[task] for task in file_tasks if task in outcomes]
+        if task_insights:
+            add_insight(merge_source_unit_insights(task_insights), insights, profile)
+
+    if use_processes or budgets:
+        gc.unfreeze()
+        _inherited_run.clear()
+    if profile is not None:
+        profile.sort(key=lambda record: record["wall_time"], reverse=True)
     log(
         "info",
         f"{color.Error}{len(insights)}{color.Default} insight{'s were' if (len(insights) > 1 or len(insights) == 0) else ' was'} found by eBurger.",
@@ -124,3 +1191,112 @@ def process_files_concurrently(ast_data: dict, src_paths: list) -> list:
     if insights:
         log("insights", insights)
     return insights
+
+
+def process_source_unit(
+    templates: dict, source_unit: dict, unit_index: int, src_paths: list
+) -> tuple[dict, AnalysisContext]:
+    """
+    Runs file and contract scoped templates on a single source unit, on its own.
+
+    :param templates: Template key -> loaded file or contract scoped template.
+    :param source_unit: The source unit root.
+    :param unit_index: The index of the source unit in the whole AST.
+    :param src_paths: The source files of the AST, up to the source unit's.
+    :return: (template key, unit_index) task -> the template's insight dict, and the
+    source unit's indexed analysis context, for the whole AST's to adopt.
+    """
+    unit_ast_data = [source_unit]
+    with use_analysis_context(unit_ast_data) as context:
+        context.ensure_index()
+        unit_matches = find_template_matches(templates, unit_ast_data)
+        unit_outcomes = {}
+        for file_path, template in templates.items():
+            if _stop_run.is_set():
+                break
+            unit_outcomes[(file_path, unit_index)] = process_yaml(
+                file_path,
+                unit_ast_data,
+                src_paths,
+                template,
+                unit_matches.get(file_path),
+                0,
+            )
+        return unit_outcomes, context
+
+
+def process_files_pipelined(
+    source_units: SourceUnitStream, profile: list = None, timed_out: list = None
+) -> list:
+    """
+    Executes all loaded templates against the source units of compilation output, while it's
+    being decoded.
+
+    File and contract scoped templates start on each source unit as soon as it's decoded,
+    the rest of the templates run once all source units are, like in
+    process_files_concurrently, on the indexes built for each source unit.
+
+    :param source_units: The source units stream of the compilation output.
+    :param profile: See process_files_concurrently.
+    :param timed_out: See process_files_concurrently.
+    :return: The insights of templates that found results.
+    """
+    templates = load_templates()
+    # Budgeted templates are left to process_files_concurrently, which enforces budgets, and
+    # dumped profiles would record the decoding along with the templates
+    early_templates = {
+        file_path: template
+        for file_path, template in templates.items()
+        if is_template_compatible(template["metadata"])
+        and get_template_scope(template["metadata"]) in ["contract", "file"]
+        and get_template_budget(template["metadata"]) is None
+        and not args.profile_dump
+    }
+
+    ast_data = []
+    early_outcomes = {}
+    _stop_run.clear()
+    with create_thread_pool() as executor:
+        futures = []
+        for source_unit in source_units:
+            if _stop_run.is_set():
+                # The run fails anyway, the remaining source units aren't needed
+                break
+            ast_data.append(source_unit)
+            if early_templates:
+                futures.append(
+                    executor.submit(
+                        process_source_unit,
+                        early_templates,
+                        source_unit,
+                        len(ast_data) - 1,
+                        # The stream keeps appending to its list
+                        list(source_units.src_paths),
+                    )
+                )
+        log(
+            "debug",
+            f"Decoded {len(ast_data)} source units, {sum(not future.done() for future in futures)} still being analyzed.",
+        )
+        unit_contexts = []
+        for future in futures:
+            try:
+                unit_outcomes, unit_context = future.result()
+            except Exception as e:
+                log("error", f"Unhandled error: {e}", sorry=True)
+            early_outcomes.update(unit_outcomes)
+            unit_contexts.append(unit_context)
+
+    with use_analysis_context(ast_data) as context:
+        if futures and len(unit_contexts) == len(ast_data):
+            context.adopt_root_indexes(unit_contexts)
+            # Adopted by copy, the source units' indexes aren't needed anymore
+            unit_contexts.clear()
+        return process_files_concurrently(
+            ast_data,
+            source_units.src_paths,
+            profile,
+            timed_out,
+            templates,
+            early_outcomes,
+        )
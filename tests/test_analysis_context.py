@@ -0,0 +1,351 @@
+import concurrent.futures
+import contextlib
+import copy
+import sys
+
+import pytest
+from eburger.analysis_context import (
+    AnalysisContext,
+    get_analysis_context,
+    find_analysis_context,
+    register_analysis_context,
+    use_analysis_context,
+)
+from eburger.template_utils import (
+    find_node_ids_first_parent_of_type,
+    get_node_by_id,
+    get_nodes_by_signature,
+    get_nodes_by_types,
+    get_parent,
+    get_statements_view,
+    is_node_before,
+    is_node_within,
+    iter_nodes_by_types,
+    sort_nodes_by_location,
+)
+
+
+@pytest.fixture
+def ast_data() -> list:
+    return [
+        {
+            "id": 1,
+            "nodeType": "SourceUnit",
+            "src": "0:120:0",
+            "nodes": [
+                {
+                    "id": 2,
+                    "nodeType": "ContractDefinition",
+                    "src": "0:120:0",
+                    "nodes": [
+                        {
+                            "id": 3,
+                            "nodeType": "FunctionDefinition",
+                            "name": "withdraw",
+                            "src": "20:60:0",
+                            "body": {
+                                "id": 4,
+                                "nodeType": "Block",
+                                "src": "40:40:0",
+                                "statements": [
+                                    {
+                                        "id": 5,
+                                        "nodeType": "ExpressionStatement",
+                                        "src": "42:10:0",
+                                        "expression": {
+                                            "id": 6,
+                                            "nodeType": "Identifier",
+                                            "name": "require",
+                                            "src": "42:7:0",
+                                            "typeDescriptions": {
+                                                "typeString": "function (bool) pure"
+                                            },
+                                        },
+                                    },
+                                    {
+                                        "id": 7,
+                                        "nodeType": "ExpressionStatement",
+                                        "src": "54:20:0",
+                                        "expression": {
+                                            "id": 8,
+                                            "nodeType": "FunctionCall",
+                                            "src": "54:18:0",
+                                            "expression": {
+                                                "id": 9,
+                                                "nodeType": "Identifier",
+                                                "name": "revert",
+                                                "src": "54:6:0",
+                                                "typeDescriptions": {
+                                                    "typeString": "function () pure"
+                                                },
+                                            },
+                                        },
+                                    },
+                                ],
+                            },
+                        },
+                        {
+                            "id": 10,
+                            "nodeType": "FunctionDefinition",
+                            "name": "deposit",
+                            "src": "80:30:0",
+                            "body": {
+                                "id": 11,
+                                "nodeType": "Block",
+                                "src": "95:15:0",
+                                "statements": [],
+                            },
+                        },
+                    ],
+                }
+            ],
+        }
+    ]
+
+
+def test_indexed_queries_match_tree_walk(ast_data):
+    unindexed_ast = copy.deepcopy(ast_data)
+    with use_analysis_context(ast_data):
+        for node_types in [
+            "FunctionDefinition",
+            ["Identifier", "Block"],
+            ["FunctionCall", "FunctionDefinition", "FunctionCall"],
+            "Missing",
+        ]:
+            assert get_nodes_by_types(ast_data, node_types) == get_nodes_by_types(
+                unindexed_ast, node_types
+            )
+        for filter_key, filter_value in [
+            ("name", "revert"),
+            ("name", "withdraw"),
+            ("name", None),
+            ("id", 6),
+            ("statements", []),
+        ]:
+            for node_types in ["Identifier", ["Block", "FunctionDefinition"]]:
+                # Twice, to go through the lazily built attribute index as well
+                for _ in range(2):
+                    assert get_nodes_by_types(
+                        ast_data, node_types, filter_key, filter_value
+                    ) == get_nodes_by_types(
+                        unindexed_ast, node_types, filter_key, filter_value
+                    )
+    assert get_analysis_context(ast_data) is None
+
+
+def test_parent_and_id_lookups(ast_data):
+    unindexed_ast = copy.deepcopy(ast_data)
+    with use_analysis_context(ast_data):
+        for ast in [ast_data, unindexed_ast]:
+            revert_node = get_node_by_id(ast, 9)
+            assert revert_node["name"] == "revert"
+            assert get_parent(ast, revert_node)["id"] == 8
+            assert get_parent(ast, ast[0]) is None
+            assert get_node_by_id(ast, 404) is None
+            assert find_node_ids_first_parent_of_type(ast, 9, "Block")["id"] == 4
+            assert (
+                find_node_ids_first_parent_of_type(ast, 9, "FunctionDefinition")["name"]
+                == "withdraw"
+            )
+            assert (
+                find_node_ids_first_parent_of_type(ast, 9, "ModifierDefinition") is None
+            )
+
+
+def test_indexed_signature_queries_match_tree_walk(ast_data):
+    unindexed_ast = copy.deepcopy(ast_data)
+    with use_analysis_context(ast_data):
+        for pattern, use_regex in [
+            ("function () pure", False),
+            ("function (bool) pure", False),
+            ("function.*pure", True),
+            ("^function \\(\\)", True),
+            ("external", True),
+        ]:
+            # Twice, to go through the cached regex results as well
+            for _ in range(2):
+                assert get_nodes_by_signature(
+                    ast_data, pattern, use_regex
+                ) == get_nodes_by_signature(unindexed_ast, pattern, use_regex)
+        assert [
+            node["id"] for node in get_nodes_by_signature(ast_data, "pure", True)
+        ] == [6, 9]
+
+
+def test_subtree_queries_match_tree_walk(ast_data):
+    unindexed_ast = copy.deepcopy(ast_data)
+    with use_analysis_context(ast_data):
+
+        def roots(ast):
+            withdraw = ast[0]["nodes"][0]["nodes"][0]
+            statements = withdraw["body"]["statements"]
+            return [withdraw, withdraw["body"], statements, statements[1:], []]
+
+        for root, unindexed_root in zip(roots(ast_data), roots(unindexed_ast)):
+            for node_types in ["Identifier", ["FunctionCall", "Identifier"]]:
+                assert get_nodes_by_types(root, node_types) == get_nodes_by_types(
+                    unindexed_root, node_types
+                )
+                assert get_nodes_by_types(
+                    root, node_types, "name", "require"
+                ) == get_nodes_by_types(unindexed_root, node_types, "name", "require")
+            assert get_nodes_by_signature(
+                root, "pure", use_regex=True
+            ) == get_nodes_by_signature(unindexed_root, "pure", use_regex=True)
+            assert get_node_by_id(root, 9) == get_node_by_id(unindexed_root, 9)
+            assert find_node_ids_first_parent_of_type(
+                root, 9, "Block"
+            ) == find_node_ids_first_parent_of_type(unindexed_root, 9, "Block")
+
+        # Subtree results are the indexed nodes themselves, not copies
+        statement = roots(ast_data)[2][0]
+        assert get_nodes_by_types(statement, "Identifier")[0] is statement["expression"]
+
+
+def test_deeply_nested_expressions_do_not_recurse():
+    # a + b + c + ... chains nest one BinaryOperation per operand
+    expression = {"id": 0, "nodeType": "Identifier", "name": "a"}
+    for node_id in range(1, 5000):
+        expression = {
+            "id": node_id,
+            "nodeType": "BinaryOperation",
+            "leftExpression": expression,
+            "rightExpression": {"nodeType": "Identifier", "name": "b"},
+        }
+    ast = [{"nodeType": "SourceUnit", "nodes": [expression]}]
+
+    assert len(get_nodes_by_types(ast, "BinaryOperation")) == 4999
+    assert find_node_ids_first_parent_of_type(ast, 0, "SourceUnit") is ast[0]
+
+    with use_analysis_context(ast):
+        assert len(get_nodes_by_types(ast, "BinaryOperation")) == 4999
+        assert next(iter_nodes_by_types(expression, "Identifier"))["name"] == "a"
+
+
+def test_contexts_are_released_after_their_runs(ast_data):
+    with use_analysis_context(ast_data) as context:
+        with use_analysis_context(ast_data) as nested_context:
+            assert nested_context is context
+        # Still used by the outer run
+        assert get_analysis_context(ast_data) is context
+    assert get_analysis_context(ast_data) is None
+
+    with pytest.raises(RuntimeError):
+        with use_analysis_context(ast_data):
+            raise RuntimeError()
+    assert get_analysis_context(ast_data) is None
+
+    # The registry doesn't keep contexts, or their ASTs, alive
+    register_analysis_context(ast_data)
+    assert get_analysis_context(ast_data) is None
+
+
+def test_unindexed_contexts_do_not_cover_nodes(ast_data):
+    function = ast_data[0]["nodes"][0]["nodes"][0]
+    with use_analysis_context(ast_data) as context:
+        assert find_analysis_context(ast_data) is context
+        # Looking nodes up doesn't build the indexes
+        assert find_analysis_context(function) is None
+        assert not context._indexed
+
+        context.ensure_index()
+        assert find_analysis_context(function) is context
+        assert find_analysis_context(copy.deepcopy(function)) is None
+
+
+def test_contexts_are_found_while_others_are_registered(ast_data):
+    function = ast_data[0]["nodes"][0]["nodes"][0]
+
+    def register_and_release():
+        for _ in range(200):
+            with contextlib.ExitStack() as stack:
+                for _ in range(50):
+                    stack.enter_context(use_analysis_context([function]))
+
+    def find():
+        return all(find_analysis_context(function) is context for _ in range(2000))
+
+    switch_interval = sys.getswitchinterval()
+    # Switches threads often, so that registrations interleave with the lookups
+    sys.setswitchinterval(1e-6)
+    try:
+        with use_analysis_context(ast_data) as context:
+            context.ensure_index()
+            with concurrent.futures.ThreadPoolExecutor(8) as executor:
+                futures = [executor.submit(register_and_release) for _ in range(4)]
+                futures += [executor.submit(find) for _ in range(4)]
+                for future in futures[4:]:
+                    assert future.result()
+                for future in futures[:4]:
+                    future.result()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+
+def test_statements_view_scopes_queries_without_copies(ast_data):
+    withdraw_body = ast_data[0]["nodes"][0]["nodes"][0]["body"]
+    statements = withdraw_body["statements"]
+    view = get_statements_view(withdraw_body, 1)
+
+    assert len(view) == 1 and view[0] is statements[1]
+    assert list(view[0:]) == statements[1:]
+    assert len(get_statements_view(withdraw_body)[1:][1:]) == 0
+
+    for indexed in [False, True]:
+        with contextlib.ExitStack() as stack:
+            if indexed:
+                stack.enter_context(use_analysis_context(ast_data)).ensure_index()
+            identifiers = get_nodes_by_types(view, "Identifier")
+            assert [identifier["name"] for identifier in identifiers] == ["revert"]
+            assert identifiers[0] is statements[1]["expression"]["expression"]
+            assert get_nodes_by_signature(view, "function (bool) pure") == []
+            assert (
+                find_node_ids_first_parent_of_type(view, 9, "ExpressionStatement")
+                is statements[1]
+            )
+            assert find_node_ids_first_parent_of_type(view, 9, "Block") is None
+
+
+def test_src_locations(ast_data):
+    with use_analysis_context(ast_data) as context:
+        starts, lengths, files = context.src_arrays()
+        assert len(starts) == len(lengths) == len(files)
+
+        withdraw = get_node_by_id(ast_data, 3)
+        require, revert = get_nodes_by_types(withdraw, "Identifier")
+        assert context.src_location(withdraw) == (20, 60, 0)
+        # Dicts without a src attribute are decoded as -1
+        assert -1 in starts
+
+        nodes = get_nodes_by_types(ast_data, ["Identifier", "FunctionDefinition"])
+        assert [node["id"] for node in sort_nodes_by_location(nodes)] == [3, 6, 9, 10]
+        assert is_node_before(require, revert)
+        assert not is_node_before(revert, require)
+        assert is_node_within(revert, withdraw)
+        assert not is_node_within(withdraw, revert)
+
+
+def test_adopted_root_indexes_match_a_walk(ast_data):
+    ast_data = ast_data + [copy.deepcopy(ast_data[0])]
+    walked = AnalysisContext(ast_data)
+    walked.ensure_index()
+
+    adopted = AnalysisContext(ast_data)
+    adopted.adopt_root_indexes([AnalysisContext([root]) for root in ast_data])
+    for index in [
+        "_nodes",
+        "_positions",
+        "_ends",
+        "_parents",
+        "_type_positions",
+        "_id_positions",
+        "_type_string_positions",
+        "_src_starts",
+        "_src_lengths",
+        "_src_files",
+    ]:
+        assert getattr(adopted, index) == getattr(walked, index)
+    assert adopted.root_index_of(ast_data[1]["nodes"][0]) == 1
+
+    with pytest.raises(ValueError):
+        AnalysisContext(ast_data).adopt_root_indexes([AnalysisContext(ast_data[:1])])
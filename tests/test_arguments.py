@@ -1,7 +1,7 @@
 from pathlib import Path
 
 import pytest
-from eburger.utils.cli_args import args
+from eburger.utils.cli_args import args, parser
 from eburger.main import main
 from eburger import settings
 
@@ -45,3 +45,27 @@ def test_arguments():
     args.solidity_file_or_folder = None
     settings.project_root = original_project_root
     settings.original_outputs_dir = original_outputs_dir
+
+
+def test_max_findings_must_be_positive(capsys):
+    assert parser.parse_args(["-mf", "2"]).max_findings_per_template == 2
+    for value in ["0", "-1"]:
+        with pytest.raises(SystemExit):
+            parser.parse_args(["--max-findings-per-template", value])
+    assert "expected a number of 1 or more" in capsys.readouterr().err
+
+
+def test_jobs_must_be_positive(capsys):
+    assert parser.parse_args(["-j", "4"]).jobs == 4
+    for value in ["0", "-2"]:
+        with pytest.raises(SystemExit):
+            parser.parse_args(["--jobs", value])
+    assert "expected a number of 1 or more" in capsys.readouterr().err
+
+
+def test_timeout_must_be_positive(capsys):
+    assert parser.parse_args(["-to", "0.5"]).template_timeout == 0.5
+    for value in ["0", "-1", "nan"]:
+        with pytest.raises(SystemExit):
+            parser.parse_args(["--timeout", value])
+    assert "expected a number above 0" in capsys.readouterr().err
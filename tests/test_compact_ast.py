@@ -0,0 +1,200 @@
+import io
+import json
+
+import pytest
+from eburger import compact_ast, serializer
+from eburger.analysis_context import use_analysis_context
+from eburger.serializer import (
+    JsonTextReader,
+    SourceUnitStream,
+    _iter_raw_source_asts,
+    load_compact_ast,
+    parse_solidity_ast,
+    reduce_json,
+)
+from eburger.template_utils import (
+    find_node_ids_first_parent_of_type,
+    get_nodes_by_signature,
+    get_nodes_by_types,
+    get_parent,
+)
+
+
+def source_unit(unit_id: int, file_index: int, function_name: str) -> dict:
+    return {
+        "id": unit_id,
+        "nodeType": "SourceUnit",
+        "src": f"0:200:{file_index}",
+        "absolutePath": f"src/{function_name}.sol",
+        "nodes": [
+            {
+                "id": unit_id + 1,
+                "nodeType": "PragmaDirective",
+                "literals": ["solidity", "^", "0.8", ".20"],
+                "src": f"0:24:{file_index}",
+            },
+            {
+                "id": unit_id + 2,
+                "nodeType": "FunctionDefinition",
+                "name": function_name,
+                "src": f"30:100:{file_index}",
+                "body": {
+                    "id": unit_id + 3,
+                    "nodeType": "Block",
+                    "src": f"60:70:{file_index}",
+                    "statements": [
+                        {
+                            "id": unit_id + 4,
+                            "nodeType": "ExpressionStatement",
+                            "src": f"62:20:{file_index}",
+                            "expression": {
+                                "id": unit_id + 5,
+                                "nodeType": "Identifier",
+                                "name": "msg",
+                                "src": f"62:3:{file_index}",
+                                "typeDescriptions": {
+                                    "typeIdentifier": "t_magic_message",
+                                    "typeString": "msg",
+                                },
+                            },
+                        }
+                    ],
+                },
+            },
+        ],
+    }
+
+
+@pytest.fixture
+def build_info_path(tmp_path) -> str:
+    build_info = {
+        "id": "e1a2",
+        "input": {"sources": {"src/A.sol": {"content": 'string s = "}{";'}}},
+        "output": {
+            "contracts": {"src/A.sol": {"A": {"abi": [{"name": "a}"}]}}},
+            "sources": {
+                "src/A.sol": {"id": 0, "ast": source_unit(10, 0, "deposit")},
+                "lib/forge-std/src/Test.sol": {
+                    "id": 1,
+                    "ast": source_unit(20, 1, "excluded"),
+                },
+                "src/B.sol": {"id": 2, "ast": source_unit(30, 2, "withdraw")},
+            },
+        },
+    }
+    path = tmp_path / "build-info.json"
+    path.write_text(json.dumps(build_info, indent=2))
+    return str(path)
+
+
+def test_compact_ast_matches_dict_ast(build_info_path):
+    with open(build_info_path, "r") as f:
+        ast_json, src_paths = reduce_json(json.load(f)["output"])
+    ast_roots = parse_solidity_ast(ast_json)
+
+    compact, compact_src_paths = load_compact_ast(build_info_path)
+    compact_roots = parse_solidity_ast(compact)
+
+    assert compact_src_paths == src_paths
+    assert len(compact_roots) == len(ast_roots) == 2
+    # Source units stay compressed until something touches them
+    assert compact.positions == {}
+
+    with use_analysis_context(ast_roots), use_analysis_context(compact_roots):
+        for roots in [ast_roots, compact_roots]:
+            assert [
+                node["name"] for node in get_nodes_by_types(roots, "FunctionDefinition")
+            ] == ["deposit", "withdraw"]
+
+        for node_types in ["Identifier", ["Block", "PragmaDirective"]]:
+            assert get_nodes_by_types(compact_roots, node_types) == get_nodes_by_types(
+                ast_roots, node_types
+            )
+        assert get_nodes_by_signature(compact_roots, "msg") == get_nodes_by_signature(
+            ast_roots, "msg"
+        )
+
+        # Subtree queries and parent lookups work on materialized nodes
+        withdraw = get_nodes_by_types(compact_roots, "FunctionDefinition")[1]
+        identifier = get_nodes_by_types(withdraw, "Identifier")[0]
+        assert identifier is withdraw["body"]["statements"][0]["expression"]
+        assert (
+            find_node_ids_first_parent_of_type(compact_roots, 35, "FunctionDefinition")
+            is withdraw
+        )
+        assert compact_roots[1] is compact_roots[-1]
+
+        assert compact.src_starts[compact.positions[id(withdraw)]] == 30
+        assert compact.src_files[compact.positions[id(withdraw)]] == 2
+
+
+def test_compact_ast_drops_least_recently_used_units(build_info_path, monkeypatch):
+    # Only the unit in use stays materialized
+    monkeypatch.setattr(compact_ast, "MATERIALIZED_NODES_LIMIT", 1)
+    with open(build_info_path, "r") as f:
+        ast_json, _ = reduce_json(json.load(f)["output"])
+    ast_roots = parse_solidity_ast(ast_json)
+    compact, _ = load_compact_ast(build_info_path)
+    compact_roots = parse_solidity_ast(compact)
+
+    with use_analysis_context(ast_roots), use_analysis_context(compact_roots):
+        deposit, withdraw = get_nodes_by_types(compact_roots, "FunctionDefinition")
+        assert [deposit["name"], withdraw["name"]] == ["deposit", "withdraw"]
+        assert len(compact.positions) == len(compact) // 2
+
+        # Nodes of dropped units are still found by the index
+        assert id(deposit) not in compact.positions
+        assert get_parent(compact_roots, deposit) == ast_roots[0]
+        assert get_nodes_by_types(deposit, "Identifier") == get_nodes_by_types(
+            ast_roots[0], "Identifier"
+        )
+        assert get_nodes_by_types(compact_roots, "Block", "id", 33) == [
+            withdraw["body"]
+        ]
+        assert get_parent(compact_roots, {**deposit, "src": "0:1:0"}) is None
+
+
+def test_source_unit_stream(build_info_path):
+    compact, compact_src_paths = load_compact_ast(build_info_path)
+
+    source_units = SourceUnitStream(build_info_path)
+    assert source_units.src_paths == []
+    for index, source_unit in enumerate(source_units):
+        # Decoded one by one, src_paths is filled up to the current source unit
+        assert source_units.src_paths[-1] == ["src/A.sol", "src/B.sol"][index]
+        assert source_unit == compact.unit_root(index)
+    assert source_units.src_paths == compact_src_paths
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_source_unit_stream_reads_in_chunks(build_info_path, monkeypatch, chunk_size):
+    with open(build_info_path, "r") as f:
+        ast_json, src_paths = reduce_json(json.load(f)["output"])
+    monkeypatch.setattr(serializer, "JSON_CHUNK_SIZE", chunk_size)
+
+    source_units = SourceUnitStream(build_info_path)
+    assert list(source_units) == parse_solidity_ast(ast_json)
+    assert source_units.src_paths == src_paths
+
+
+def test_source_units_are_walked_as_the_text_is_read():
+    units = [
+        {"id": index, "nodeType": "SourceUnit", "name": '"{[' * index}
+        for index in range(50)
+    ]
+    text = json.dumps(
+        {
+            "output": {
+                "sources": {
+                    f"src/{index}.sol": {"id": index, "ast": unit}
+                    for index, unit in enumerate(units)
+                }
+            }
+        }
+    )
+    file = io.StringIO(text)
+    raw_asts = _iter_raw_source_asts(JsonTextReader(file, chunk_size=16), [])
+
+    assert json.loads(next(raw_asts)) == units[0]
+    assert file.tell() < len(text) / 10
+    assert [json.loads(raw_ast) for raw_ast in raw_asts] == units[1:]
@@ -0,0 +1,108 @@
+import concurrent.futures
+
+import pytest
+from eburger.analysis_context import use_analysis_context
+from eburger.facts import SourceUnitFacts, get_facts, get_referenced_facts
+
+
+def source_unit(unit_id: int, mutability: str) -> dict:
+    return {
+        "id": unit_id,
+        "nodeType": "SourceUnit",
+        "nodes": [
+            {
+                "id": unit_id + 1,
+                "nodeType": "ContractDefinition",
+                "nodes": [
+                    {
+                        "id": unit_id + 2,
+                        "nodeType": "VariableDeclaration",
+                        "name": "balance",
+                        "stateVariable": True,
+                        "constant": False,
+                        "mutability": mutability,
+                    },
+                    {
+                        "id": unit_id + 3,
+                        "nodeType": "FunctionDefinition",
+                        "modifiers": [
+                            {
+                                "id": unit_id + 4,
+                                "nodeType": "ModifierInvocation",
+                                "modifierName": {"name": "nonReentrant"},
+                            }
+                        ],
+                        "body": {
+                            "id": unit_id + 5,
+                            "nodeType": "Block",
+                            "statements": [
+                                {
+                                    "id": unit_id + 6,
+                                    "nodeType": "MemberAccess",
+                                    "memberName": "transfer",
+                                    "typeDescriptions": {
+                                        "typeString": "function (address,uint256) external returns (bool)"
+                                    },
+                                },
+                                {
+                                    "id": unit_id + 7,
+                                    "nodeType": "MemberAccess",
+                                    "memberName": "call",
+                                },
+                            ],
+                        },
+                    },
+                ],
+            }
+        ],
+    }
+
+
+@pytest.fixture
+def ast_data() -> list:
+    ast_data = [source_unit(10, "mutable"), source_unit(20, "immutable")]
+    with use_analysis_context(ast_data):
+        yield ast_data
+
+
+def test_facts(ast_data):
+    facts = get_facts(ast_data)
+    assert get_facts(ast_data) is facts
+
+    assert [node["id"] for node in facts.state_variables] == [12, 22]
+    assert [node["id"] for node in facts.mutable_state_variables] == [12]
+    assert [node["id"] for node in facts.external_call_sites] == [16, 26]
+    assert [node["id"] for node in facts.functions_with_external_calls] == [13, 23]
+    assert [node["id"] for node in facts.low_level_calls] == [17, 27]
+    assert facts.function_modifiers == {13: ["nonReentrant"], 23: ["nonReentrant"]}
+
+    second_unit_facts = SourceUnitFacts(facts, 1)
+    assert [node["id"] for node in second_unit_facts.state_variables] == [22]
+    assert second_unit_facts.mutable_state_variables == []
+    assert second_unit_facts.function_modifiers == {23: ["nonReentrant"]}
+    with pytest.raises(AttributeError):
+        second_unit_facts.unknown_fact
+
+    function = ast_data[1]["nodes"][0]["nodes"][1]
+    function_facts = SourceUnitFacts(facts, 1, function)
+    assert function_facts.state_variables == []
+    assert [node["id"] for node in function_facts.external_call_sites] == [26]
+    assert function_facts.function_modifiers == {23: ["nonReentrant"]}
+
+
+def test_facts_are_computed_once(ast_data):
+    facts = get_facts(ast_data)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        state_variables = list(executor.map(lambda _: facts.state_variables, range(32)))
+    assert all(value is state_variables[0] for value in state_variables)
+
+
+def test_referenced_facts():
+    code = compile(
+        "def on_Block(node, ctx):\n    return facts.low_level_calls\n"
+        "results = facts.state_variables\n",
+        "<string>",
+        "exec",
+    )
+    assert get_referenced_facts(code) == {"low_level_calls", "state_variables"}
+    assert get_referenced_facts(compile("state_variables = 1", "", "exec")) == set()
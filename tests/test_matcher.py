@@ -0,0 +1,110 @@
+import pytest
+from eburger.analysis_context import use_analysis_context
+from eburger.matcher import compile_match_patterns, run_match_patterns
+from eburger.template_utils import get_nodes_by_types
+
+
+@pytest.fixture
+def ast_data() -> list:
+    def call(call_id: int, member_name: str, type_string: str) -> dict:
+        return {
+            "id": call_id,
+            "nodeType": "FunctionCall",
+            "expression": {
+                "id": call_id + 1,
+                "nodeType": "MemberAccess",
+                "memberName": member_name,
+                "expression": {
+                    "id": call_id + 2,
+                    "nodeType": "Identifier",
+                    "name": "to",
+                    "typeDescriptions": {"typeString": type_string},
+                },
+                "typeDescriptions": {"typeString": "function (uint256)"},
+            },
+            "typeDescriptions": {"typeString": "tuple()"},
+        }
+
+    return [
+        {
+            "id": 1,
+            "nodeType": "SourceUnit",
+            "nodes": [
+                {
+                    "id": 2,
+                    "nodeType": "FunctionDefinition",
+                    "stateMutability": "payable",
+                    "body": {
+                        "id": 3,
+                        "nodeType": "Block",
+                        "statements": [
+                            call(10, "transfer", "address payable"),
+                            call(20, "send", "address"),
+                        ],
+                    },
+                },
+                {
+                    "id": 4,
+                    "nodeType": "FunctionDefinition",
+                    "stateMutability": "nonpayable",
+                    "body": {
+                        "id": 5,
+                        "nodeType": "Block",
+                        "statements": [call(30, "send", "address payable")],
+                    },
+                },
+            ],
+        }
+    ]
+
+
+def test_match_patterns_run_in_one_pass(ast_data):
+    template_patterns = {
+        "transfer_or_send": compile_match_patterns(
+            [
+                {
+                    "nodeType": "FunctionCall",
+                    "attributes": {
+                        "expression.memberName": member_name,
+                        "expression.expression.typeDescriptions.typeString": "address payable",
+                    },
+                }
+                for member_name in ["transfer", "send"]
+            ]
+        ),
+        "in_payable_function": compile_match_patterns(
+            {
+                "nodeType": ["FunctionCall", "Identifier"],
+                "ancestor": {
+                    "nodeType": "FunctionDefinition",
+                    "attributes": {"stateMutability": "payable"},
+                },
+            }
+        ),
+        "payable_receivers": compile_match_patterns(
+            {
+                "typeString": "^address payable$",
+                "parent": {"nodeType": "MemberAccess", "attributes": {"id": 31}},
+            }
+        ),
+        "any_node": compile_match_patterns([{}, {"nodeType": "Block"}]),
+    }
+    with use_analysis_context(ast_data):
+        matches = run_match_patterns(template_patterns, ast_data)
+        assert [node["id"] for node in matches["transfer_or_send"]] == [10, 30]
+        assert [node["id"] for node in matches["in_payable_function"]] == [
+            10,
+            12,
+            20,
+            22,
+        ]
+        assert [node["id"] for node in matches["payable_receivers"]] == [32]
+        # Every dict of the AST, reported once even when matching several alternatives
+        assert len(matches["any_node"]) == 23
+        assert len(get_nodes_by_types(ast_data, "Block")) == 2
+
+
+def test_invalid_match_patterns():
+    for match_spec in [[], "FunctionCall", [{"nodeName": "FunctionCall"}]]:
+        with pytest.raises(ValueError):
+            compile_match_patterns(match_spec)
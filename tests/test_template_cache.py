@@ -0,0 +1,126 @@
+import marshal
+
+import pytest
+from eburger import settings, template_cache
+from eburger.template_cache import (
+    BUNDLE_SUFFIX,
+    find_template_files,
+    get_template_cache_path,
+    load_template,
+    load_template_bundle,
+    pack_templates,
+)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "templates_cache_dir", tmp_path / "cache")
+    return tmp_path / "cache"
+
+
+def test_templates_are_cached_by_content(tmp_path, cache_dir):
+    template_path = tmp_path / "template.yaml"
+    template_path.write_text('name: "Cached"\npython: |\n    results = [1]\n')
+
+    template = load_template(template_path)
+    assert template["metadata"]["name"] == "Cached"
+    cache_path = get_template_cache_path(template_path.read_bytes())
+    assert cache_path.exists()
+
+    # Served from the cache, including the compiled code
+    cached_template = load_template(template_path)
+    assert cached_template["metadata"] == template["metadata"]
+    local_vars = {}
+    exec(cached_template["code"], {}, local_vars)
+    assert local_vars["results"] == [1]
+
+    # Editing the template invalidates its entry
+    template_path.write_text('name: "Edited"\npython: |\n    results = [2]\n')
+    assert load_template(template_path)["metadata"]["name"] == "Edited"
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # Corrupted entries are rebuilt
+    cache_path.write_bytes(b"\x00")
+    template_path.write_text('name: "Cached"\npython: |\n    results = [1]\n')
+    assert load_template(template_path)["metadata"]["name"] == "Cached"
+
+
+def test_cache_format_bump_misses_old_entries(tmp_path, cache_dir, monkeypatch):
+    template_path = tmp_path / "template.yaml"
+    template_path.write_text('name: "Cached"\npython: |\n    yield 1\n')
+    load_template(template_path)
+    old_cache_path = get_template_cache_path(template_path.read_bytes())
+    assert old_cache_path.exists()
+
+    compiled = []
+    compile_template = template_cache.compile_template
+
+    def record_compilation(template):
+        compiled.append(template["metadata"]["name"])
+        return compile_template(template)
+
+    monkeypatch.setattr(template_cache, "compile_template", record_compilation)
+    load_template(template_path)
+    assert compiled == []
+
+    monkeypatch.setattr(template_cache, "CACHE_FORMAT", template_cache.CACHE_FORMAT + 1)
+    assert get_template_cache_path(template_path.read_bytes()) != old_cache_path
+    load_template(template_path)
+    assert compiled == ["Cached"]
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+def test_uncacheable_templates(tmp_path, cache_dir):
+    template_path = tmp_path / "template.yaml"
+    template_path.write_text('name: "Broken"\npython: |\n    results = [\n')
+    template = load_template(template_path)
+    assert template["code"] is None
+    assert template["metadata"]["python"].startswith("results")
+
+    # Dates can't be marshalled, the template is still loaded
+    template_path.write_text('name: "Dated"\ndate: 2024-01-01\n')
+    assert load_template(template_path)["metadata"]["name"] == "Dated"
+    assert not list(cache_dir.iterdir())
+
+
+def test_templates_bundle(tmp_path, cache_dir):
+    templates_directory = tmp_path / "templates"
+    templates_directory.mkdir()
+    (templates_directory / "one.yaml").write_text(
+        'name: "One"\npython: |\n    results = [1]\n'
+    )
+    (templates_directory / "two.yaml").write_text(
+        'name: "Two"\nmatch:\n    nodeType: ContractDefinition\n'
+    )
+    bundle_path = tmp_path / f"templates{BUNDLE_SUFFIX}"
+    template_files = find_template_files([templates_directory])
+    assert pack_templates(template_files, bundle_path) == 2
+
+    templates = load_template_bundle(bundle_path)
+    assert templates.keys() == {"one.yaml", "two.yaml"}
+    assert templates["one.yaml"] == load_template(templates_directory / "one.yaml")
+    assert templates["two.yaml"]["code"] is None
+
+    # Bundles packed on another Python version are compiled from their sources
+    bundle = marshal.loads(bundle_path.read_bytes())
+    bundle["cache_tag"] = "other-version"
+    bundle["code"] = b"\x00"
+    bundle_path.write_bytes(marshal.dumps(bundle))
+    local_vars = {}
+    exec(load_template_bundle(bundle_path)["one.yaml"]["code"], {}, local_vars)
+    assert local_vars["results"] == [1]
+
+    # And so are bundles packed by another template compiler
+    pack_templates(template_files, bundle_path)
+    bundle = marshal.loads(bundle_path.read_bytes())
+    bundle["cache_format"] = template_cache.CACHE_FORMAT - 1
+    bundle["code"] = b"\x00"
+    bundle_path.write_bytes(marshal.dumps(bundle))
+    assert load_template_bundle(bundle_path)["one.yaml"]["code"] is not None
+
+    # Invalid templates fail the pack
+    (templates_directory / "broken.yaml").write_text(
+        'name: "Broken"\npython: |\n    results = [\n'
+    )
+    with pytest.raises(SystemExit):
+        pack_templates(find_template_files([templates_directory]), bundle_path)
@@ -0,0 +1,603 @@
+import concurrent.futures
+import json
+import sys
+
+import pytest
+from eburger import settings, template_cache, yaml_parser
+from eburger.analysis_context import AnalysisContext, get_analysis_context
+from eburger.serializer import SourceUnitStream
+from eburger.template_cache import find_template_files, pack_templates
+from eburger.utils.cli_args import args
+from eburger.yaml_parser import (
+    process_files_concurrently,
+    process_files_pipelined,
+    process_yaml,
+)
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch) -> tuple[list, list]:
+    (tmp_path / "A.sol").write_text("contract A {\n    function f() public {}\n}\n")
+    templates_directory = tmp_path / "templates"
+    templates_directory.mkdir()
+    (templates_directory / "contracts.yaml").write_text(
+        'version: 1.0.8\nname: "Contracts"\nseverity: "Low"\n'
+        "match:\n    nodeType: ContractDefinition\n"
+    )
+    (templates_directory / "functions.yaml").write_text(
+        'name: "Functions"\nseverity: "Medium"\npython: |\n'
+        '    results = get_nodes_by_types(ast_data, "FunctionDefinition")\n'
+    )
+    (templates_directory / "nothing.yaml").write_text(
+        'name: "Nothing"\nseverity: "High"\npython: |\n    results = []\n'
+    )
+
+    monkeypatch.setattr(settings, "project_root", tmp_path)
+    monkeypatch.setattr(settings, "templates_directories", [templates_directory])
+    monkeypatch.setattr(settings, "templates_cache_dir", None)
+    monkeypatch.setattr(settings, "outputs_dir", tmp_path / ".eburger")
+    monkeypatch.setattr(args, "no", ["insights"])
+
+    ast_data = [
+        {
+            "id": 1,
+            "nodeType": "SourceUnit",
+            "src": "0:42:0",
+            "nodes": [
+                {
+                    "id": 2,
+                    "nodeType": "ContractDefinition",
+                    "src": "0:41:0",
+                    "nodes": [
+                        {
+                            "id": 3,
+                            "nodeType": "FunctionDefinition",
+                            "src": "17:22:0",
+                        }
+                    ],
+                }
+            ],
+        }
+    ]
+    return ast_data, ["A.sol"]
+
+
+def test_forked_workers_match_threads(project, monkeypatch):
+    ast_data, src_paths = project
+
+    insights_by_mode = []
+    for jobs in [None, 2]:
+        monkeypatch.setattr(args, "jobs", jobs)
+        insights = process_files_concurrently(ast_data, src_paths)
+        insights_by_mode.append(sorted(insights, key=lambda insight: insight["name"]))
+
+    threaded_insights, forked_insights = insights_by_mode
+    assert [insight["name"] for insight in threaded_insights] == [
+        "Contracts",
+        "Functions",
+    ]
+    assert threaded_insights[1]["results"][0]["lines"] == "Line 2 Columns 5-27"
+    assert forked_insights == threaded_insights
+
+
+def test_visitor_templates(project, tmp_path):
+    ast_data, src_paths = project
+    template_path = tmp_path / "visitor.yaml"
+    template_path.write_text(
+        'name: "Visitor"\nvisit: |\n'
+        "    def on_ContractDefinition(node, ctx):\n"
+        "        ctx.contracts = ctx.__dict__.get('contracts', 0) + 1\n\n"
+        "    def on_FunctionDefinition(node, ctx):\n"
+        "        if ctx.parent(node)['nodeType'] == 'ContractDefinition' and ctx.contracts:\n"
+        "            ctx.report(node)\n"
+    )
+
+    insight = process_yaml(str(template_path), ast_data, src_paths)
+    assert insight["name"] == "Visitor"
+    # Released once the template ran
+    assert get_analysis_context(ast_data) is None
+    assert [result["lines"] for result in insight["results"]] == ["Line 2 Columns 5-27"]
+
+
+def test_template_profiling(project, tmp_path, monkeypatch):
+    ast_data, src_paths = project
+    monkeypatch.setattr(args, "profile_dump", True)
+    monkeypatch.setattr(settings, "outputs_dir", tmp_path / ".eburger")
+
+    profile = []
+    insights = process_files_concurrently(ast_data, src_paths, profile)
+    assert all("profile" not in insight for insight in insights)
+
+    records = {record["template"]: record for record in profile}
+    assert len(records) == 4
+    assert profile == sorted(
+        profile, key=lambda record: record["wall_time"], reverse=True
+    )
+    assert records["Functions"]["helper_calls"] == 1
+    # The whole AST was scanned to find its single function
+    assert records["Functions"]["nodes_visited"] == 3
+    assert records["Functions"]["results"] == 1
+    assert records["Nothing"]["results"] == 0
+    assert records["Shared match and visit pass"]["results"] == 1
+    profiles_directory = tmp_path / ".eburger" / "profiles"
+    assert sorted(path.name for path in profiles_directory.glob("*.pstats")) == [
+        "contracts.pstats",
+        "functions.pstats",
+        "nothing.pstats",
+        "shared_pass.pstats",
+    ]
+    functions_record = json.loads((profiles_directory / "functions.json").read_text())
+    assert functions_record == records["Functions"]
+
+
+def test_templates_exceeding_their_budget_are_stopped(project, monkeypatch):
+    ast_data, src_paths = project
+    templates_directory = settings.templates_directories[0]
+    (templates_directory / "endless.yaml").write_text(
+        'name: "Endless"\nseverity: "High"\ntimeout: 0.5\n'
+        "python: |\n    while True:\n        pass\n"
+    )
+
+    for jobs in [None, 2]:
+        monkeypatch.setattr(args, "jobs", jobs)
+        timed_out = []
+        insights = process_files_concurrently(ast_data, src_paths, None, timed_out)
+        assert sorted(insight["name"] for insight in insights) == [
+            "Contracts",
+            "Functions",
+        ]
+        assert timed_out == [
+            {
+                "name": "Endless",
+                "template": str(templates_directory / "endless.yaml"),
+                "timeout": 0.5,
+            }
+        ]
+
+    # The CLI budget applies to every template, all of them run in killable workers
+    monkeypatch.setattr(args, "template_timeout", 30)
+    (templates_directory / "endless.yaml").unlink()
+    timed_out = []
+    insights = process_files_concurrently(ast_data, src_paths, None, timed_out)
+    assert len(insights) == 2 and timed_out == []
+
+
+def test_budgets_cover_match_and_visit_sections(project, monkeypatch):
+    ast_data, src_paths = project
+    templates_directory = settings.templates_directories[0]
+    (templates_directory / "endless.yaml").write_text(
+        'name: "Endless"\nseverity: "High"\ntimeout: 0.5\nvisit: |\n'
+        "    def on_FunctionDefinition(node, ctx):\n"
+        "        while True:\n"
+        "            pass\n"
+    )
+    (templates_directory / "budgeted.yaml").write_text(
+        'name: "Budgeted"\nseverity: "Low"\ntimeout: 30\nscope: "file"\n'
+        "match:\n    nodeType: FunctionDefinition\n"
+    )
+
+    for jobs in [None, 2]:
+        monkeypatch.setattr(args, "jobs", jobs)
+        timed_out = []
+        insights = process_files_concurrently(ast_data, src_paths, None, timed_out)
+        assert sorted(insight["name"] for insight in insights) == [
+            "Budgeted",
+            "Contracts",
+            "Functions",
+        ]
+        assert [record["name"] for record in timed_out] == ["Endless"]
+
+
+def test_file_scoped_templates_run_per_source_unit(project, tmp_path, monkeypatch):
+    ast_data, src_paths = project
+    (tmp_path / "B.sol").write_text("contract B {}\n")
+    ast_data.append(
+        {
+            "id": 4,
+            "nodeType": "SourceUnit",
+            "src": "0:14:1",
+            "nodes": [{"id": 5, "nodeType": "ContractDefinition", "src": "0:13:1"}],
+        }
+    )
+    src_paths = src_paths + ["B.sol"]
+
+    templates_directory = settings.templates_directories[0]
+    (templates_directory / "contracts.yaml").write_text(
+        'version: 1.0.8\nname: "Contracts"\nseverity: "Low"\nscope: "file"\n'
+        "match:\n    nodeType: ContractDefinition\n"
+    )
+    (templates_directory / "functions.yaml").write_text(
+        'name: "Units"\nseverity: "Medium"\nscope: "file"\npython: |\n'
+        "    assert len(ast_data) == 1\n"
+        "    results = list(ast_data)\n"
+    )
+
+    for jobs in [None, 2]:
+        monkeypatch.setattr(args, "jobs", jobs)
+        insights = process_files_concurrently(ast_data, src_paths)
+        insights = {insight["name"]: insight for insight in insights}
+        for name in ["Contracts", "Units"]:
+            assert [
+                result["file"].rsplit("/", 1)[-1]
+                for result in insights[name]["results"]
+            ] == ["A.sol", "B.sol"]
+
+
+def test_incremental_runs_reuse_unchanged_results(project, tmp_path, monkeypatch):
+    ast_data, src_paths = project
+    templates_directory = settings.templates_directories[0]
+    for template_name in ["contracts", "functions"]:
+        template_path = templates_directory / f"{template_name}.yaml"
+        template_path.write_text(
+            template_path.read_text().replace("\n", '\nscope: "file"\n', 1)
+        )
+    monkeypatch.setattr(args, "incremental", True)
+    monkeypatch.setattr(settings, "outputs_dir", tmp_path / ".eburger")
+
+    executions = []
+    execute_python_code = yaml_parser.execute_python_code
+
+    def count_executions(template_name, *execution_args):
+        executions.append(template_name)
+        return execute_python_code(template_name, *execution_args)
+
+    monkeypatch.setattr(yaml_parser, "execute_python_code", count_executions)
+
+    cold_insights = process_files_concurrently(ast_data, src_paths)
+    assert len(executions) == 3
+
+    executions.clear()
+    assert process_files_concurrently(ast_data, src_paths) == cold_insights
+    assert executions == []
+
+    # Editing a source or a template only reruns the stale pairs
+    (tmp_path / "A.sol").write_text(
+        (tmp_path / "A.sol").read_text().replace("public", "public ")
+    )
+    (templates_directory / "nothing.yaml").write_text(
+        'name: "Nothing"\nseverity: "High"\npython: |\n    results = [] \n'
+    )
+    executions.clear()
+    incremental_insights = process_files_concurrently(ast_data, src_paths)
+    assert sorted(executions) == ["Contracts", "Functions", "Nothing"]
+
+    monkeypatch.setattr(args, "incremental", False)
+    assert incremental_insights == process_files_concurrently(ast_data, src_paths)
+
+
+def test_bundled_templates_match_template_files(project, tmp_path, monkeypatch):
+    ast_data, src_paths = project
+    templates_directory = settings.templates_directories[0]
+    insights = process_files_concurrently(ast_data, src_paths)
+
+    bundle_path = tmp_path / "templates.ebundle"
+    pack_templates(find_template_files([templates_directory]), bundle_path)
+    monkeypatch.setattr(settings, "templates_directories", [bundle_path])
+    bundled_insights = process_files_concurrently(ast_data, src_paths)
+
+    def by_name(insight):
+        return insight["name"]
+
+    assert sorted(bundled_insights, key=by_name) == sorted(insights, key=by_name)
+
+
+def test_pipelined_analysis_matches_sequential(project, tmp_path, monkeypatch):
+    ast_data, src_paths = project
+    (tmp_path / "B.sol").write_text("contract B {}\n")
+    ast_data.append(
+        {
+            "id": 4,
+            "nodeType": "SourceUnit",
+            "src": "0:14:1",
+            "nodes": [{"id": 5, "nodeType": "ContractDefinition", "src": "0:13:1"}],
+        }
+    )
+    src_paths = src_paths + ["B.sol"]
+    (settings.templates_directories[0] / "units.yaml").write_text(
+        'name: "Units"\nseverity: "Medium"\nscope: "file"\npython: |\n'
+        "    results = list(ast_data)\n"
+    )
+    ast_json_path = tmp_path / "ast.json"
+    ast_json_path.write_text(
+        json.dumps(
+            {
+                "sources": {
+                    src_path: {"id": index, "ast": unit}
+                    for index, (src_path, unit) in enumerate(zip(src_paths, ast_data))
+                }
+            }
+        )
+    )
+
+    def by_name(insight):
+        return insight["name"]
+
+    insights = sorted(process_files_concurrently(ast_data, src_paths), key=by_name)
+
+    # Each source unit is indexed once, as it's decoded
+    indexed = []
+    build_index = AnalysisContext._build_index
+
+    def record_index(context):
+        indexed.append(context.ast_data)
+        build_index(context)
+
+    monkeypatch.setattr(AnalysisContext, "_build_index", record_index)
+    source_units = SourceUnitStream(str(ast_json_path))
+    pipelined_insights = sorted(process_files_pipelined(source_units), key=by_name)
+    assert sorted(len(indexed_ast_data) for indexed_ast_data in indexed) == [1, 1]
+    assert source_units.src_paths == src_paths
+    assert pipelined_insights == insights
+    assert [len(insight["results"]) for insight in insights] == [2, 1, 2]
+
+
+def test_templates_run_in_isolated_namespaces(project, tmp_path):
+    ast_data, src_paths = project
+    template_path = tmp_path / "shadowing.yaml"
+    template_path.write_text(
+        'name: "Shadowing"\npython: |\n'
+        "    args = None\n"
+        "    def is_function(node):\n"
+        "        return node.get('nodeType') == 'FunctionDefinition'\n"
+        "    def functions(nodes):\n"
+        "        return [node for node in nodes if is_function(node)]\n"
+        "    results = functions(get_nodes_by_types(ast_data, 'FunctionDefinition'))\n"
+    )
+
+    for _ in range(2):
+        insight = process_yaml(str(template_path), ast_data, src_paths)
+        assert len(insight["results"]) == 1
+    assert yaml_parser.args is args
+    assert "is_function" not in vars(yaml_parser)
+    assert "is_function" not in yaml_parser.get_template_globals()
+
+
+def test_thread_pool_uses_every_core_without_the_gil(monkeypatch):
+    monkeypatch.setattr(yaml_parser, "get_cpu_count", lambda: 3)
+
+    monkeypatch.setattr(sys, "_is_gil_enabled", lambda: False, raising=False)
+    with yaml_parser.create_thread_pool() as executor:
+        assert executor._max_workers == 3
+
+    monkeypatch.setattr(sys, "_is_gil_enabled", lambda: True, raising=False)
+    with yaml_parser.create_thread_pool() as executor:
+        assert (
+            executor._max_workers
+            == concurrent.futures.ThreadPoolExecutor()._max_workers
+        )
+
+    # Dumped profiles are taken one template at a time
+    monkeypatch.setattr(args, "profile_dump", True)
+    with yaml_parser.create_thread_pool() as executor:
+        assert executor._max_workers == 1
+
+
+def test_generator_templates_stop_at_the_findings_limit(project, tmp_path, monkeypatch):
+    ast_data, src_paths = project
+    template_path = tmp_path / "endless.yaml"
+    template_path.write_text(
+        'name: "Endless"\nseverity: "Low"\npython: |\n'
+        "    function = get_nodes_by_types(ast_data, 'FunctionDefinition')[0]\n"
+        "    while True:\n"
+        "        yield function\n"
+    )
+    monkeypatch.setattr(args, "max_findings_per_template", 3)
+
+    insight = process_yaml(str(template_path), ast_data, src_paths)
+    assert [result["lines"] for result in insight["results"]] == [
+        "Line 2 Columns 5-27"
+    ] * 3
+
+
+def test_fail_fast_stops_the_run(project, monkeypatch):
+    ast_data, src_paths = project
+    templates_directory = settings.templates_directories[0]
+    (templates_directory / "nothing.yaml").write_text(
+        'name: "Endless"\nseverity: "High"\npython: |\n'
+        "    while True:\n"
+        "        yield ast_data[0]\n"
+    )
+    monkeypatch.setattr(args, "fail_fast_on", "high")
+
+    insights = process_files_concurrently(ast_data, src_paths)
+    assert any(
+        insight["name"] == "Endless" and len(insight["results"]) == 1
+        for insight in insights
+    )
+    assert yaml_parser._stop_run.is_set()
+
+    monkeypatch.setattr(args, "fail_fast_on", None)
+    monkeypatch.setattr(args, "max_findings_per_template", 2)
+    insights = process_files_concurrently(ast_data, src_paths)
+    assert len(insights) == 3
+    assert not yaml_parser._stop_run.is_set()
+
+
+def test_fail_fast_keeps_findings_of_running_budgeted_templates(project, monkeypatch):
+    ast_data, src_paths = project
+    templates_directory = settings.templates_directories[0]
+    (templates_directory / "fast.yaml").write_text(
+        'name: "Fast"\nseverity: "High"\ntimeout: 30\npython: |\n'
+        "    results = list(ast_data)\n"
+    )
+    (templates_directory / "slow.yaml").write_text(
+        'name: "Slow"\nseverity: "Low"\ntimeout: 30\npython: |\n'
+        "    import time\n"
+        "    time.sleep(0.5)\n"
+        "    results = list(ast_data)\n"
+    )
+    monkeypatch.setattr(args, "jobs", 2)
+    monkeypatch.setattr(args, "fail_fast_on", "high")
+
+    insights = process_files_concurrently(ast_data, src_paths)
+    # Templates of the pool, running alongside, may or may not report before the stop
+    assert {"Fast", "Slow"} <= {insight["name"] for insight in insights}
+    assert yaml_parser._stop_run.is_set()
+
+
+def test_budgeted_templates_run_alongside_the_pool(project, tmp_path, monkeypatch):
+    ast_data, src_paths = project
+    templates_directory = settings.templates_directories[0]
+    # Each template only reports once it sees the other one started, which can't
+    # happen if they run one after the other
+    for name, other_name, timeout in [
+        ("budgeted", "unbudgeted", "timeout: 60\n"),
+        ("unbudgeted", "budgeted", ""),
+    ]:
+        (templates_directory / f"{name}.yaml").write_text(
+            f'name: "{name}"\nseverity: "Low"\n{timeout}python: |\n'
+            "    import os, time\n"
+            "    results = []\n"
+            f"    open({str(tmp_path / name)!r}, 'w').close()\n"
+            "    deadline = time.monotonic() + 20\n"
+            f"    while not os.path.exists({str(tmp_path / other_name)!r}):\n"
+            "        if time.monotonic() > deadline:\n"
+            "            break\n"
+            "        time.sleep(0.01)\n"
+            f"    if os.path.exists({str(tmp_path / other_name)!r}):\n"
+            "        results = list(ast_data)\n"
+        )
+
+    for jobs in [None, 2]:
+        monkeypatch.setattr(args, "jobs", jobs)
+        for name in ["budgeted", "unbudgeted"]:
+            (tmp_path / name).unlink(missing_ok=True)
+        insights = process_files_concurrently(ast_data, src_paths)
+        assert {"budgeted", "unbudgeted"} <= {insight["name"] for insight in insights}
+
+
+def test_unselected_templates_are_not_compiled(project, monkeypatch):
+    ast_data, src_paths = project
+    (settings.templates_directories[0] / "nothing.yaml").write_text(
+        'name: "Nothing"\nseverity: "High"\ntags: ["Fast"]\npython: |\n'
+        "    results = list(ast_data)\n"
+    )
+    compiled = []
+    compile_template = template_cache.compile_template
+
+    def record_compilation(template):
+        compiled.append(template["metadata"]["name"])
+        return compile_template(template)
+
+    monkeypatch.setattr(template_cache, "compile_template", record_compilation)
+
+    def selected_names(**options) -> list:
+        for option, value in options.items():
+            monkeypatch.setattr(args, option, value)
+        compiled.clear()
+        insights = process_files_concurrently(ast_data, src_paths)
+        assert sorted(compiled) == sorted(insight["name"] for insight in insights)
+        return sorted(compiled)
+
+    assert selected_names(severities=["medium", "high"]) == ["Functions", "Nothing"]
+    assert selected_names(exclude_templates=["noth*"]) == ["Functions"]
+    assert selected_names(severities=[], exclude_templates=[], tags=["fast"]) == [
+        "Nothing"
+    ]
+    assert selected_names(tags=[], include_templates=["Contr*", "functions"]) == [
+        "Contracts",
+        "Functions",
+    ]
+    assert selected_names(include_templates=[], no=["insights", "low"]) == [
+        "Functions",
+        "Nothing",
+    ]
+
+
+def test_templates_run_longest_first_from_previous_timings(project, monkeypatch):
+    ast_data, src_paths = project
+    templates_directory = settings.templates_directories[0]
+    timings_path = settings.outputs_dir / "template_timings.json"
+    settings.outputs_dir.mkdir()
+    timings_path.write_text(
+        json.dumps(
+            {
+                str(templates_directory / "nothing.yaml"): {"": 5},
+                str(templates_directory / "functions.yaml"): {"": 1},
+            }
+        )
+    )
+    monkeypatch.setattr(
+        yaml_parser,
+        "create_thread_pool",
+        lambda: concurrent.futures.ThreadPoolExecutor(max_workers=1),
+    )
+    executions = []
+    execute_python_code = yaml_parser.execute_python_code
+
+    def record_execution(template_name, *execution_args):
+        executions.append(template_name)
+        return execute_python_code(template_name, *execution_args)
+
+    monkeypatch.setattr(yaml_parser, "execute_python_code", record_execution)
+
+    process_files_concurrently(ast_data, src_paths)
+    # Templates that never ran first, as they may be the longest
+    assert executions == ["Contracts", "Nothing", "Functions"]
+
+    timings = json.loads(timings_path.read_text())
+    assert sorted(timings) == sorted(
+        str(templates_directory / f"{name}.yaml")
+        for name in ["contracts", "functions", "nothing"]
+    )
+    assert all(
+        list(template_timings) == [""] and template_timings[""] < 5
+        for template_timings in timings.values()
+    )
+
+
+def test_heavy_contract_scoped_templates_split_per_contract(
+    project, tmp_path, monkeypatch
+):
+    ast_data, src_paths = project
+    (tmp_path / "A.sol").write_text(
+        "contract A {\n    function f() public {}\n}\ncontract C {}\n"
+    )
+    ast_data[0]["src"] = "0:56:0"
+    ast_data[0]["nodes"].append(
+        {"id": 4, "nodeType": "ContractDefinition", "src": "42:13:0", "nodes": []}
+    )
+    template_path = settings.templates_directories[0] / "per_contract.yaml"
+    template_path.write_text(
+        'name: "Per contract"\nseverity: "Low"\nscope: "contract"\npython: |\n'
+        "    functions = get_nodes_by_types(ast_data, 'FunctionDefinition')\n"
+        "    assert len(ast_data) == 1\n"
+        "    assert len(facts.function_modifiers) == len(functions)\n"
+        "    results = list(ast_data) + functions\n"
+    )
+    monkeypatch.setattr(yaml_parser, "is_free_threaded", lambda: True)
+    monkeypatch.setattr(yaml_parser, "get_cpu_count", lambda: 2)
+    monkeypatch.setattr(args, "split_heavy_templates", True)
+    executions = []
+    process_yaml = yaml_parser.process_yaml
+
+    def record_execution(file_path, *execution_args):
+        if file_path == str(template_path):
+            executions.append(execution_args[4:])
+        return process_yaml(file_path, *execution_args)
+
+    monkeypatch.setattr(yaml_parser, "process_yaml", record_execution)
+
+    def per_contract_lines() -> list:
+        insights = process_files_concurrently(ast_data, src_paths)
+        insight = next(
+            insight for insight in insights if insight["name"] == "Per contract"
+        )
+        return [result["lines"] for result in insight["results"]]
+
+    expected_lines = per_contract_lines()
+    assert expected_lines == [
+        "Line 1 Columns 1-13",
+        "Line 2 Columns 5-27",
+        "Line 4 Columns 1-14",
+    ]
+    assert executions == [(0,)]
+
+    timings_path = settings.outputs_dir / "template_timings.json"
+    timings = json.loads(timings_path.read_text())
+    timings[str(template_path)]["0"] = 10
+    timings_path.write_text(json.dumps(timings))
+    executions.clear()
+    assert per_contract_lines() == expected_lines
+    assert sorted(executions) == [(0, 0), (0, 1)]
+    assert json.loads(timings_path.read_text())[str(template_path)]["0"] < 10